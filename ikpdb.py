@@ -25,10 +25,17 @@ import Queue
 import types
 import argparse
 import datetime
+import time
 import cStringIO
-import ctypes
 import iksettrace
 import cgi
+import dis
+import fnmatch
+import itertools
+import array
+import collections
+import struct
+import weakref
 
 # For now ikpdb is a singleton
 ikpdb = None 
@@ -188,6 +195,101 @@ _logger = IKPdbLogger
 class IKPdbConnectionError(Exception):
     pass
 
+class IKMessagePack(object):
+    """ A minimal MessagePack (see https://msgpack.org) encoder and decoder 
+    used for the 'msgpack' encoding of messages. Supports None, bool, int, 
+    long, float, str, unicode, list, tuple and dict.
+    
+    utf8 encoded str and unicode are packed as MessagePack str, other str as
+    MessagePack bin. Like json, unpacked str are unicode (and bin are str).
+    """
+    UNPACK_FORMATS = {  # struct format and size indexed by type byte
+        0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+        0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+        0xca: ('>f', 4), 0xcb: ('>d', 8),
+    }
+    
+    def pack(self, obj):
+        """ :return: obj packed as a str. Unsupported objects and integers 
+                 out of MessagePack range are packed as their repr().
+        :raises ValueError: if obj is too large or too deep.
+        
+        Packing is done by iksettrace as large messages (eg. 'programBreak')
+        must be encoded faster than json does.
+        """
+        return iksettrace._msgpack_pack(obj)
+
+    def unpack(self, data):
+        """ :return: the object packed in data (a str). 
+        :raises ValueError: if data is not a valid MessagePack.
+        """
+        try:
+            obj, idx = self._unpack(data, 0)
+        except (IndexError, struct.error) as exc:
+            raise ValueError("Truncated MessagePack: %s" % exc)
+        if idx != len(data):
+            raise ValueError("Extra data after MessagePack at %s" % idx)
+        return obj
+
+    def _unpack(self, data, idx):
+        """ :return: a tuple (object, index of next object). """
+        type_byte = ord(data[idx])
+        idx += 1
+        if type_byte <= 0x7f:
+            return type_byte, idx
+        elif type_byte >= 0xe0:
+            return type_byte - 0x100, idx
+        elif type_byte in self.UNPACK_FORMATS:
+            fmt, size = self.UNPACK_FORMATS[type_byte]
+            return struct.unpack_from(fmt, data, idx)[0], idx + size
+        elif type_byte == 0xc0:
+            return None, idx
+        elif type_byte == 0xc2:
+            return False, idx
+        elif type_byte == 0xc3:
+            return True, idx
+        
+        # containers
+        if 0xa0 <= type_byte <= 0xbf:
+            kind, length = 'str', type_byte & 0x1f
+        elif 0x90 <= type_byte <= 0x9f:
+            kind, length = 'array', type_byte & 0x0f
+        elif 0x80 <= type_byte <= 0x8f:
+            kind, length = 'map', type_byte & 0x0f
+        else:
+            try:
+                kind, fmt, size = {
+                    0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+                    0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+                    0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4),
+                    0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4),
+                }[type_byte]
+            except KeyError:
+                raise ValueError("Unsupported MessagePack type: 0x%x" % type_byte)
+            length = struct.unpack_from(fmt, data, idx)[0]
+            idx += size
+        
+        if kind in ('str', 'bin',):
+            if idx + length > len(data):
+                raise IndexError("str or bin out of data")
+            value = data[idx:idx + length]
+            if kind == 'str':
+                value = value.decode('utf8')
+            return value, idx + length
+        elif kind == 'array':
+            array_value = []
+            for i in xrange(length):
+                item, idx = self._unpack(data, idx)
+                array_value.append(item)
+            return array_value, idx
+        else:
+            map_value = {}
+            for i in xrange(length):
+                key, idx = self._unpack(data, idx)
+                map_value[key], idx = self._unpack(data, idx)
+            return map_value, idx
+
+
 class IKPdbConnectionHandler(object):
     """ IKPdbConnectionHandler manages a connection with a remote client once
     it is established.
@@ -196,30 +298,80 @@ class IKPdbConnectionHandler(object):
     
     ``length={{integer length of json_message_body below}}{{MAGIC_CODE}}{{json_dump_of_message_body}}``
     
+    where length is the count of bytes of the utf8 encoded json message body.
+    
+    Once client has switched to 'msgpack' encoding (see `set_encoding()`), 
+    messages are MessagePack bodies (see :class:`IKMessagePack`) prefixed by
+    their length as a 4 bytes big endian unsigned integer.
+    
     This class contains methods to receive, send and reply to such messages.
     """
     MAGIC_CODE = "LLADpcdtbdpac"
     MESSAGE_TEMPLATE = "length=%%s%s%%s" % MAGIC_CODE
+    LENGTH_HEADER = "length="
     
-    SOCKET_BUFFER_SIZE = 4096  # Maximum size of a packet received from client
-    MSG_WAITALL = 0x100  # From Linux sys/socket.h
+    ENCODINGS = ('json', 'msgpack',)  # 'json' is the default
+    BINARY_LENGTH_PREFIX = struct.Struct('>I')
+    
+    SOCKET_BUFFER_SIZE = 4096  # Initial size of the receive buffer
+    MAX_MESSAGE_LENGTH = 64 * 1024 * 1024  # Longer messages are discarded
     CMD_LOOP_SOCKET_TIMEOUT = 0.3
     
     def __init__(self, connection):
         self._connection = connection
-        self._connection_lock = threading.Lock()
-        self._received_data = ''
+        self._connection_lock = threading.RLock()
+        self.encoding = 'json'
+        self._message_pack = IKMessagePack()
+        
+        # Received bytes are read into _received_data at _received_end. 
+        # Bytes before _received_start have already been parsed. 
+        # _message_length is the byte length of the message body being 
+        # received once it's header has been parsed. _discard_length is the
+        # count of bytes of a too long message body that are still to be 
+        # discarded.
+        self._received_data = bytearray(self.SOCKET_BUFFER_SIZE)
+        self._received_view = memoryview(self._received_data)
+        self._received_start = 0
+        self._received_end = 0
+        self._header_scan_idx = 0
+        self._message_length = None
+        self._discard_length = 0
+        
         self._network_loop = True
         self._connection.settimeout(self.CMD_LOOP_SOCKET_TIMEOUT)
 
     def encode(self, obj):
+        if self.encoding == 'msgpack':
+            message_body = self._message_pack.pack(obj)
+            return self.BINARY_LENGTH_PREFIX.pack(len(message_body)) + message_body
         json_obj = json.dumps(obj)
         return self.MESSAGE_TEMPLATE % (len(json_obj), json_obj,)
 
-    def decode(self, message):
-        json_obj = message.split(self.MAGIC_CODE)[1]
-        obj = json.loads(json_obj)
+    def decode(self, message_body):
+        """ :param message_body: utf8 encoded json message body or a 
+                                 MessagePack depending on `encoding`.
+        """
+        if self.encoding == 'msgpack':
+            return self._message_pack.unpack(message_body)
+        obj = json.loads(message_body.decode('utf8'))
         return obj
+
+    def set_encoding(self, obj, encoding, result=None):
+        """ Replies to a client's command (eg. `setEncoding`) then switches 
+        to encoding. Reply is encoded with current encoding, all following 
+        messages (in both directions) use the new one.
+        
+        :param encoding: one of `ENCODINGS`.
+        :param result: result of the reply, default to {'encoding': encoding}.
+        """
+        with self._connection_lock:
+            if encoding not in self.ENCODINGS:
+                self.reply(obj, {'encoding': self.encoding},
+                           command_exec_status='error',
+                           error_messages=["Unsupported encoding: '%s'" % encoding])
+                return
+            self.reply(obj, result if result is not None else {'encoding': encoding})
+            self.encoding = encoding
         
     def log_sent(self, msg):
         _logger.n_debug("Sent %s bytes >>>%s<<<", len(msg), msg)
@@ -229,7 +381,7 @@ class IKPdbConnectionHandler(object):
     
     def send(self, command, _id=None, result={}, frames=[], threads=None,
              error_messages=[], warning_messages=[], info_messages=[],
-             exception=None):
+             exception=None, objects=None):
         """ Build a message from parameters and send it to debugger.
         
         :param command: The command sent to the debugger client.
@@ -262,6 +414,10 @@ class IKPdbConnectionHandler(object):
         :param exception: If debugger encounter an exception, this dict contains
                           2 keys: `type` and `info` (the later is the message).
         :type exception: dict
+
+        :param objects: objects referenced by `frames` indexed by handle when 
+                        objects are interned (see `IKPdb.intern_variables()`).
+        :type objects: dict
         """
         with self._connection_lock:
             payload = {
@@ -277,6 +433,8 @@ class IKPdbConnectionHandler(object):
             }
             if threads:
                 payload['threads'] = threads
+            if objects is not None:
+                payload['objects'] = objects
             msg = self.encode(payload)
             if self._connection:
                 send_bytes_count = self._connection.sendall(msg)
@@ -314,17 +472,21 @@ class IKPdbConnectionHandler(object):
         """
         # with self._connection_lock:
         while self._network_loop:
-            _logger.n_debug("Enter socket.recv(%s) with self._received_data = %s", 
-                            self.SOCKET_BUFFER_SIZE, 
-                            self._received_data)
+            # We may land here with a full message already received
+            # In that case we must not enter recv()
+            message_body = self.parse_message()
+            if message_body is not None:
+                break
+            
+            receive_view = self.get_receive_view()
+            _logger.n_debug("Enter socket.recv_into(%s) with %s bytes received", 
+                            len(receive_view),
+                            self._received_end - self._received_start)
             try:
-                # We may land here with a full packet already in self.received_data
-                # In that case we must not enter recv() 
-                if self.SOCKET_BUFFER_SIZE:
-                    data = self._connection.recv(self.SOCKET_BUFFER_SIZE)
-                else:
-                    data = '' 
-                _logger.n_debug("socket.recv(%s) => %s", self.SOCKET_BUFFER_SIZE, data)
+                received_count = self._connection.recv_into(receive_view)
+                _logger.n_debug("socket.recv_into(%s) => %s", 
+                                len(receive_view), 
+                                received_count)
             except socket.timeout:
                 _logger.n_debug("socket.timeout witk ikpdb.status=%s", ikpdb.status)
                 if ikpdb.status == 'terminated':
@@ -354,39 +516,122 @@ class IKPdbConnectionHandler(object):
                         "message": exc.message
                     }
                 }
+            self._received_end += received_count
 
-            # received data is utf8 encoded
-            self._received_data += data.decode('utf8')
+        self.log_received(message_body)
+        try:
+            obj = self.decode(message_body)
+        except ValueError as exc:
+            _logger.n_error("Dropped received message that can't be decoded: %s", exc)
+            return self.receive(ikpdb)
+        return obj
 
+    def parse_message(self):
+        """ Parses received bytes. Message header is scanned only once and 
+        message body is copied only once it has been completely received.
+        
+        :return: the next complete message body (utf8 encoded bytes) or None.
+        """
+        if self._discard_length:
+            discarded_count = min(self._discard_length, 
+                                  self._received_end - self._received_start)
+            self._discard_length -= discarded_count
+            self.consume_received_data(self._received_start + discarded_count)
+            if self._discard_length:
+                return None
+        
+        if self._message_length is None and self.encoding == 'msgpack':
+            prefix_size = self.BINARY_LENGTH_PREFIX.size
+            if self._received_end - self._received_start < prefix_size:
+                return None
+            if self._received_data.startswith(self.LENGTH_HEADER[:prefix_size], 
+                                              self._received_start):
+                # A json message (eg. from a new client) whose header would
+                # be read as a length above MAX_MESSAGE_LENGTH.
+                _logger.n_info("Received a json message, switching back to "
+                               "json encoding.")
+                with self._connection_lock:
+                    self.encoding = 'json'
+            else:
+                self._message_length = self.BINARY_LENGTH_PREFIX.unpack_from(self._received_data,
+                                                                             self._received_start)[0]
+                self._received_start += prefix_size
+        
+        if self._message_length is None:
             # have we received a MAGIC_CODE
-            try:
-                magic_code_idx = self._received_data.index(self.MAGIC_CODE)
-            except ValueError:
-                continue
+            magic_code_idx = self._received_data.find(self.MAGIC_CODE, 
+                                                      self._header_scan_idx,
+                                                      self._received_end)
+            if magic_code_idx < 0:
+                # MAGIC_CODE may be split between 2 reads
+                self._header_scan_idx = max(self._received_start, 
+                                            self._received_end - len(self.MAGIC_CODE) + 1)
+                return None
             
             # Have we received a 'length='
+            length_idx = self._received_data.find(self.LENGTH_HEADER, 
+                                                  self._received_start,
+                                                  magic_code_idx)
+            body_idx = magic_code_idx + len(self.MAGIC_CODE)
             try:
-                length_idx = self._received_data.index('length=')
-            except ValueError:
-                continue
-            
-            # extract length content from received data
-            json_length = int(self._received_data[length_idx + 7:magic_code_idx])
-            message_length = magic_code_idx + len(self.MAGIC_CODE) + json_length
-            if message_length <= len(self._received_data):
-                full_message = self._received_data[:message_length]
-                self._received_data = self._received_data[message_length:]
-                if len(self._received_data) > 0:
-                    self.SOCKET_BUFFER_SIZE = 0
-                else:
-                    self.SOCKET_BUFFER_SIZE = 4096
-                break
+                if length_idx < 0:
+                    raise ValueError("no '%s' header" % self.LENGTH_HEADER)
+                self._message_length = int(str(self._received_data[length_idx + len(self.LENGTH_HEADER):
+                                                                   magic_code_idx]))
+            except ValueError as exc:
+                _logger.n_error("Dropped received message with invalid header: %s", exc)
+                self.consume_received_data(body_idx)
+                return None
+            self._received_start = body_idx
+        
+        if self._message_length > self.MAX_MESSAGE_LENGTH:
+            _logger.n_error("Discarding received message as it's length (%s "
+                            "bytes) exceeds %s bytes.", 
+                            self._message_length, 
+                            self.MAX_MESSAGE_LENGTH)
+            self._discard_length = self._message_length
+            self._message_length = None
+            return self.parse_message()
+        
+        body_end = self._received_start + self._message_length
+        if body_end > self._received_end:
+            return None
+        message_body = self._received_view[self._received_start:body_end].tobytes()
+        self._message_length = None
+        self.consume_received_data(body_end)
+        return message_body
+
+    def consume_received_data(self, idx):
+        """ Marks received bytes up to idx as parsed. """
+        self._received_start = self._header_scan_idx = idx
+        if self._received_start == self._received_end:
+            self._received_start = self._received_end = self._header_scan_idx = 0
+
+    def get_receive_view(self):
+        """ Returns a memoryview on the free space at end of receive buffer.
+        Parsed bytes are dropped when buffer is full and buffer is grown to
+        the size of the message being received (or doubled while message 
+        length is unknown).
+        """
+        buffer_size = len(self._received_data)
+        if self._received_end == buffer_size:
+            received_count = self._received_end - self._received_start
+            if self._message_length is not None:
+                required_size = self._message_length
             else:
-                self.SOCKET_BUFFER_SIZE = message_length - len(self._received_data)
-
-        self.log_received(full_message)
-        obj = self.decode(full_message)
-        return obj
+                required_size = received_count + 1
+            if required_size > buffer_size:
+                buffer_size = max(required_size, buffer_size * 2)
+            if buffer_size != len(self._received_data) or self._received_start:
+                received_data = bytearray(buffer_size)
+                received_data[:received_count] = self._received_view[self._received_start:
+                                                                    self._received_end]
+                self._header_scan_idx -= self._received_start
+                self._received_start = 0
+                self._received_end = received_count
+                self._received_data = received_data
+                self._received_view = memoryview(received_data)
+        return self._received_view[self._received_end:]
         
 
 ##
@@ -397,6 +642,10 @@ class IKPdbQuit(Exception):
     """ A dummy Exception used by debugger to quit debugged program. """
     pass
 
+class IKBreakpointError(Exception):
+    """ Raised when a breakpoint action or it's expressions are invalid. """
+    pass
+
 def IKPdbRepr(t):
     """ A function that returns a type representation suitable for debugger GUI.
     :param t: anyThing
@@ -409,6 +658,297 @@ def IKPdbRepr(t):
         result = "IKPdbReprError"
     return result
 
+class IKBoundedReprOverflow(Exception):
+    """ Raised by IKBoundedRepr when representation exceeds max_length. """
+    pass
+
+class IKBoundedRepr(object):
+    """ A size bounded repr(). Representation of str, unicode, list, tuple,
+    dict, set and frozenset (and of their subclasses that keep their repr() 
+    or use the one of OrderedDict, defaultdict or namedtuple) is built 
+    piece by piece and building stops as soon as it exceeds `max_length` so
+    that a huge value is never fully represented just to be truncated. 
+    Containers are represented up to `max_level` nesting levels (deeper ones
+    are represented as '[...]') and, as each item takes at least one 
+    character, the length limit caps the number of items visited. Other 
+    objects are represented using repr(), truncated.
+    
+    Representation is a prefix of repr(). It is longer than max_length 
+    only if it has been truncated, so callers keep on checking length to 
+    add their truncation marker.
+    
+    :param max_length: length after which representation is truncated.
+    :type max_length: int
+    
+    :param max_level: maximum nesting level of containers.
+    :type max_level: int
+    """
+    CONTAINERS_DELIMITERS = {
+        types.ListType: ('[', ']'),
+        types.TupleType: ('(', ')'),
+        types.DictType: ('{', '}'),
+        set: ('set([', '])'),
+        frozenset: ('frozenset([', '])'),
+    }
+    BOUNDED_TYPES = (types.StringType, types.UnicodeType, types.ListType, 
+                     types.TupleType, types.DictType, set, frozenset,)
+
+    def __init__(self, max_length, max_level=6):
+        self.max_length = max_length
+        self.max_level = max_level
+        self._pieces = []
+        self._length = 0
+        self._running = set()  # id of containers being represented
+
+    def repr(self, obj):
+        """ :return: representation of obj, truncated just after 
+                     `max_length`.
+        """
+        self._pieces = []
+        self._length = 0
+        self._running = set()
+        try:
+            self._repr(obj, 0)
+        except IKBoundedReprOverflow:
+            pass
+        return ''.join(self._pieces)
+
+    def _write(self, piece):
+        self._pieces.append(piece[:self.max_length - self._length + 1])
+        self._length += len(piece)
+        if self._length > self.max_length:
+            raise IKBoundedReprOverflow()
+
+    def _repr_format(self, obj):
+        """ :return: a tuple (opening, closing, items_format) describing how
+                     repr() represents obj or None if obj is not bounded. 
+                     items_format is one of 'string', 'value' (list, tuple,
+                     set), 'key_value' (dict), 'pair' (OrderedDict) or 
+                     'field' (namedtuple).
+        """
+        obj_type = type(obj)
+        if obj_type in (types.StringType, types.UnicodeType):
+            return None, None, 'string'
+        if obj_type in self.CONTAINERS_DELIMITERS:
+            opening, closing = self.CONTAINERS_DELIMITERS[obj_type]
+            return opening, closing, 'key_value' if obj_type is types.DictType else 'value'
+        if not isinstance(obj, self.BOUNDED_TYPES):
+            return None
+        
+        # a subclass, dispatched on it's __repr__
+        type_repr = getattr(obj_type, '__repr__', None)
+        base_type = next((t for t in self.BOUNDED_TYPES if type_repr is t.__repr__), None)
+        if base_type in (types.StringType, types.UnicodeType):
+            return None, None, 'string'
+        if base_type in (set, frozenset):
+            return obj_type.__name__ + '([', '])', 'value'
+        if base_type is not None:
+            opening, closing = self.CONTAINERS_DELIMITERS[base_type]
+            return opening, closing, 'key_value' if base_type is types.DictType else 'value'
+        if type_repr is collections.defaultdict.__repr__:
+            return 'defaultdict(%r, {' % (obj.default_factory,), '})', 'key_value'
+        repr_function = getattr(type_repr, '__func__', None)
+        if repr_function is collections.OrderedDict.__repr__.__func__:
+            if not obj:
+                return obj_type.__name__ + '(', ')', 'pair'
+            return obj_type.__name__ + '([', '])', 'pair'
+        # namedtuple() defines __repr__ in a 'namedtuple_<typename>' module
+        module_name = getattr(repr_function, 'func_globals', {}).get('__name__', '')
+        if (isinstance(obj, types.TupleType) and hasattr(obj_type, '_fields')
+                and module_name.startswith('namedtuple_')):
+            return module_name[len('namedtuple_'):] + '(', ')', 'field'
+        return None
+
+    def _repr(self, obj, level):
+        repr_format = self._repr_format(obj)
+        if repr_format is None:
+            self._write(repr(obj))
+            return
+        opening, closing, items_format = repr_format
+        if items_format == 'string':
+            # represent just what we need
+            self._write(repr(obj[:self.max_length - self._length + 1]))
+            return
+        if level >= self.max_level or id(obj) in self._running:
+            self._write(opening + '...' + closing)
+            return
+        self._running.add(id(obj))
+        self._write(opening)
+        if items_format in ('key_value', 'pair',):
+            for idx, (key, value) in enumerate(obj.iteritems()):
+                if idx:
+                    self._write(', ')
+                if items_format == 'pair':
+                    self._write('(')
+                self._repr(key, level + 1)
+                self._write(': ' if items_format == 'key_value' else ', ')
+                self._repr(value, level + 1)
+                if items_format == 'pair':
+                    self._write(')')
+        elif items_format == 'field':
+            for idx, (name, value) in enumerate(zip(obj._fields, obj)):
+                if idx:
+                    self._write(', ')
+                self._write(name + '=')
+                self._repr(value, level + 1)
+        else:
+            for idx, value in enumerate(obj):
+                if idx:
+                    self._write(', ')
+                self._repr(value, level + 1)
+            if isinstance(obj, types.TupleType) and len(obj) == 1:
+                self._write(',')
+        self._write(closing)
+        self._running.discard(id(obj))
+
+
+class IKArraySummarizer(object):
+    """ Summarizes array-like objects (eg. NumPy arrays, pandas Series and 
+    DataFrames, array.array, bytearray, memoryview) whose repr is slow and 
+    useless once truncated. Objects are recognized by duck typing on their 
+    type (so IKPdb does not depend on NumPy) as:
+    
+    - 'ndarray': types with `shape`, `dtype` and `nbytes` attributes,
+    - 'dataframe': types with `shape`, `dtypes` and `columns` attributes,
+    - 'buffer': array.array, bytearray and memoryview.
+    
+    Summary contains shape, dtype, size in bytes and min, max and mean
+    computed on the first `sample_size` elements.
+    
+    :param sample_size: number of elements used to compute statistics.
+    :type sample_size: int
+    
+    :param max_slice_size: maximum number of elements returned by 
+                           `get_slice()`.
+    :type max_slice_size: int
+    """
+    BUFFER_TYPES = (array.array, bytearray, memoryview,)
+    NOT_ARRAY_TYPES = (types.NoneType, types.BooleanType, types.IntType, 
+                       types.LongType, types.FloatType, types.StringType, 
+                       types.UnicodeType, types.DictType, types.ListType, 
+                       types.TupleType, set, frozenset, types.ModuleType, 
+                       types.MethodType, types.FunctionType,)
+
+    def __init__(self, sample_size=1000, max_slice_size=1000):
+        self.sample_size = sample_size
+        self.max_slice_size = max_slice_size
+        self._kinds_cache = {}  # array kind or None indexed by type
+
+    def array_kind(self, obj):
+        """ :return: 'ndarray', 'dataframe', 'buffer' or None if obj is not
+                     array-like.
+        """
+        obj_type = type(obj)
+        if obj_type in self.NOT_ARRAY_TYPES:
+            return None
+        try:
+            return self._kinds_cache[obj_type]
+        except KeyError:
+            pass
+        # attributes are looked up on type to avoid any instance side effect
+        if issubclass(obj_type, self.BUFFER_TYPES):
+            kind = 'buffer'
+        elif all(hasattr(obj_type, a) for a in ('shape', 'dtype', 'nbytes',)):
+            kind = 'ndarray'
+        elif all(hasattr(obj_type, a) for a in ('shape', 'dtypes', 'columns',)):
+            kind = 'dataframe'
+        else:
+            kind = None
+        self._kinds_cache[obj_type] = kind
+        return kind
+
+    def summarize(self, obj):
+        """ :return: a summary of obj as a string or None if obj is not 
+                     array-like.
+        """
+        kind = self.array_kind(obj)
+        if kind is None:
+            return None
+        try:
+            if kind == 'ndarray':
+                summary = "shape=%s dtype=%s nbytes=%s" % (self.shape_repr(obj.shape), 
+                                                           obj.dtype,
+                                                           obj.nbytes,)
+                sample = obj.flat if hasattr(obj, 'flat') else iter(obj)
+            elif kind == 'dataframe':
+                return "shape=%s columns=%s nbytes=%s" % (
+                    self.shape_repr(obj.shape),
+                    IKBoundedRepr(128).repr(list(itertools.islice(obj.columns, 32))),
+                    obj.memory_usage(index=True).sum(),)
+            else:
+                view = obj if isinstance(obj, memoryview) else memoryview(obj) \
+                       if isinstance(obj, bytearray) else None
+                if view is not None:
+                    summary = "shape=%s format=%s nbytes=%s" % (
+                        self.shape_repr(view.shape), view.format, len(view) * view.itemsize,)
+                    sample = view[:self.sample_size].tolist()
+                else:  # array.array
+                    summary = "shape=(%s,) typecode=%s nbytes=%s" % (
+                        len(obj), obj.typecode, len(obj) * obj.itemsize,)
+                    sample = iter(obj)
+        except Exception:
+            return None
+        return summary + self.sample_stats(sample)
+        
+    def shape_repr(self, shape):
+        return repr(tuple(int(dim) for dim in shape))
+
+    def sample_stats(self, sample):
+        """ :return: min, max and mean of the first `sample_size` values of 
+                     sample iterable as a string ('' if values are not 
+                     numbers).
+        """
+        count = 0
+        total = 0.0
+        min_value = max_value = None
+        try:
+            for value in itertools.islice(sample, self.sample_size):
+                value = float(value)
+                total += value
+                min_value = value if min_value is None else min(min_value, value)
+                max_value = value if max_value is None else max(max_value, value)
+                count += 1
+        except Exception:
+            return ''
+        if not count:
+            return ''
+        return " min=%r max=%r mean=%r (first %s)" % (min_value, max_value, 
+                                                      total / count, count,)
+
+    def get_slice(self, obj, start, stop):
+        """ Returns elements start to stop (along first axis, at most 
+        `max_slice_size`) of an array-like object as a list. Buffers are 
+        sliced using memoryview so only returned elements are copied.
+
+        :raises TypeError: if obj is not array-like.
+        """
+        kind = self.array_kind(obj)
+        if kind is None:
+            raise TypeError("%s is not an array." % IKPdbRepr(obj))
+        stop = min(stop, start + self.max_slice_size)
+        if kind == 'ndarray':
+            values = obj[start:stop].tolist()
+        elif kind == 'dataframe':
+            values = obj.iloc[start:stop].values.tolist()
+        elif isinstance(obj, (bytearray, memoryview,)):
+            view = obj if isinstance(obj, memoryview) else memoryview(obj)
+            values = view[start:stop].tolist()
+        else:
+            values = obj[start:stop].tolist()
+        return self.jsonable(values)
+
+    def jsonable(self, value):
+        """ Convert elements of value that can't be JSON encoded to their 
+        repr.
+        """
+        if isinstance(value, types.ListType):
+            return [self.jsonable(v) for v in value]
+        if value is None or type(value) in (types.BooleanType, types.IntType, 
+                                            types.LongType, types.FloatType,):
+            return value
+        return IKBoundedRepr(128).repr(value)
+
+
 class IKBreakpoint(object):
     """ IKBreakpoint implements and manages IKPdb Breakpoints. 
     
@@ -419,6 +959,17 @@ class IKBreakpoint(object):
     - `line_number`: 1 based
     - `condition`: an optional python expression used to trigger conditional breakpoints.Basically
     - `enabled`: a flag to enable / disable the breakpoint
+    - `ignore_count`: number of hits to ignore before breaking
+    - `every_nth_hit`: if greater than 1, break only every nth hit (after 
+      ignored ones)
+    - `action`: one of `ACTIONS`. 'break' stops debugged program, 'log' 
+      (logpoint) evaluates `expressions` and records the result in 
+      `logpoints_buffer` then execution continues.
+    
+    `condition` is compiled once when it is set so that a SyntaxError is 
+    reported to the client immediately. Each time the line is reached, 
+    `hit_count` is incremented then `ignore_count` and `every_nth_hit` are 
+    checked before `condition` is evaluated.
     
     The debugger manages Breakpoints using 3 lists maintained by IKBreakpoint:
     
@@ -429,6 +980,12 @@ class IKBreakpoint(object):
     This class also maintains a `any_active_breakpoint` boolean class attribute
     that is False when there is no active breakpoint. This flag is used to 
     trigger `TURBO Mode`.
+    
+    iksettrace keeps a native copy of enabled breakpoints lines (built using
+    :func:`IKPdb.native_breakpoints_resolver`) and `code_breakpoints_cache` 
+    records wether a code object contains any enabled breakpoint line (see 
+    :func:`IKPdb.code_has_breakpoint`). Both are flushed by 
+    `invalidate_caches()` each time breakpoints are modified.
      
     :param file_name: a CANONICAL file name.
     :type file_name: str
@@ -443,18 +1000,44 @@ class IKBreakpoint(object):
     :param enabled: a flag to enable / disable the breakpoint.
     :type enabled: bool
         
+    :param ignore_count: number of hits to ignore before breaking.
+    :type ignore_count: int
+        
+    :param every_nth_hit: break only every nth hit (0 or 1 to break on every hit).
+    :type every_nth_hit: int
+
+    :param action: 'break' or 'log'.
+    :type action: str
+
+    :param expressions: python expressions evaluated on each 'log' hit.
+    :type expressions: list of str
+        
+    :raises SyntaxError: if condition cannot be compiled.
+    :raises IKBreakpointError: if action or expressions are invalid.
     """
+    ACTIONS = ('break', 'log',)
+    LOGPOINT_VALUE_MAX_LENGTH = 1024  #: logged values repr are truncated
+
     breakpoints_files = {}  #: list of lines indexed by canonical file names
     breakpoints_by_file_and_line = {}  #: list of breakpoints indexed by (file_name, line)
     breakpoints_by_number = []  #: list of breakpoints indexed by number.
     next_breakpoint_number = 0  #: Used to allocate next breakpoint number.
     any_active_breakpoint = False #: False when there is no active breakpoint.
+    code_breakpoints_cache = weakref.WeakKeyDictionary()  #: True or False indexed by code object.
+    logpoints_buffer = None  #: IKLogpointsBuffer where logpoints hits are recorded
     
-    def __init__(self, file_name, line_number, condition=None, enabled=True):
+    def __init__(self, file_name, line_number, condition=None, enabled=True, 
+                 ignore_count=0, every_nth_hit=0, action='break', 
+                 expressions=None):
+        # compile first so that nothing is registered if condition is invalid
+        self.set_condition(condition)
+        self.set_action(action, expressions)
         self.file_name = file_name    # In canonical form!
         self.line_number = line_number
-        self.condition = condition
         self.enabled = enabled
+        self.hit_count = 0
+        self.ignore_count = ignore_count or 0
+        self.every_nth_hit = every_nth_hit or 0
         
         # Allocate number
         self.number = IKBreakpoint.next_breakpoint_number
@@ -467,6 +1050,100 @@ class IKBreakpoint(object):
             IKBreakpoint.breakpoints_files.get(file_name, [])+[line_number]
         if enabled:
             IKBreakpoint.any_active_breakpoint = True            
+        IKBreakpoint.invalidate_caches()
+
+    @staticmethod
+    def compile_condition(condition):
+        """ :return: compiled condition or None if there is no condition.
+        
+        :raises SyntaxError: (or TypeError, ValueError) if condition cannot 
+                             be compiled.
+        """
+        if condition:
+            return compile(condition, '<breakpoint condition>', 'eval')
+        return None
+
+    @staticmethod
+    def compile_action(action, expressions=None):
+        """ Check action and compile logpoint expressions.
+        
+        :return: a tuple (action, expressions, compiled_expressions) to be
+                 applied using `apply_action()`.
+        :raises IKBreakpointError: if action is unknown or an expression 
+                                   cannot be compiled.
+        """
+        action = action or 'break'
+        if action not in IKBreakpoint.ACTIONS:
+            raise IKBreakpointError("Unknown action '%s'." % action)
+        expressions = list(expressions or [])
+        compiled_expressions = []
+        for expression in expressions:
+            try:
+                compiled_expressions.append(compile(expression, 
+                                                    '<logpoint expression>',
+                                                    'eval'))
+            except Exception as e:
+                raise IKBreakpointError("Invalid expression '%s' (%s: %s)." % (
+                                        expression, e.__class__.__name__, e,))
+        return action, expressions, compiled_expressions
+
+    def set_condition(self, condition):
+        """ Compile and set breakpoint's condition. Breakpoint is left 
+        unchanged if condition is invalid.
+        
+        :raises SyntaxError: (or TypeError, ValueError) if condition cannot 
+                             be compiled.
+        """
+        self.apply_condition(condition, IKBreakpoint.compile_condition(condition))
+
+    def apply_condition(self, condition, compiled_condition):
+        """ Set breakpoint's condition compiled by `compile_condition()`. """
+        self.condition = condition
+        self.compiled_condition = compiled_condition
+
+    def set_action(self, action, expressions=None):
+        """ Set breakpoint's action and compile logpoint expressions. 
+        Breakpoint is left unchanged if action or any expression is invalid.
+        
+        :raises IKBreakpointError: if action is unknown or an expression 
+                                   cannot be compiled.
+        """
+        self.apply_action(IKBreakpoint.compile_action(action, expressions))
+
+    def apply_action(self, compiled_action):
+        """ Set breakpoint's action and expressions checked and compiled by
+        `compile_action()`.
+        """
+        self.action, self.expressions, self.compiled_expressions = compiled_action
+
+    def log_hit(self, frame):
+        """ Evaluate logpoint expressions in frame and record the result in 
+        `logpoints_buffer`. Evaluation errors are logged as values.
+        """
+        values = []
+        for expression, compiled_expression in zip(self.expressions, 
+                                                   self.compiled_expressions):
+            try:
+                value = eval(compiled_expression, frame.f_globals, frame.f_locals)
+                value_repr = IKBoundedRepr(IKBreakpoint.LOGPOINT_VALUE_MAX_LENGTH).repr(value)
+                value_type = IKPdbRepr(value)
+            except Exception as e:
+                value_repr = "%s: %s" % (e.__class__.__name__, e,)
+                value_type = 'IKPdbEvaluationError'
+            if len(value_repr) > IKBreakpoint.LOGPOINT_VALUE_MAX_LENGTH:
+                value_repr = value_repr[:IKBreakpoint.LOGPOINT_VALUE_MAX_LENGTH]+'...'
+            values.append({'expression': expression,
+                           'value': value_repr, 
+                           'type': value_type})
+        current_thread = threading.currentThread()
+        IKBreakpoint.logpoints_buffer.append({
+            'breakpoint_number': self.number,
+            'hit_count': self.hit_count,
+            'timestamp': time.time(),
+            'thread_ident': current_thread.ident,
+            'thread_name': current_thread.name,
+            'values': values,
+        })
 
     def clear(self):
         """ Clear a breakpoint by removing it from all lists.
@@ -481,14 +1158,28 @@ class IKBreakpoint(object):
     @classmethod
     def update_active_breakpoint_flag(cls):
         """ Checks all breakpoints to find wether at least one is active and 
-        update `any_active_breakpoint` accordingly.
+        update `any_active_breakpoint` accordingly. Also flushes breakpoints
+        caches.
         """
         cls.any_active_breakpoint=any([bp.enabled for bp in cls.breakpoints_by_number if bp])
+        cls.invalidate_caches()
+
+    @classmethod
+    def invalidate_caches(cls):
+        """ Flush all caches derived from breakpoints list: `code_breakpoints_cache` 
+        and iksettrace native breakpoints table.
+        """
+        cls.code_breakpoints_cache.clear()
+        iksettrace._clear_breakpoints_cache()
 
     @classmethod
     def lookup_effective_breakpoint(cls, file_name, line_number, frame):
         """ Checks if there is an enabled breakpoint at given file_name and 
-        line_number. Check breakpoint condition if any.
+        line_number. Updates hit count then checks ignore count, every nth hit
+        and breakpoint condition if any. Logpoints are logged there and never
+        returned.
+        
+        Must be called once and only once each time the line is reached.
         
         :return: found, enabled and condition verified breakpoint or None
         :rtype: IKPdbBreakpoint or None
@@ -499,21 +1190,32 @@ class IKBreakpoint(object):
             
         if not bp.enabled:
             return None
+        
+        bp.hit_count += 1
+        if bp.hit_count <= bp.ignore_count:
+            return None
+        if bp.every_nth_hit > 1 \
+                and (bp.hit_count - bp.ignore_count) % bp.every_nth_hit:
+            return None
             
-        if not bp.condition:
-            return bp
-        try:
-            value = eval(bp.condition, frame.f_globals, frame.f_locals)
-            return bp if value else None
-        except:
-            pass
-        return None
+        if bp.compiled_condition:
+            try:
+                if not eval(bp.compiled_condition, frame.f_globals, frame.f_locals):
+                    return None
+            except:
+                return None
+        if bp.action == 'log':
+            bp.log_hit(frame)
+            return None
+        return bp
 
     @classmethod
     def get_breakpoints_list(cls):
         """:return: a list of all breakpoints.
         :rtype: a list of dict with this keys: `breakpoint_number`, `bp.number`,
-                `file_name`, `line_number`, `condition`, `enabled`.
+                `file_name`, `line_number`, `condition`, `enabled`, 
+                `hit_count`, `ignore_count`, `every_nth_hit`, `action`, 
+                `expressions`.
                 
         Warning: IKPDb line numbers are 1 based so line number conversion
         must be done by clients (eg. inouk.ikpdb for Cloud9)
@@ -527,6 +1229,11 @@ class IKBreakpoint(object):
                     'line_number': bp.line_number,
                     'condition': bp.condition,
                     'enabled': bp.enabled,
+                    'hit_count': bp.hit_count,
+                    'ignore_count': bp.ignore_count,
+                    'every_nth_hit': bp.every_nth_hit,
+                    'action': bp.action,
+                    'expressions': bp.expressions,
                 }
                 breakpoints_list.append(bp_dict)
         return breakpoints_list
@@ -550,7 +1257,8 @@ class IKBreakpoint(object):
             if bp: 
                 all_breakpoints_state.append((bp.number, 
                                               bp.enabled, 
-                                              bp.condition,))
+                                              bp.condition,
+                                              bp.compiled_condition,))
         return all_breakpoints_state
 
     @classmethod
@@ -560,20 +1268,500 @@ class IKBreakpoint(object):
         since backup missing or added breakpoints are ignored.
         
         breakpoints_state_list is a list of tuple. Each tuple is of form:
-        (breakpoint_number, enabled, condition)
+        (breakpoint_number, enabled, condition, compiled_condition)
         """
         for breakpoint_state in breakpoints_state_list:
             bp = cls.breakpoints_by_number[breakpoint_state[0]]
             if bp:
                 bp.enabled = breakpoint_state[1]
                 bp.condition = breakpoint_state[2]
+                bp.compiled_condition = breakpoint_state[3]
         cls.update_active_breakpoint_flag()
         return
 
+
+class IKLogpointsBuffer(object):
+    """ A bounded ring buffer of logpoints hits. Hits are appended by debugged
+    threads and popped by batches by debugger's logpoints sender (see 
+    :func:`IKPdb.logpoints_sender_loop`). When buffer is full, oldest hits
+    are dropped and counted so that a logpoint in a hot loop can't exhaust
+    memory.
+    
+    :param size: maximum number of hits kept in buffer.
+    :type size: int
+    """
+    def __init__(self, size):
+        self._hits = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.dropped_count = 0
+        
+    def __len__(self):
+        return len(self._hits)
+        
+    def append(self, hit):
+        with self._lock:
+            if len(self._hits) == self._hits.maxlen:
+                self.dropped_count += 1
+            self._hits.append(hit)
+
+    def pop_batch(self, max_count):
+        """ Remove up to max_count oldest hits from buffer.
+        
+        :return: a tuple of (list of hits, number of hits dropped since last
+                 call).
+        """
+        with self._lock:
+            hits = [self._hits.popleft() 
+                    for i in range(min(max_count, len(self._hits)))]
+            dropped_count = self.dropped_count
+            self.dropped_count = 0
+        return hits, dropped_count
+
+class IKHandleTable(object):
+    """ Maps the compact integer handles sent to client (as frames, scopes 
+    and variables `id`) to objects of debugged program. While debugged 
+    program is stopped, table holds a strong reference on each object so 
+    that any handle sent during this stop can be safely resolved. All 
+    references are released by `release()` on resume. 
+    
+    An object keeps the handle it had at previous stop so that clients can
+    match frames and variables between stops. As an id can be reused once 
+    an object is freed, previous stop's objects are matched by id and an
+    identity check (see `identity_check()`). Objects that can't be 
+    referenced (dicts, lists, tuples...) are only checked to be of the same
+    type, so their handle may then resolve to the object that replaced a 
+    freed one at the same address.
+    
+    The table also caches properties extracted from it's objects (see 
+    `cache`) so that expanding a variable again during a stop is a lookup.
+    """
+    # Objects kept referenced until next stop to check their identity: 
+    # immutable scalars and modules, that keeping alive has no effect on 
+    # debugged program
+    STRONG_REFERENCE_TYPES = frozenset((types.NoneType, bool, int, long, float,
+                                        complex, str, unicode, types.ModuleType,))
+
+    def __init__(self):
+        self._objects = {}  # objects indexed by handle
+        self._handles = {}  # handles indexed by object id
+        # (handle, identity check) of previous stop objects indexed by object id
+        self._previous_handles = {}
+        self._next_handle = 1
+        self.cache = {}  #: properties results indexed by handle and options
+
+    def get_handle(self, obj):
+        """ :return: obj's handle. """
+        obj_id = id(obj)
+        handle = self._handles.get(obj_id)
+        if handle is None:
+            previous = self._previous_handles.get(obj_id)
+            if previous is not None and previous[1](obj):
+                handle = previous[0]
+            else:
+                handle = self._next_handle
+                self._next_handle += 1
+            self._handles[obj_id] = handle
+            self._objects[handle] = obj
+        return handle
+
+    def identity_check(self, obj):
+        """ :return: a function returning True if an object found at obj's 
+                 id at next stop is obj. `STRONG_REFERENCE_TYPES` objects 
+                 are referenced strongly, other objects with a weakref. 
+                 Frames can't be weakly referenced so their code is; a frame
+                 is thus matched by it's id and code, which CPython reuses
+                 for next call of the same function from the same stack 
+                 depth. Other objects are matched by id and type.
+        """
+        obj_type = type(obj)
+        if obj_type in self.STRONG_REFERENCE_TYPES:
+            return lambda an_obj: an_obj is obj
+        if obj_type is types.FrameType:
+            code_reference = weakref.ref(obj.f_code)
+            return lambda an_obj: type(an_obj) is types.FrameType \
+                                  and code_reference() is an_obj.f_code
+        try:
+            reference = weakref.ref(obj)
+        except TypeError:
+            type_reference = weakref.ref(obj_type)
+            return lambda an_obj: type(an_obj) is type_reference()
+        return lambda an_obj: reference() is an_obj
+
+    def get_object(self, handle):
+        """ :return: object identified by handle.
+        :raises KeyError: if handle is unknown or has been released.
+        """
+        return self._objects[handle]
+
+    def release(self):
+        """ Release all objects references. Objects keep their handle at 
+        next stop if they pass their identity check (see `identity_check()`).
+        """
+        self._previous_handles = dict(
+            (obj_id, (handle, self.identity_check(self._objects[handle])))
+            for obj_id, handle in self._handles.iteritems())
+        self._handles = {}
+        self._objects = {}
+        self.cache = {}
+
+
+class IKCodePatcher(object):
+    """ IKCodePatcher implements bytecode patched breakpoints. Instead of
+    tracing, code objects containing breakpoints lines are replaced by
+    patched copies that call `hook(line_number)` when they enter a breakpoint
+    line. Lines without breakpoint run at full speed.
+    
+    For each patched line, this sequence is inserted before line's first 
+    instruction:
+    
+        LOAD_CONST hook ; LOAD_CONST line_number ; CALL_FUNCTION 1 ; POP_TOP
+        
+    Jumps to the line are redirected to the inserted sequence and line 
+    numbers table is rebuilt so that frames report the patched line while
+    hook is running.
+    
+    Patched code objects are swapped into known functions: functions found 
+    in modules namespaces (including classes, methods and closures of 
+    decorated functions) which are registered, by file, in weak sets when 
+    modules are imported (see `import_hook()`) and when lines of their file 
+    are patched. Code of modules imported later is patched as soon as import
+    returns and debugged script's code is patched before it runs (see 
+    `patch_code()`). Note that frames already running keep their original 
+    code (eg. breakpoints set in a running loop are hit at next function 
+    call), that functions only referenced elsewhere (eg. closures created at
+    runtime) keep the code they have been created with and that module 
+    level statements of an imported module have already run when they are 
+    patched.
+    
+    :param hook: function called with line number on patched lines
+    :param canonic: function returning a canonical file name
+    """
+    HOOK_STACK_SIZE = 2  #: stack items used by inserted sequence
+    
+    def __init__(self, hook, canonic):
+        self.hook = hook
+        self.canonic = canonic
+        self.patched_lines = {}  # frozenset of lines indexed by canonical file names
+        self.patched_codes = {}  # patched code objects indexed by file name then by original code
+        self.original_codes = {}  # original code objects indexed by patched ones
+        self.functions = {}  # weak sets of known functions indexed by canonical file name
+        self.known_modules = set(sys.modules)
+        self.original_import = None
+        self.importing = threading.local()  # importing.running is True during an import
+        
+    def install_import_hook(self):
+        """ Replace `__import__` builtin by `import_hook()` and register 
+        functions of already imported modules.
+        """
+        import __builtin__
+        if self.original_import is None:
+            self.original_import = __builtin__.__import__
+            __builtin__.__import__ = self.import_hook
+            for module in sys.modules.values():
+                self.register_module(module)
+
+    def import_hook(self, *args, **kwargs):
+        """ Wraps `__import__` to register functions of newly imported 
+        modules and patch the ones having breakpoints. This is done once 
+        outermost import returns as a module running nested imports is 
+        only partially defined.
+        """
+        if getattr(self.importing, 'running', False):
+            return self.original_import(*args, **kwargs)
+        known_modules = self.known_modules
+        self.importing.running = True
+        try:
+            module = self.original_import(*args, **kwargs)
+        finally:
+            self.importing.running = False
+        if len(sys.modules) != len(known_modules):
+            self.patch_new_modules(known_modules)
+        return module
+
+    def patch_new_modules(self, known_modules):
+        """ Register functions of modules added to sys.modules since 
+        known_modules and patch the ones having breakpoints.
+        """
+        new_module_names = set(sys.modules) - known_modules
+        self.known_modules = set(sys.modules)
+        for module_name in new_module_names:
+            module = sys.modules[module_name]
+            self.register_module(module)
+            c_file_name = self.module_file_name(module)
+            if c_file_name in self.patched_lines:
+                self.patch_functions(c_file_name)
+
+    def module_file_name(self, module):
+        """ :return: canonical name of module's source file or None. """
+        file_name = getattr(module, '__file__', None)
+        if not file_name:
+            return None
+        if file_name.endswith(('.pyc', '.pyo')):
+            file_name = file_name[:-1]
+        return self.canonic(file_name)
+
+    def register_module(self, module):
+        """ Register functions of module. Note that sys.modules may contain
+        None or objects that are not modules.
+        """
+        namespace = getattr(module, '__dict__', None)
+        if type(namespace) is types.DictType:
+            self.register_functions(namespace)
+
+    def register_functions(self, namespace):
+        """ Register functions found in namespace (eg. a module's dict), in 
+        it's classes, static and class methods, properties and in closures
+        of these functions (eg. functions wrapped by a decorator).
+        """
+        visited = set()  # id of visited objects
+        objects = namespace.values()
+        while objects:
+            obj = objects.pop()
+            if id(obj) in visited:
+                continue
+            obj_type = type(obj)
+            if obj_type is types.FunctionType:
+                visited.add(id(obj))
+                self.register_function(obj)
+                for cell in obj.func_closure or ():
+                    try:
+                        objects.append(cell.cell_contents)
+                    except ValueError:  # empty cell
+                        pass
+            elif obj_type is types.MethodType:
+                objects.append(obj.im_func)
+            elif obj_type in (staticmethod, classmethod,):
+                objects.append(obj.__func__)
+            elif obj_type is property:
+                objects.extend((obj.fget, obj.fset, obj.fdel,))
+            elif issubclass(obj_type, (type, types.ClassType,)):
+                visited.add(id(obj))
+                objects.extend(obj.__dict__.values())
+
+    def register_function(self, function):
+        """ Register function in the weak set of it's file functions. """
+        code = function.func_code
+        original_code = self.original_codes.get(code, code)
+        file_name = self.canonic(original_code.co_filename)
+        try:
+            self.functions[file_name].add(function)
+        except KeyError:
+            self.functions[file_name] = weakref.WeakSet((function,))
+
+    def set_patched_lines(self, file_name, lines):
+        """ Patch all functions of a file so that hook is called on lines. 
+        Original functions code is restored if lines is empty.
+        
+        :param file_name: a CANONICAL file name
+        :param lines: an iterable of line numbers
+        """
+        lines = frozenset(lines)
+        if lines == self.patched_lines.get(file_name, frozenset()):
+            return
+        # file's module functions may have been defined since import (eg. 
+        # debugged script's ones)
+        for module in sys.modules.values():
+            if self.module_file_name(module) == file_name:
+                self.register_module(module)
+        if lines:
+            self.patched_lines[file_name] = lines
+        else:
+            del self.patched_lines[file_name]
+        self.patched_codes.pop(file_name, None)
+        self.patch_functions(file_name)
+        # forget obsolete patched code objects
+        self.original_codes = dict(
+            (patched_code, original_code) 
+            for patched_code, original_code in self.original_codes.items()
+            if self.canonic(original_code.co_filename) != file_name
+        )
+        for original_code, patched_code in self.patched_codes.get(file_name, {}).items():
+            if patched_code is not original_code:
+                self.original_codes[patched_code] = original_code
+
+    def patch_functions(self, file_name):
+        """ Swap code of all known functions defined in file_name with their
+        patched (or original) version.
+        """
+        lines = self.patched_lines.get(file_name)
+        for function in list(self.functions.get(file_name, ())):
+            code = function.func_code
+            original_code = self.original_codes.get(code, code)
+            if self.canonic(original_code.co_filename) != file_name:
+                continue
+            new_code = self.patch_code(original_code) if lines else original_code
+            if new_code is not code:
+                function.func_code = new_code
+
+    def patch_code(self, code):
+        """ Returns a copy of code (and nested code objects) with hook calls 
+        inserted on patched lines or code itself if there is nothing to patch.
+        """
+        file_name = self.canonic(code.co_filename)
+        lines = self.patched_lines.get(file_name)
+        if not lines:
+            return code
+        cache = self.patched_codes.setdefault(file_name, {})
+        try:
+            return cache[code]
+        except KeyError:
+            pass
+        
+        consts = tuple(self.patch_code(const) if type(const) is types.CodeType else const 
+                       for const in code.co_consts)
+        patched_offsets = dict((offset, line_number) 
+                               for offset, line_number in dis.findlinestarts(code)
+                               if line_number in lines)
+        if patched_offsets or any(new_const is not const 
+                                  for new_const, const in zip(consts, code.co_consts)):
+            new_code = self.build_code(code, consts, patched_offsets)
+            self.original_codes[new_code] = code
+        else:
+            new_code = code
+        cache[code] = new_code
+        return new_code
+
+    def build_code(self, code, consts, patched_offsets):
+        """ Build a new code object from code with consts and hook calls 
+        inserted at patched_offsets.
+
+        :param patched_offsets: line numbers indexed by offset of their first 
+                                instruction.
+        """
+        co_code = code.co_code
+        code_size = len(co_code)
+        
+        # constants used by hook calls
+        consts = list(consts)
+        hook_index = len(consts)
+        consts.append(self.hook)
+        line_indexes = {}
+        for line_number in set(patched_offsets.values()):
+            line_indexes[line_number] = len(consts)
+            consts.append(line_number)
+        
+        # decode instructions as (offset, opcode, arg, jump target offset)
+        instructions = []
+        offset = i = extended_arg = 0
+        while i < code_size:
+            opcode = ord(co_code[i])
+            if opcode >= dis.HAVE_ARGUMENT:
+                arg = ord(co_code[i+1]) + ord(co_code[i+2]) * 256 + extended_arg
+                i += 3
+                if opcode == dis.EXTENDED_ARG:
+                    extended_arg = arg << 16
+                    continue
+            else:
+                arg = None
+                i += 1
+            if opcode in dis.hasjrel:
+                target = i + arg
+            elif opcode in dis.hasjabs:
+                target = arg
+            else:
+                target = None
+            instructions.append((offset, opcode, arg, target))
+            offset = i
+            extended_arg = 0
+
+        def instruction_size(arg):
+            if arg is None:
+                return 1
+            return 3 if arg <= 0xFFFF else 6
+
+        def hook_size(line_number):
+            return instruction_size(hook_index) \
+                + instruction_size(line_indexes[line_number]) + 4
+        
+        # compute new offsets until jumps args sizes are stable
+        sizes = [instruction_size(arg) for _, _, arg, _ in instructions]
+        while True:
+            new_offsets = {}  # new offsets indexed by old ones
+            positions = []  # new offsets of instructions
+            position = 0
+            for index, (offset, _, _, _) in enumerate(instructions):
+                new_offsets[offset] = position
+                if offset in patched_offsets:
+                    position += hook_size(patched_offsets[offset])
+                positions.append(position)
+                position += sizes[index]
+            new_offsets[code_size] = position
+            
+            args = []
+            stable = True
+            for index, (_, opcode, arg, target) in enumerate(instructions):
+                if opcode in dis.hasjrel:
+                    arg = new_offsets[target] - positions[index] - sizes[index]
+                elif opcode in dis.hasjabs:
+                    arg = new_offsets[target]
+                args.append(arg)
+                size = instruction_size(arg)
+                if size > sizes[index]:
+                    sizes[index] = size
+                    stable = False
+            if stable:
+                break
+        
+        # emit patched code
+        new_code = []
+        def emit(opcode, arg=None, size=None):
+            if arg is None:
+                new_code.append(chr(opcode))
+                return
+            if (size or instruction_size(arg)) == 6:
+                new_code.append(chr(dis.EXTENDED_ARG) 
+                                + chr((arg >> 16) & 0xFF) + chr(arg >> 24))
+            new_code.append(chr(opcode) + chr(arg & 0xFF) + chr((arg >> 8) & 0xFF))
+        
+        for index, (offset, opcode, _, _) in enumerate(instructions):
+            if offset in patched_offsets:
+                emit(dis.opmap['LOAD_CONST'], hook_index)
+                emit(dis.opmap['LOAD_CONST'], line_indexes[patched_offsets[offset]])
+                emit(dis.opmap['CALL_FUNCTION'], 1)
+                emit(dis.opmap['POP_TOP'])
+            emit(opcode, args[index], sizes[index])
+        
+        # rebuild line numbers table
+        lnotab = []
+        last_offset, last_line_number = 0, code.co_firstlineno
+        for offset, line_number in dis.findlinestarts(code):
+            offset_increment = new_offsets[offset] - last_offset
+            line_increment = line_number - last_line_number
+            while offset_increment > 255:
+                lnotab.append(chr(255) + chr(0))
+                offset_increment -= 255
+            while line_increment > 255:
+                lnotab.append(chr(offset_increment) + chr(255))
+                line_increment -= 255
+                offset_increment = 0
+            if offset_increment or line_increment:
+                lnotab.append(chr(offset_increment) + chr(line_increment))
+            last_offset, last_line_number = new_offsets[offset], line_number
+        
+        return types.CodeType(code.co_argcount,
+                              code.co_nlocals,
+                              code.co_stacksize + self.HOOK_STACK_SIZE,
+                              code.co_flags,
+                              ''.join(new_code),
+                              tuple(consts),
+                              code.co_names,
+                              code.co_varnames,
+                              code.co_filename,
+                              code.co_name,
+                              code.co_firstlineno,
+                              ''.join(lnotab),
+                              code.co_freevars,
+                              code.co_cellvars)
+
+
 class IKPdb(object):
     """ Main debugger class.
 
-    :param skip: reserved for future use
+    :param skip: an iterable of glob patterns (eg. ``*/site-packages/*``, 
+                 ``/usr/lib/python2.7/*``, ``openerp.osv.*``) matched against 
+                 modules names and canonical files paths. Frames of matching
+                 code objects are never traced: breakpoints in them are
+                 ignored and steps go through them ("Just My Code" mode).
     :param working_directory: allows to force debugger's Current Working 
                               Directory (CWD). `working_directory` is used for file
                               mapping between IKPdb and clients. 
@@ -584,16 +1772,76 @@ class IKPdb(object):
     :param stop_at_first_statement: defines wether debugger must break at
                                     first statement. None don't break, else break.
     :type stop_at_first_statement: str
+
+    :param stats: collect tracer statistics (see `get_tracer_stats()`).
+    :type stats: bool
+
+    :param tracing_backend: one of `TRACING_BACKENDS`. With 'settrace', all 
+                            'line' events of traced threads are filtered by
+                            iksettrace. With 'gated', 'line' events are only
+                            generated in frames where debugger may stop.
+    :type tracing_backend: str
+
+    :param breakpoints_mode: one of `BREAKPOINTS_MODES`. With 'trace', 
+                             breakpoints are detected by tracing. With 
+                             'patch', code objects are patched to call
+                             debugger on breakpoints lines (see 
+                             :class:`IKCodePatcher`) and debugged program 
+                             is only traced while a step is pending or when
+                             exception breakpoints are set.
+    :type breakpoints_mode: str
+
+    :param lazy_scopes: if True, `programBreak` frames contain no variables.
+                        Client fetches them with `getScopes` and 
+                        `getProperties` (see `get_scopes()`).
+    :type lazy_scopes: bool
+
+    :param variables_diff: if True, frames already sent at previous stop
+                           only contain variables added, changed or removed
+                           since then (see `diff_frame_variables()`).
+    :type variables_diff: bool
+
+    :param stop_budget: estimated maximum size (in bytes) of frames variables
+                        sent at each stop (see `dump_frames_variables()`). 
+                        None for no limit.
+    :type stop_budget: int
+
+    :param stack_depth: count of stack entries sent in `programBreak`, 
+                        others are fetched using `getStackFrames`. None to 
+                        send the whole stack.
+    :type stack_depth: int
+
+    :param intern_objects: if True, frames variables are references to a 
+                           table of objects sent along with frames. Each 
+                           object and scope is sent once per stop (see 
+                           `intern_variables()`).
+    :type intern_objects: bool
         
     Take note that, right now, IKPdb is used as singleton.
     """
     
+    TRACING_BACKENDS = ('settrace', 'gated',)
+    BREAKPOINTS_MODES = ('trace', 'patch',)
+    
+    # see collapse_recursions()
+    RECURSION_MAX_PERIOD = 4
+    RECURSION_COLLAPSE_THRESHOLD = 10
+
+    # Read-only commands executed by stopped thread (see 
+    # execute_inspection_command())
+    INSPECTION_COMMANDS = ('getScopes', 'getStackFrames', 'getProperties', 
+                           'getArraySlice',)
+
     def __init__(self, skip=None, stop_at_first_statement=False, working_directory=None, 
-                 client_working_directory=None):
-        # TODO: manage skip
+                 client_working_directory=None, stats=False, 
+                 tracing_backend='settrace', breakpoints_mode='trace',
+                 lazy_scopes=False, variables_diff=False, stop_budget=None,
+                 stack_depth=None, intern_objects=False):
         self.skip = set(skip) if skip else None
+        self.skipped_code_cache = weakref.WeakKeyDictionary()  # True or False indexed by code object
         
         self.debugger_thread_ident = None
+        self.logpoints_sender_ident = None
         self.file_name_cache = {}        
         
         self._CWD = working_directory or os.getcwd()
@@ -602,11 +1850,51 @@ class IKPdb(object):
         self.mainpyfile = ''
         self._active_breakpoint_lock = threading.Lock()
         self._active_thread_lock = threading.Lock()
+        self._logpoints_send_lock = threading.Lock()
         self._command_q = Queue.Queue(maxsize=1)
 
         # tracing is disabled until required 
         self.execution_started = False
         self.tracing_enabled = False
+        self.tracing_backend = tracing_backend
+        
+        # frames variables are sent on demand (see get_scopes())
+        self.lazy_scopes = lazy_scopes
+        
+        # Each stop is numbered. With variables_diff, we keep fingerprints of
+        # variables sent at last stop indexed by frame id.
+        self.variables_diff = variables_diff
+        self.stop_budget = stop_budget
+        self.stop_id = 0
+        self.variables_fingerprints = {}
+        self.children_count_cache = {}  # see children_count()
+        self.variables_cache = {}  # see extract_variable()
+        
+        # With intern_objects, objects and scopes are sent once per stop
+        # (see intern_variables())
+        self.intern_objects = intern_objects
+        self.interned_handles = set()  # objects sent as a variable value
+        self.interned_scope_handles = set()  # objects sent as a scope
+        self.interned_scopes = {}
+        
+        # stack of stopped thread (see dump_frames())
+        self.stack_depth = stack_depth
+        self.stack_entries = []
+        self.stack_thread = None
+        
+        # handles sent to client instead of objects ids
+        self.handles = IKHandleTable()
+        
+        # array-like variables are summarized instead of repr'd
+        self.array_summarizer = IKArraySummarizer()
+        
+        # bytecode patched breakpoints
+        self.breakpoints_mode = breakpoints_mode
+        if breakpoints_mode == 'patch':
+            self.code_patcher = IKCodePatcher(self._breakpoint_hook, self.canonic)
+            self.code_patcher.install_import_hook()
+        else:
+            self.code_patcher = None
         
         # At any time IKPdb status can be
         #   * 'pending' => Execution has not started yet
@@ -616,6 +1904,8 @@ class IKPdb(object):
         self.status = 'pending'  
         self.debugged_thread_ident = None
         self.debugged_thread_name = None
+        # threads which may be debugged, None for all (see is_traced_thread())
+        self.traced_thread_idents = None
 
         # stop management
         self.pending_stop = False  # True if any of frame_xxxx is set
@@ -627,12 +1917,37 @@ class IKPdb(object):
         # last frame to dump ; allows to dump only debugged program frames         
         self.frame_beginning = None
         
+        # exception breakpoints (see set_exception_breakpoints())
+        self.break_on_raised = False
+        self.break_on_uncaught = False
+        self.break_exception_types = frozenset()
+        self.break_in_library = False
+        self.uncaught_exception_traceback = None  # last uncaught exception reported
+        
         # If True, debugger breaks on first line to allow user to setup 
         # some breakpoints.
         self.stop_at_first_statement = True if stop_at_first_statement else False
         
         # Some parameters that may need to become cli options
         self.CGI_ESCAPE_EVALUATE_OUTPUT = False
+        # Logpoints hits are buffered then sent by batches (see 
+        # logpoints_sender_loop())
+        self.LOGPOINTS_BUFFER_SIZE = 1000
+        self.LOGPOINTS_BATCH_SIZE = 100
+        self.LOGPOINTS_FLUSH_INTERVAL = 0.1  # seconds
+        # Members of instances are counted up to this value
+        self.MAX_CHILDREN_COUNT = 1000
+        IKBreakpoint.logpoints_buffer = IKLogpointsBuffer(self.LOGPOINTS_BUFFER_SIZE)
+
+        # iksettrace filters 'line' events using it's own copy of breakpoints
+        iksettrace._set_breakpoints_resolver(self.native_breakpoints_resolver)
+
+        # tracer statistics (see get_tracer_stats())
+        self.stats_enabled = False
+        self.stats_breaks = 0
+        self.stats_break_latency_total = 0.0
+        self.stats_break_latency_max = 0.0
+        self.set_stats_enabled(stats)
 
 
     def canonic(self, file_name):
@@ -649,6 +1964,139 @@ class IKPdb(object):
             self.file_name_cache[file_name] = c_file_name
         return c_file_name
 
+    def native_breakpoints_resolver(self, file_name):
+        """ Called by iksettrace the first time it meets a file name to build
+        it's native breakpoints table.
+        
+        :param file_name: a `co_filename` (not canonical)
+        :return: a frozenset of lines with an enabled breakpoint or None
+        """
+        c_file_name = self.canonic(file_name)
+        lines = [line_number 
+                 for line_number in IKBreakpoint.breakpoints_files.get(c_file_name, [])
+                 if IKBreakpoint.breakpoints_by_file_and_line[c_file_name, line_number].enabled]
+        return frozenset(lines) if lines else None
+
+    def code_has_breakpoint(self, code):
+        """ Checks wether an enabled breakpoint line belongs to code object's
+        line table. Result is cached in `IKBreakpoint.code_breakpoints_cache`.
+        
+        :param code: a code object
+        :rtype: bool
+        """
+        try:
+            return IKBreakpoint.code_breakpoints_cache[code]
+        except KeyError:
+            pass
+        lines = self.native_breakpoints_resolver(code.co_filename)
+        if lines:
+            has_breakpoint = any(line_number in lines 
+                                 for _, line_number in dis.findlinestarts(code))
+        else:
+            has_breakpoint = False
+        IKBreakpoint.code_breakpoints_cache[code] = has_breakpoint
+        return has_breakpoint
+
+    def is_skipped_frame(self, frame):
+        """ Checks wether frame's module name or canonical file name matches
+        one of the `skip` glob patterns. Result is cached by code object.
+        Debugger's own frames (eg. `_breakpoint_hook()`) are always skipped.
+        
+        :rtype: bool
+        """
+        if frame.f_globals is globals():
+            return True
+        if not self.skip:
+            return False
+        code = frame.f_code
+        try:
+            return self.skipped_code_cache[code]
+        except KeyError:
+            pass
+        module_name = frame.f_globals.get('__name__') or ''
+        c_file_name = self.canonic(code.co_filename)
+        is_skipped = any(fnmatch.fnmatchcase(module_name, pattern) 
+                         or fnmatch.fnmatch(c_file_name, pattern)
+                         for pattern in self.skip)
+        self.skipped_code_cache[code] = is_skipped
+        return is_skipped
+
+    def unskipped_caller(self, frame):
+        """ Returns first frame in frame's callers chain which is not skipped.
+        """
+        caller = frame.f_back
+        while caller and caller != self.frame_beginning \
+                and self.is_skipped_frame(caller):
+            caller = caller.f_back
+        return caller
+
+    def native_exception_resolver(self, exc_type):
+        """ Called by iksettrace the first time it meets an exception type 
+        in a traced frame to build it's native exception filter.
+        
+        SystemExit, GeneratorExit and StopIteration are ignored unless they 
+        are explicitly listed in `break_exception_types`.
+        
+        :param exc_type: an exception class
+        :return: True if debugger may break on this exception type.
+        """
+        if not isinstance(exc_type, (type, types.ClassType)):
+            return False  # string exceptions
+        if issubclass(exc_type, IKPdbQuit):
+            return False
+        mro_names = set()
+        for cls in inspect.getmro(exc_type):
+            mro_names.add(cls.__name__)
+            mro_names.add("%s.%s" % (cls.__module__, cls.__name__,))
+        if self.break_exception_types:
+            return not mro_names.isdisjoint(self.break_exception_types)
+        return not issubclass(exc_type, (SystemExit, GeneratorExit, StopIteration,))
+
+    def is_uncaught_boundary(self, frame):
+        """ Checks wether frame belongs to the code that launched debugged 
+        program (ikpdb or threading module). An exception propagating to
+        such a frame has not been caught by debugged program.
+        """
+        return frame.f_back == self.frame_beginning \
+            or frame.f_globals.get('__name__') == 'threading'
+
+    def is_raised_here(self, callee_traceback):
+        """ Checks wether an exception is reported for the first time by an 
+        'exception' event. This is the case if exception has been raised in 
+        the frame that received the event or - unless `break_in_library` is 
+        set - in skipped frames it called.
+        
+        :param callee_traceback: next traceback entry of the frame that 
+                                 received the 'exception' event.
+        """
+        if callee_traceback is None:
+            return True
+        if self.break_in_library:
+            return False
+        while callee_traceback:
+            if not self.is_skipped_frame(callee_traceback.tb_frame):
+                return False
+            callee_traceback = callee_traceback.tb_next
+        return True
+
+    def normalize_exc_info(self, exc_info):
+        """ 'exception' events receive un-normalized exceptions (eg. value may
+        be a string or None). Returns exc_info with value being an instance
+        of type.
+        """
+        exc_type, exc_value, exc_traceback = exc_info
+        if not isinstance(exc_value, exc_type):
+            try:
+                if exc_value is None:
+                    exc_value = exc_type()
+                elif isinstance(exc_value, tuple):
+                    exc_value = exc_type(*exc_value)
+                else:
+                    exc_value = exc_type(exc_value)
+            except:
+                pass
+        return exc_type, exc_value, exc_traceback
+
     def normalize_path_in(self, client_file_name):
         """Translate a (possibly incomplete) file or module name received from debugging client
         into an absolute file name.
@@ -711,8 +2159,11 @@ class IKPdb(object):
         return normalized_path
 
 
-    def object_properties_count(self, o):
-        """ returns the number of user browsable properties of an object. """
+    def object_properties_count(self, o, max_count=None):
+        """ returns the number of user browsable properties of an object. 
+        If `max_count` is specified, members of instances are counted up to 
+        `max_count` + 1.
+        """
         o_type = type(o)
         if isinstance(o, (types.DictType, types.ListType, types.TupleType, set,)):
             return len(o)
@@ -743,110 +2194,221 @@ class IKPdb(object):
             # else:
             try:
                 if hasattr(o, '__dict__'):
-                    count = len([m_name for m_name, m_value in o.__dict__.iteritems()
-                                  if not m_name.startswith('__') 
-                                    and not type(m_value) in (types.ModuleType, 
-                                                              types.MethodType, 
-                                                              types.FunctionType,) ])
+                    members = (m_name for m_name, m_value in o.__dict__.iteritems()
+                               if not m_name.startswith('__') 
+                                 and not type(m_value) in (types.ModuleType, 
+                                                           types.MethodType, 
+                                                           types.FunctionType,))
+                    if max_count is not None:
+                        members = itertools.islice(members, max_count + 1)
+                    count = sum(1 for m_name in members)
                 else:
                     count = 0
             except:
                 count = 0
             return count
 
-    def extract_object_properties(self, o, limit_size=False):
-        """Extracts all properties from an object (eg. f_locals, f_globals, 
+    def children_count(self, o):
+        """ Returns the number of properties of o displayed next to it's type
+        as a tuple of (count, count label). Members of instances are counted 
+        up to `MAX_CHILDREN_COUNT` (label is then eg. '1000+'). Result is 
+        cached by object id until next stop or variable modification.
+        """
+        o_id = id(o)
+        cached = self.children_count_cache.get(o_id)
+        if cached is None:
+            count = self.object_properties_count(o, max_count=self.MAX_CHILDREN_COUNT)
+            if count > self.MAX_CHILDREN_COUNT \
+                    and not isinstance(o, (types.DictType, types.ListType, 
+                                           types.TupleType, set,)):
+                cached = count, "%s+" % self.MAX_CHILDREN_COUNT
+            else:
+                cached = count, str(count)
+            self.children_count_cache[o_id] = cached
+        return cached
+
+    def get_properties(self, handle, start=0, count=None, name_filter=None, 
+                       with_children_count=True):
+        """ Returns the properties of object identified by handle (see 
+        `extract_object_properties()`) and their `total_count` as a dict. 
+        Results are cached in handles table until resume.
+
+        :raises KeyError: if handle is not valid.
+        """
+        key = (handle, start, count, name_filter, with_children_count,)
+        result = self.handles.cache.get(key)
+        if result is None:
+            o = self.handles.get_object(handle) if handle else None
+            result = {
+                'properties': self.extract_object_properties(o,
+                                                             start=start,
+                                                             count=count,
+                                                             name_filter=name_filter,
+                                                             with_children_count=with_children_count),
+                'total_count': self.object_properties_total_count(o, name_filter),
+            }
+            self.handles.cache[key] = result
+        return result
+
+    def iter_object_properties(self, o):
+        """ Returns an iterator on (name, value) of the user browsable 
+        properties of an object: items of a dict, elements of a list, tuple 
+        or set (named by index) or members of an instance.
+        """
+        if isinstance(o, types.DictType):
+            return o.iteritems()
+        elif type(o) in (types.ListType, types.TupleType, set,):
+            return enumerate(o)
+        elif hasattr(o, '__dict__'):
+            return ((a_var_name, a_var_value) 
+                    for a_var_name, a_var_value in o.__dict__.iteritems()
+                    if (not a_var_name.startswith('__') 
+                        and not type(a_var_value) in (types.ModuleType, 
+                                                      types.MethodType, 
+                                                      types.FunctionType,)))
+        return iter(())
+
+    def filter_object_properties(self, properties, name_filter):
+        """ Filters an iterator of (name, value) on names containing 
+        `name_filter` (case insensitive).
+        """
+        name_filter = name_filter.lower()
+        return ((a_var_name, a_var_value) 
+                for a_var_name, a_var_value in properties
+                if name_filter in (a_var_name if isinstance(a_var_name, 
+                                                            types.StringTypes)
+                                   else repr(a_var_name)).lower())
+
+    def object_properties_total_count(self, o, name_filter=None):
+        """ returns the number of user browsable properties of an object 
+        whose name contains name_filter.
+        """
+        if not name_filter:
+            return self.object_properties_count(o)
+        try:
+            return sum(1 for p in self.filter_object_properties(self.iter_object_properties(o),
+                                                                 name_filter))
+        except:
+            return 0
+
+    def extract_object_properties(self, o, limit_size=False, start=0, count=None, 
+                                  name_filter=None, with_children_count=True):
+        """Extracts properties from an object (eg. f_locals, f_globals, 
         user dict, instance ...) and returns them as an array of variables.
+        
+        Only the `count` properties starting at `start` (whose name contains
+        `name_filter` if any) are iterated so that containers of any size
+        can be browsed in bounded time. When `count` is not specified, 
+        `MAX_CHILDREN_TO_RETURN` properties are returned followed by a 
+        truncation marker if there are more.
+        Properties children count is not computed unless `with_children_count`
+        is True.
         """
+        MAX_CHILDREN_TO_RETURN = 256
+        MAX_CHILDREN_MESSAGE = "Truncated by ikpdb (don't hot change me !)."
         try:
-            prop_str = repr(o)[:512]
+            prop_str = IKBoundedRepr(512).repr(o)[:512]
         except:
             prop_str = "Error while extracting value"
 
         _logger.e_debug("extract_object_properties(%s)", prop_str)
+        truncation_marker = count is None
+        if truncation_marker:
+            count = MAX_CHILDREN_TO_RETURN
         var_list = []
-        if isinstance(o, types.DictType):
-            a_var_name = None
-            a_var_value = None
-            for a_var_name in o:
-                a_var_value = o[a_var_name]
-                children_count = self.object_properties_count(a_var_value)
-                v_name, v_value, v_type = self.extract_name_value_type(a_var_name, 
-                                                                       a_var_value, 
-                                                                       limit_size=limit_size)
-                a_var_info = {
-                    'id': id(a_var_value),
-                    'name': v_name,
-                    'type': "%s%s" % (v_type, " [%s]" % children_count if children_count else '',),
-                    'value': v_value,
-                    'children_count': children_count,
-                }
-                var_list.append(a_var_info)
-                
-        elif type(o) in (types.ListType, types.TupleType, set,):
-            MAX_CHILDREN_TO_RETURN = 256
-            MAX_CHILDREN_MESSAGE = "Truncated by ikpdb (don't hot change me !)."
-            a_var_name = None
-            a_var_value = None
-            do_truncate = len(o) > MAX_CHILDREN_TO_RETURN
-            for idx, a_var_value in enumerate(o):
-                children_count = self.object_properties_count(a_var_value)
-                v_name, v_value, v_type = self.extract_name_value_type(idx, 
-                                                                       a_var_value, 
-                                                                       limit_size=limit_size)
-                var_list.append({
-                    'id': id(a_var_value),
-                    'name': v_name,
-                    'type': "%s%s" % (v_type, " [%s]" % children_count if children_count else '',),
-                    'value': v_value,
-                    'children_count': children_count,
-                })
-                if do_truncate and idx==MAX_CHILDREN_TO_RETURN-1:
+        properties = self.iter_object_properties(o)
+        if name_filter:
+            properties = self.filter_object_properties(properties, name_filter)
+        for a_var_name, a_var_value in itertools.islice(properties, start, 
+                                                        start + count + 1):
+            if len(var_list) == count:
+                if truncation_marker:
                     var_list.append({
                         'id': None,
-                        'name': str(MAX_CHILDREN_TO_RETURN),
+                        'name': str(start + count),
                         'type': '',
                         'value': MAX_CHILDREN_MESSAGE,
                         'children_count': 0,
                     })
-                    break
-        else:
-            a_var_name = None
-            a_var_value = None
-            if hasattr(o, '__dict__'):
-                for a_var_name, a_var_value in o.__dict__.iteritems():
-                    if (not a_var_name.startswith('__') 
-                        and not type(a_var_value) in (types.ModuleType, 
-                                                      types.MethodType, 
-                                                      types.FunctionType,)):
-                        children_count = self.object_properties_count(a_var_value)
-                        v_name, v_value, v_type = self.extract_name_value_type(a_var_name,
-                                                                               a_var_value, 
-                                                                               limit_size=limit_size)
-                        var_list.append({
-                            'id': id(a_var_value),
-                            'name': v_name,
-                            'type': "%s%s" % (v_type, " [%s]" % children_count if children_count else '',),
-                            'value': v_value,
-                            'children_count': children_count,
-                        })
+                break
+            var_list.append(self.extract_variable(a_var_name, 
+                                                  a_var_value, 
+                                                  limit_size=limit_size,
+                                                  with_children_count=with_children_count))
         return var_list    
+
+    def extract_variable(self, name, value, limit_size=False, with_children_count=True):
+        """ Returns a variable as a dict with `id`, `name`, `type`, `value`, 
+        `children_count` and `array_kind` for array-like values.
+        Value, type and children count of an object are extracted once and 
+        cached in `variables_cache` until next stop or variable modification
+        so that an object referenced by several variables is repr'd once.
+        """
+        handle = self.handles.get_handle(value)
+        key = (handle, with_children_count,)
+        cached = self.variables_cache.get(key)
+        if cached is None:
+            if with_children_count:
+                children_count, children_count_label = self.children_count(value)
+            else:
+                children_count, children_count_label = None, None
+            v_name, v_value, v_type = self.extract_name_value_type(name, 
+                                                                   value, 
+                                                                   limit_size=limit_size)
+            var_info = {
+                'id': handle,
+                'name': v_name,
+                'type': "%s%s" % (v_type, " [%s]" % children_count_label if children_count else '',),
+                'value': v_value,
+                'children_count': children_count,
+            }
+            array_kind = self.array_summarizer.array_kind(value)
+            if array_kind:
+                var_info['array_kind'] = array_kind  # see getArraySlice
+            # value truncation is marked in variable name
+            truncated = v_name != self.variable_name(name)
+            self.variables_cache[key] = var_info, truncated
+            return var_info
+        
+        var_info, truncated = cached
+        v_name = self.variable_name(name)
+        if truncated:
+            v_name = "%s*" % v_name
+        return dict(var_info, name=v_name)
+
+    def variable_name(self, name):
+        """ :return: name of a variable (or key, or index) as str. """
+        if isinstance(name, types.StringType):
+            return name
+        return repr(name)
+
+    def clear_variables_caches(self):
+        """ Forget all variables extracted since stop. Called at each stop and 
+        when variables may have been modified (by evaluate or setVariable).
+        """
+        self.children_count_cache.clear()
+        self.variables_cache.clear()
+        self.interned_handles.clear()
+        self.interned_scope_handles.clear()
+        self.interned_scopes.clear()
+        self.handles.cache.clear()
     
     def extract_name_value_type(self, name, value, limit_size=False):
         """Extracts value of any object, eventually reduces it's size and
-        returns name, truncated value and type (for str with size appended)
+        returns name, truncated value and type (for str with size appended).
+        Value of array-like objects is a summary (see 
+        :class:`IKArraySummarizer`).
         """
         MAX_STRING_LEN_TO_RETURN = 487
         try:
-            t_value = repr(value)
+            t_value = self.array_summarizer.summarize(value)
+            if t_value is None:
+                t_value = IKBoundedRepr(MAX_STRING_LEN_TO_RETURN).repr(value)
         except:
             t_value = "Error while extracting value"
 
         # convert all var names to string
-        if isinstance(name, types.StringType):
-            r_name = name
-        else:
-            r_name = repr(name)
+        r_name = self.variable_name(name)
 
         # truncate value to limit data flow between ikpdb and client
         if len(t_value) > MAX_STRING_LEN_TO_RETURN:
@@ -862,59 +2424,390 @@ class IKPdb(object):
 
         return r_name, r_value, r_type
 
-    def dump_frames(self, frame):
+    def dump_frames(self, frame, thread=None):
         """ dumps frames chain in a representation suitable for serialization 
            and remote (debugger) client usage.
+           `thread` is the thread running frame, default to current thread.
+           Stack is walked up to `frame_beginning` and recursions are 
+           collapsed (see `collapse_recursions()`). Only the `stack_depth` 
+           first entries are dumped, others are fetched using 
+           `getStackFrames` (see `get_stack_frames()`).
+           With `lazy_scopes`, frames variables are not dumped (see 
+           `get_scopes()`), else see `dump_frames_variables()`.
+           Each call is a new stop identified by `stop_id`.
+           
+           :return: a tuple (frames, objects) where objects is the table of
+                    objects referenced by frames with `intern_objects` (else 
+                    None).
         """
-        current_thread = threading.currentThread()
-        frames = []
+        self.stop_id += 1
+        self.clear_variables_caches()
+        self.stack_thread = thread or threading.currentThread()
+        self.stack_entries = self.collapse_recursions(self.get_stack(frame))
+
+        levels = self.stack_depth or len(self.stack_entries)
+        objects = {} if self.intern_objects else None
+        frames, variables_fingerprints = self.dump_stack_entries(self.stack_entries[:levels],
+                                                                 self.variables_diff,
+                                                                 objects)
+        self.variables_fingerprints = variables_fingerprints
+        return frames, objects
+
+    def get_stack(self, frame):
+        """ :return: the list of frames from frame up to `frame_beginning` 
+        (excluded).
+        """
+        stack = []
         frame_browser = frame
         
         # Browse the frame chain as far as we can
         _logger.f_debug("dump_frames(), frame analysis:")
-        spacer = ""
         while hasattr(frame_browser, 'f_back') and frame_browser.f_back != self.frame_beginning:
-            spacer += "="
-            _logger.f_debug("%s>frame = %s, frame.f_code = %s, frame.f_back = %s, "
+            _logger.f_debug("=>frame = %s, frame.f_code = %s, frame.f_back = %s, "
                             "self.frame_beginning = %s",
-                            spacer,
                             hex(id(frame_browser)),
                             frame_browser.f_code,
                             hex(id(frame_browser.f_back)),
                             hex(id(self.frame_beginning)))
-                                
-            # At root frame, globals == locals so we dump only globals
-            if hasattr(frame_browser.f_back, 'f_back')\
-                    and frame_browser.f_back.f_back != self.frame_beginning:
-                locals_vars_list = self.extract_object_properties(frame_browser.f_locals,
-                                                                  limit_size=True)
+            stack.append(frame_browser)
+            frame_browser = frame_browser.f_back
+        return stack
+
+    def collapse_recursions(self, stack):
+        """ Split stack in entries. An entry is a tuple (frames, 
+        repeat_count). Sequences of frames running the same code (up to 
+        `RECURSION_MAX_PERIOD` frames) repeated more than 
+        `RECURSION_COLLAPSE_THRESHOLD` times are recursions. The first 
+        occurrence of a recursion is kept as individual frames while the 
+        others are collapsed in one entry whose frames are those of the 
+        second occurrence. Other frames are entries of their own with a 
+        repeat_count of 1.
+        
+        :param stack: a list of frames as returned by `get_stack()`.
+        """
+        codes = [f.f_code for f in stack]
+        entries = []
+        idx = 0
+        while idx < len(stack):
+            for period in range(1, self.RECURSION_MAX_PERIOD + 1):
+                pattern = codes[idx:idx + period]
+                repeat_count = 1
+                while codes[idx + repeat_count * period:
+                            idx + (repeat_count + 1) * period] == pattern:
+                    repeat_count += 1
+                if repeat_count > self.RECURSION_COLLAPSE_THRESHOLD:
+                    entries.extend(([f], 1,) for f in stack[idx:idx + period])
+                    entries.append((stack[idx + period:idx + 2 * period], 
+                                    repeat_count - 1,))
+                    idx += repeat_count * period
+                    break
             else:
-                locals_vars_list = []
-
-            globals_vars_list = self.extract_object_properties(frame_browser.f_globals,
-                                                               limit_size=True)
-                
+                entries.append(([stack[idx]], 1,))
+                idx += 1
+        return entries
+
+    def dump_stack_entries(self, entries, variables_diff=False, objects=None):
+        """ Dumps stack entries (see `collapse_recursions()`) of stopped 
+        thread. A collapsed recursion is dumped as a frame without variables 
+        with an `id` of None, a `repeat_count` and the `frames_count` it 
+        collapses.
+        
+        :param variables_diff: dump variables diffs of frames sent at 
+                               previous stop (see `diff_frame_variables()`).
+        :param objects: if not None, variables are interned in this table 
+                        (see `intern_variables()`).
+        :return: a tuple (frames, variables_fingerprints).
+        """
+        current_thread = self.stack_thread
+        frames = []
+        frames_scopes = []  # (remote_frame, locals, globals) of each frame
+        for entry_frames, repeat_count in entries:
+            frame_browser = entry_frames[0]
+            
             # normalize path sent to debugging client
             file_path = self.normalize_path_out(frame_browser.f_code.co_filename)
 
             frame_name = "%s() [%s]" % (frame_browser.f_code.co_name, current_thread.name,)
             remote_frame = {
-                'id': id(frame_browser),
+                'id': self.handles.get_handle(frame_browser),
                 'name': frame_name,
                 'line_number': frame_browser.f_lineno,  # Warning 1 based
                 'file_path': file_path,
-                'f_locals': locals_vars_list + globals_vars_list,
                 'thread': current_thread.ident,
                 'thread_name': current_thread.name
             }
+            if repeat_count > 1:
+                remote_frame['id'] = None
+                remote_frame['name'] = "%s repeated %s times" % (
+                                       " > ".join("%s()" % f.f_code.co_name 
+                                                  for f in entry_frames),
+                                       repeat_count,)
+                remote_frame['repeat_count'] = repeat_count
+                remote_frame['frames_count'] = repeat_count * len(entry_frames)
+            elif not self.lazy_scopes:
+                # At root frame, globals == locals so we dump only globals
+                if hasattr(frame_browser.f_back, 'f_back')\
+                        and frame_browser.f_back.f_back != self.frame_beginning:
+                    frame_locals = frame_browser.f_locals
+                else:
+                    frame_locals = None
+                frames_scopes.append((remote_frame, 
+                                      frame_locals, 
+                                      frame_browser.f_globals,))
             frames.append(remote_frame)
-            frame_browser = frame_browser.f_back
 
-        return frames        
+        variables_fingerprints = self.dump_frames_variables(frames_scopes, 
+                                                            variables_diff,
+                                                            objects)
+        return frames, variables_fingerprints
+
+    def get_stack_frames(self, start, levels=None):
+        """ Returns `levels` stack entries (all if None) of current stop 
+        starting at `start` (see `dump_frames()`). Frames are always sent
+        with all their variables (never as a diff).
+        
+        :return: a dict with `frames` and `stackDepth` (the count of 
+                 entries of the stack) plus `objects` with `intern_objects`.
+        """
+        stop = start + levels if levels is not None else None
+        objects = {} if self.intern_objects else None
+        frames = self.dump_stack_entries(self.stack_entries[start:stop], 
+                                         objects=objects)[0]
+        result = {
+            'frames': frames,
+            'stackDepth': len(self.stack_entries),
+        }
+        if objects is not None:
+            result['objects'] = objects
+        return result
+
+    def estimate_size(self, obj):
+        """ Returns an estimate of the JSON encoded size of a frame header or
+        a variable (a dict of str or int values).
+        """
+        return sum(len(k) + (len(v) if isinstance(v, basestring) else 20) + 6
+                   for k, v in obj.iteritems())
+
+    def dump_frames_variables(self, frames_scopes, variables_diff=False, objects=None):
+        """ Set variables in frames dumped by `dump_stack_entries()`. 
+
+        If `stop_budget` is set, variables are added by priority: top frame 
+        locals, then outer frames locals then globals (top to bottom) until
+        the estimated size of frames exceeds budget. Frames whose scopes have
+        not been (completely) dumped have a `deferred_scopes` list. Each 
+        deferred scope (`name`, `id`, `start` and `total_count`) is fetched 
+        on demand using `getProperties`.
+        
+        :param frames_scopes: a list of tuples (remote_frame, locals, 
+                              globals) where locals is None for module level
+                              frames.
+        :param variables_diff: see `diff_frame_variables()`.
+        :param objects: if not None, variables are interned in this table 
+                        (see `intern_variables()`).
+        :return: fingerprints of frames variables indexed by frame id. 
+        """
+        budget = self.stop_budget
+        if budget is not None:
+            budget -= sum(self.estimate_size(remote_frame) 
+                          for remote_frame, f_locals, f_globals in frames_scopes)
+        
+        scopes = [(idx, 'locals', f_locals) 
+                  for idx, (remote_frame, f_locals, f_globals) in enumerate(frames_scopes)
+                  if f_locals is not None]
+        scopes += [(idx, 'globals', f_globals) 
+                   for idx, (remote_frame, f_locals, f_globals) in enumerate(frames_scopes)]
+        
+        vars_lists = [{'locals': [], 'globals': []} for frame_scopes in frames_scopes]
+        deferred_scopes = [[] for frame_scopes in frames_scopes]
+        for idx, scope_name, scope_dict in scopes:
+            scope_handle = self.handles.get_handle(scope_dict)
+            if objects is not None and scope_handle in self.interned_scopes:
+                # already sent at this stop (eg. globals of a module)
+                vars_list, deferred_scope = self.interned_scopes[scope_handle]
+            else:
+                deferred_scope = None
+                if budget is None:
+                    vars_list = self.extract_object_properties(scope_dict, limit_size=True)
+                else:
+                    if budget <= 0:
+                        vars_list = []
+                    else:
+                        vars_list, budget = self.extract_scope_variables(scope_dict, 
+                                                                         budget)
+                    if len(vars_list) < len(scope_dict):
+                        deferred_scope = {
+                            'name': scope_name,
+                            'id': scope_handle,
+                            'start': len(vars_list),
+                            'total_count': len(scope_dict),
+                        }
+                if objects is not None:
+                    self.interned_scopes[scope_handle] = vars_list, deferred_scope
+            if deferred_scope:
+                deferred_scopes[idx].append(deferred_scope)
+            vars_lists[idx][scope_name] = vars_list
+
+        variables_fingerprints = {}
+        for idx, (remote_frame, f_locals, f_globals) in enumerate(frames_scopes):
+            locals_vars_list = vars_lists[idx]['locals']
+            globals_vars_list = vars_lists[idx]['globals']
+            # a diff is only meaningful between complete variables lists
+            if variables_diff and not deferred_scopes[idx]:
+                frame_fingerprints = self.diff_frame_variables(remote_frame,
+                                                               locals_vars_list,
+                                                               globals_vars_list)
+                variables_fingerprints[remote_frame['id']] = frame_fingerprints
+            else:
+                remote_frame['f_locals'] = locals_vars_list + globals_vars_list
+            if deferred_scopes[idx]:
+                remote_frame['deferred_scopes'] = deferred_scopes[idx]
+            if objects is not None:
+                self.intern_frame_variables(remote_frame, f_locals, f_globals, objects)
+        return variables_fingerprints
+
+    def extract_scope_variables(self, scope_dict, budget):
+        """ Extracts variables of a scope one by one until their estimated 
+        size (see `estimate_size()`) exceeds budget so that variables beyond
+        budget are not extracted. The budget bounds the variables list 
+        instead of `extract_object_properties()` count.
+        
+        :return: a tuple (vars_list, budget) where budget is what remains of
+                 budget, negative if extraction has been stopped by it.
+        """
+        vars_list = []
+        for a_var_name, a_var_value in self.iter_object_properties(scope_dict):
+            var = self.extract_variable(a_var_name, a_var_value, limit_size=True)
+            budget -= self.estimate_size(var)
+            if budget < 0:
+                break
+            vars_list.append(var)
+        return vars_list, budget
+
+    def intern_variables(self, vars_list, objects):
+        """ Moves `value`, `type`, `children_count` (and `array_kind`) of 
+        variables into the objects table indexed by their handle unless 
+        the object has already been sent at this stop.
+        
+        An object which is also a scope (eg. `locals()` passed as argument)
+        has both it's `properties` and it's value in the same entry.
+        
+        :return: variables as references, ie. dicts with `name` and `id`.
+        """
+        refs = []
+        for var in vars_list:
+            handle = var['id']
+            if handle is not None and handle not in self.interned_handles:
+                self.interned_handles.add(handle)
+                objects.setdefault(handle, {}).update((k, v) for k, v in var.iteritems() 
+                                                      if k not in ('id', 'name', 'scope',))
+            refs.append({'name': var['name'], 'id': handle})
+        return refs
+
+    def intern_frame_variables(self, remote_frame, f_locals, f_globals, objects):
+        """ Replaces frame's `f_locals` by a list of `scopes` (`name` and 
+        `id`) whose variables are in the objects table as a `properties` 
+        list of references (see `intern_variables()`). Variables of a
+        `f_locals_diff` are replaced by references.
+        """
+        if 'f_locals' in remote_frame:
+            del remote_frame['f_locals']
+            remote_frame['scopes'] = []
+            for scope_name, scope_dict in (('locals', f_locals),
+                                           ('globals', f_globals),):
+                if scope_dict is None:
+                    continue
+                scope_handle = self.handles.get_handle(scope_dict)
+                if scope_handle not in self.interned_scope_handles:
+                    self.interned_scope_handles.add(scope_handle)
+                    vars_list = self.interned_scopes[scope_handle][0]
+                    properties = self.intern_variables(vars_list, objects)
+                    objects.setdefault(scope_handle, {})['properties'] = properties
+                remote_frame['scopes'].append({'name': scope_name, 
+                                               'id': scope_handle})
+        else:
+            f_locals_diff = remote_frame['f_locals_diff']
+            for change in ('added', 'changed',):
+                vars_list = f_locals_diff[change]
+                refs = self.intern_variables(vars_list, objects)
+                for var, ref in zip(vars_list, refs):
+                    ref['scope'] = var['scope']
+                f_locals_diff[change] = refs
+
+    def diff_frame_variables(self, remote_frame, locals_vars_list, globals_vars_list):
+        """ Set frame's variables in remote_frame. If this frame has been sent
+        at previous stop, only variables added, changed or removed since then
+        are set in `f_locals_diff` along with `baseStopId` (the stop the
+        diff applies to). Else all variables are set in `f_locals`.
+        
+        A variable is identified by it's scope and name and is changed when
+        it's fingerprint (id() of it's value, type and hash of it's 
+        truncated value) is.
+        
+        :return: the fingerprints of frame's variables.
+        """
+        fingerprints = {}
+        variables = {}
+        for scope, vars_list in (('locals', locals_vars_list), 
+                                 ('globals', globals_vars_list),):
+            for var in vars_list:
+                handle = var['id']
+                value_id = id(self.handles.get_object(handle)) \
+                           if handle is not None else None
+                fingerprints[scope, var['name']] = (value_id, 
+                                                    var['type'], 
+                                                    hash(var['value']),)
+                variables[scope, var['name']] = var
+        
+        base_fingerprints = self.variables_fingerprints.get(remote_frame['id'])
+        if base_fingerprints is None:
+            remote_frame['f_locals'] = locals_vars_list + globals_vars_list
+            return fingerprints
+        
+        added = []
+        changed = []
+        for key, fingerprint in fingerprints.items():
+            base_fingerprint = base_fingerprints.get(key)
+            if base_fingerprint is None:
+                added.append(dict(variables[key], scope=key[0]))
+            elif base_fingerprint != fingerprint:
+                changed.append(dict(variables[key], scope=key[0]))
+        removed = [{'scope': scope, 'name': name} 
+                   for scope, name in base_fingerprints 
+                   if (scope, name) not in fingerprints]
+        remote_frame['baseStopId'] = self.stop_id - 1
+        remote_frame['f_locals_diff'] = {
+            'added': added,
+            'changed': changed,
+            'removed': removed,
+        }
+        return fingerprints
+
+    def get_scopes(self, frame_id):
+        """ Returns the variables scopes of the frame identified by frame_id 
+        (a handle).
+        Each scope is a dict with `name` ('locals' or 'globals'), `id` and 
+        `children_count` keys. Scope variables are fetched using 
+        `getProperties` with scope's `id`. Module level frames only have 
+        a 'globals' scope.
+
+        :raises KeyError: if frame_id is not a valid handle.
+        """
+        frame = self.handles.get_object(frame_id)
+        scopes = []
+        for scope_name, scope_dict in (('locals', frame.f_locals), 
+                                       ('globals', frame.f_globals),):
+            if scope_name == 'locals' and scope_dict is frame.f_globals:
+                continue
+            scopes.append({
+                'name': scope_name,
+                'id': self.handles.get_handle(scope_dict),
+                'children_count': len(scope_dict),
+            })
+        return scopes
 
     def evaluate(self, frame_id, expression, global_context=False, disable_break=False):
         """Evaluates 'expression' in the context of the frame identified by
-        'frame_id' or globally.
+        'frame_id' (a handle) or globally.
         Breakpoints are disabled depending on 'disable_break' value.
         Returns a tuple of value and type both as str.
         Note that - depending on the CGI_ESCAPE_EVALUATE_OUTPUT attribute - value is 
@@ -925,10 +2818,16 @@ class IKPdb(object):
             IKBreakpoint.disable_all_breakpoints()
 
         if frame_id and not global_context:
-            eval_frame = ctypes.cast(frame_id, ctypes.py_object).value
+            try:
+                eval_frame = self.handles.get_object(frame_id)
+            except KeyError:
+                if disable_break:
+                    IKBreakpoint.restore_breakpoints_state(breakpoints_backup)
+                return "Unknown frame: %s" % frame_id, 'IKPdbHandleError'
             global_vars = eval_frame.f_globals
             local_vars = eval_frame.f_locals
         else:
+            eval_frame = None
             global_vars = None
             local_vars = None
 
@@ -958,6 +2857,10 @@ class IKPdb(object):
                 result_type = t.__name__
             result_value = "%s: %s" % (result_type, result,)
 
+        # expression may have modified frame's locals
+        if eval_frame:
+            iksettrace._locals_to_fast(eval_frame)
+
         if disable_break:
             IKBreakpoint.restore_breakpoints_state(breakpoints_backup)
 
@@ -969,16 +2872,18 @@ class IKPdb(object):
         if self.CGI_ESCAPE_EVALUATE_OUTPUT:
             result_value = cgi.escape(result_value)
         
-        # We must check that result is json.dump compatible so that it can be sent back to client.
+        # We must check that result is utf8 so that it can be encoded to be 
+        # sent back to client.
         try:
-            json.dumps(result_value)
+            if isinstance(result_value, str):
+                result_value.decode('utf8')
         except:
             t, result = sys.exc_info()[:2]
             if isinstance(t, str):
                 result_type = t
             else: 
                 result_type = t.__name__
-            result_value = "<plaintext>%s: IKPdb is unable to JSON encode result to send it to "\
+            result_value = "<plaintext>%s: IKPdb is unable to encode result to send it to "\
                            "debugging client.\n"\
                            "  This typically occurs if you try to print a string that cannot be"\
                            " decoded to 'UTF-8'.\n"\
@@ -988,18 +2893,23 @@ class IKPdb(object):
 
     def let_variable(self, frame_id, var_name, expression_value):
         """ Let a frame's var with a value by building then eval a let 
-        expression with breakoints disabled.
+        expression with breakoints disabled. Frame is identified by frame_id 
+        (a handle).
         """
+        try:
+            eval_frame = self.handles.get_object(frame_id)
+        except KeyError:
+            return "Unknown frame: %s" % frame_id
         breakpoints_backup = IKBreakpoint.backup_breakpoints_state()
         IKBreakpoint.disable_all_breakpoints()
 
         let_expression = "%s=%s" % (var_name, expression_value,)
 
-        eval_frame = ctypes.cast(frame_id, ctypes.py_object).value
         global_vars = eval_frame.f_globals
         local_vars = eval_frame.f_locals
         try:
             exec(let_expression, global_vars, local_vars)
+            iksettrace._locals_to_fast(eval_frame)
             error_message=""
         except Exception as e:
             t, result = sys.exc_info()[:2]
@@ -1016,14 +2926,206 @@ class IKPdb(object):
                         error_message or 'succeed')
         return error_message
 
+    def tracing_required(self):
+        """ Checks wether debugged program must be traced: a step is pending,
+        a breakpoint (unless breakpoints are patched) or an exception 
+        breakpoint is active.
+        """
+        return self.pending_stop \
+            or IKBreakpoint.any_active_breakpoint and not self.code_patcher \
+            or self.break_on_raised or self.break_on_uncaught
+
+    def update_patched_breakpoints(self, c_file_name):
+        """ In 'patch' breakpoints mode, patch code of c_file_name so that 
+        debugger is called on all breakpoints lines (enabled or not as 
+        `_breakpoint_hook()` checks breakpoints state).
+        """
+        if self.code_patcher:
+            self.code_patcher.set_patched_lines(
+                c_file_name,
+                IKBreakpoint.breakpoints_files.get(c_file_name, [])
+            )
+
+    def _breakpoint_hook(self, line_number):
+        """ Called by code patched by IKCodePatcher each time a breakpoint line
+        is entered.
+        """
+        frame = sys._getframe(1)
+        if frame.f_trace is not None:
+            if self.tracing_enabled \
+                    and self.is_traced_thread(threading.currentThread().ident):
+                return  # line has already been handled by _tracer()
+            # left by a previous tracing session, it would freeze f_lineno
+            frame.f_trace = None
+        if self.is_skipped_frame(frame):
+            return
+        c_file_name = self.canonic(frame.f_code.co_filename)
+        if IKBreakpoint.lookup_effective_breakpoint(c_file_name, 
+                                                    line_number,
+                                                    frame):
+            # Like _tracer(), _line_tracer() must not be traced when it sets
+            # up a step
+            iksettrace._call_untraced(self._line_tracer, frame)
+
+    def set_exception_breakpoints(self, raised=False, uncaught=False, 
+                                  exception_types=None, include_library=False):
+        """ Setup exception breakpoints.
+        
+        :param raised: break where exceptions are raised (even if they are 
+                       caught later).
+        :param uncaught: break on exceptions propagating out of debugged 
+                         program or out of a thread.
+        :param exception_types: a list of exception class names (eg. 
+                                'KeyError' or 'openerp.exceptions.UserError')
+                                to break on. Subclasses match. All exceptions 
+                                if empty.
+        :param include_library: break on exceptions raised in skipped frames
+                                (see `skip`). If False, these exceptions are
+                                reported in the first unskipped frame they
+                                reach.
+        :return: exception breakpoints state as a dict
+        """
+        self.break_on_raised = bool(raised)
+        self.break_on_uncaught = bool(uncaught)
+        self.break_exception_types = frozenset(exception_types or [])
+        self.break_in_library = bool(include_library)
+        if self.break_on_raised or self.break_on_uncaught:
+            iksettrace._set_exception_resolver(self.native_exception_resolver)
+        else:
+            iksettrace._set_exception_resolver(None)
+        
+        if self.tracing_required():
+            if self.tracing_enabled:
+                # running frames may have been entered without local tracer
+                self.trace_running_frames()
+            self.enable_tracing()
+        else:
+            self.disable_tracing()
+        return {
+            'raised': self.break_on_raised,
+            'uncaught': self.break_on_uncaught,
+            'exception_types': sorted(self.break_exception_types),
+            'include_library': self.break_in_library,
+        }
+
+    def send_logpoints_hits(self):
+        """ Send all buffered logpoints hits to client using `logpointHits` 
+        messages of at most `LOGPOINTS_BATCH_SIZE` hits. Each message 
+        contains the number of hits dropped since previous one.
+        """
+        buffer = IKBreakpoint.logpoints_buffer
+        # so that hits popped by sender thread are sent before 'programEnd'
+        with self._logpoints_send_lock:
+            while len(buffer) or buffer.dropped_count:
+                hits, dropped_count = buffer.pop_batch(self.LOGPOINTS_BATCH_SIZE)
+                remote_client.send('logpointHits', 
+                                   result={'hits': hits, 
+                                           'dropped_count': dropped_count})
+
+    def logpoints_sender_loop(self):
+        """ Logpoints sender thread main loop: flushes logpoints hits every 
+        `LOGPOINTS_FLUSH_INTERVAL` seconds so that debugged threads never 
+        wait for the socket.
+        """
+        while self.status != 'terminated':
+            time.sleep(self.LOGPOINTS_FLUSH_INTERVAL)
+            try:
+                self.send_logpoints_hits()
+            except (IKPdbConnectionError, socket.error) as e:
+                _logger.b_error("Logpoints sender stopped (%s).", e)
+                return
+
+    def set_stats_enabled(self, enabled):
+        """ Enable or disable tracer statistics. Counters are reset when 
+        statistics are enabled.
+        """
+        if enabled and not self.stats_enabled:
+            self.stats_breaks = 0
+            self.stats_break_latency_total = 0.0
+            self.stats_break_latency_max = 0.0
+        self.stats_enabled = bool(enabled)
+        iksettrace._set_stats_enabled(self.stats_enabled)
+
+    def get_tracer_stats(self, max_files=None):
+        """ Returns tracer statistics collected since they have been enabled:
+        
+        * events received by tracer ('call', 'exception', 'line' and 'return')
+          globally, by thread and by file,
+        * python tracer callbacks made and avoided thanks to native filtering,
+        * time spent in python tracer (excluding time it was stopped),
+        * number of breaks and latency between break decision and 
+          'programBreak' sending.
+
+        :param max_files: return only the `max_files` files with most 'line'
+                          events.
+        :return: statistics as a dict
+        """
+        event_names = ('call', 'exception', 'line', 'return')
+        native_stats = iksettrace._get_stats()
+        
+        thread_names = dict((thread.ident, thread.name) 
+                            for thread in threading.enumerate())
+        threads = [{
+            'ident': thread_ident,
+            'name': thread_names.get(thread_ident, ''),
+            'events': dict(zip(event_names, counts)),
+        } for thread_ident, counts in native_stats['threads'].items()]
+        
+        files = sorted(native_stats['files'].items(), 
+                       key=lambda item: item[1][2],  # 'line' events count
+                       reverse=True)
+        if max_files is not None:
+            files = files[:max_files]
+        files = [{
+            'file_path': self.normalize_path_out(file_name),
+            'events': dict(zip(event_names, counts)),
+        } for file_name, counts in files]
+
+        events = sum(native_stats['events'])
+        callbacks = sum(native_stats['callbacks'])
+        return {
+            'enabled': self.stats_enabled,
+            'events': dict(zip(event_names, native_stats['events'])),
+            'callbacks': dict(zip(event_names, native_stats['callbacks'])),
+            'callbacks_avoided': events - callbacks,
+            'tracer_time': native_stats['tracer_time'],
+            'breaks': self.stats_breaks,
+            'break_latency_avg': self.stats_break_latency_total / self.stats_breaks \
+                                 if self.stats_breaks else 0.0,
+            'break_latency_max': self.stats_break_latency_max,
+            'threads': threads,
+            'files': files,
+        }
+
+    def update_native_step_state(self):
+        """Copy stepping state into iksettrace so that 'line' events can be 
+        filtered natively. Must be called by all setup_xxx() methods.
+        """
+        iksettrace._set_step_state(self.frame_stop,
+                                   self.frame_return,
+                                   self.frame_calling,
+                                   self.frame_suspend)
+
+    def trace_step_frames(self, frame):
+        """Ensure that frame and `frame_return` have a local trace function as 
+        'call' events may have returned None for them (see `_tracer()`), then
+        enable tracing if required (eg. after set_trace()).
+        """
+        frame.f_trace = self._tracer
+        if self.frame_return and self.frame_return != self.frame_beginning:
+            self.frame_return.f_trace = self._tracer
+        self.enable_tracing()
+
     def setup_step_over(self, frame):
         """Setup debugger for a "stepOver"
         """
         self.frame_calling = None
         self.frame_stop = frame
-        self.frame_return = frame.f_back
+        self.frame_return = self.unskipped_caller(frame)
         self.frame_suspend = False
         self.pending_stop = True 
+        self.update_native_step_state()
+        self.trace_step_frames(frame)
         return
 
     def setup_step_into(self, frame, pure=False):
@@ -1032,11 +3134,15 @@ class IKPdb(object):
         self.frame_calling = frame
         if pure:
             self.frame_stop = None
+            self.frame_return = None
         else:
             self.frame_stop = frame
-        self.frame_return = None
+            # stops in caller if line returns without any call
+            self.frame_return = self.unskipped_caller(frame)
         self.frame_suspend = False
         self.pending_stop = True 
+        self.update_native_step_state()
+        self.trace_step_frames(frame)
         return
 
     def setup_step_out(self, frame):
@@ -1044,21 +3150,131 @@ class IKPdb(object):
         """
         self.frame_calling = None
         self.frame_stop = None
-        self.frame_return = frame.f_back
+        self.frame_return = self.unskipped_caller(frame)
         self.frame_suspend = False
         self.pending_stop = True 
+        self.update_native_step_state()
+        self.trace_step_frames(frame)
         return
 
+    def suspend_target_thread(self):
+        """ Returns ident of thread to suspend: debugged thread if any, else
+        thread running debugged program, else any thread but debugger's one.
+        """
+        current_frames = sys._current_frames()
+        if self.debugged_thread_ident in current_frames:
+            return self.debugged_thread_ident
+        thread_idents = [thread.ident for thread in threading.enumerate()
+                         if thread.ident in current_frames 
+                         and self.is_traced_thread(thread.ident)]
+        for thread_ident in thread_idents:
+            a_frame = current_frames[thread_ident]
+            while a_frame:
+                if a_frame is self.frame_beginning:
+                    return thread_ident
+                a_frame = a_frame.f_back
+        return thread_idents[0] if thread_idents else None
+
     def setup_suspend(self):
-        """Setup debugger to "suspend" execution
+        """Setup debugger to "suspend" execution. Instead of tracing all 
+        threads, we arm a one-shot trace on the current stack of the thread to
+        suspend so that other threads run untraced.
+        
+        :return: thread ident and frame where thread is running or 
+                 (None, None) if there is no thread to suspend.
         """
+        thread_ident = self.suspend_target_thread()
+        if thread_ident is None:
+            return None, None
+        if thread_ident != self.debugged_thread_ident:
+            self.set_debugged_thread(thread_ident)
+        
         self.frame_calling = None
         self.frame_stop = None
         self.frame_return = None
         self.frame_suspend = True
         self.pending_stop = True
-        self.enable_tracing()
-        return
+        self.update_native_step_state()
+
+        frame = sys._current_frames().get(thread_ident)
+        a_frame = frame
+        while a_frame:
+            if not self.is_skipped_frame(a_frame):
+                a_frame.f_trace = self._tracer
+            a_frame = a_frame.f_back
+        if self.tracing_enabled:
+            # With 'gated' backend, line tracing of running frame may be off
+            self.update_threads_tracing()
+        else:
+            self.enable_tracing()
+        return thread_ident, frame
+
+    def execute_inspection_command(self, command):
+        """ Executes one of the read-only `INSPECTION_COMMANDS` received by
+        stopped thread (see `_line_tracer()`) and replies to remote client.
+        """
+        if command['cmd'] == 'getScopes':
+            error_messages = []
+            try:
+                result = {'scopes': self.get_scopes(command['frame'])}
+                command_exec_status = 'ok'
+            except KeyError:
+                result = {'scopes': []}
+                command_exec_status = 'error'
+                error_messages = ["Unknown frame: %s" % command['frame']]
+            _logger.e_debug("    => %s", result)
+            remote_client.reply(command['obj'], result, 
+                                command_exec_status=command_exec_status,
+                                error_messages=error_messages)
+
+        elif command['cmd'] == 'getStackFrames':
+            result = self.get_stack_frames(command['start'], 
+                                           command['levels'])
+            _logger.e_debug("    => %s", result)
+            remote_client.reply(command['obj'], result)
+
+        elif command['cmd'] == 'getProperties':
+            error_messages = []
+            try:
+                result = self.get_properties(command['id'],
+                                             start=command['start'],
+                                             count=command['count'],
+                                             name_filter=command['filter'],
+                                             with_children_count=command['children_count'])
+                command_exec_status = 'ok'
+            except KeyError:
+                result = {'properties': [], 'total_count': 0}
+                command_exec_status = 'error'
+                error_messages = ["Unknown variable: %s" % command['id']]
+                
+            _logger.e_debug("    => %s", result)
+            remote_client.reply(command['obj'], result, 
+                                command_exec_status=command_exec_status,
+                                error_messages=error_messages)
+
+        elif command['cmd'] == 'getArraySlice':
+            error_messages = []
+            try:
+                a_value = self.handles.get_object(command['id'])
+                result = {
+                    'values': self.array_summarizer.get_slice(a_value,
+                                                              command['start'],
+                                                              command['stop']),
+                    'total_count': len(a_value),
+                }
+                command_exec_status = 'ok'
+            except KeyError:
+                result = {}
+                command_exec_status = 'error'
+                error_messages = ["Unknown variable: %s" % command['id']]
+            except Exception as e:
+                result = {}
+                command_exec_status = 'error'
+                error_messages = ["getArraySlice() failed with error: %s: %s" % (
+                                  e.__class__.__name__, e,)]
+            remote_client.reply(command['obj'], result, 
+                                command_exec_status=command_exec_status,
+                                error_messages=error_messages)
 
     def setup_resume(self):
         """ Setup debugger to "resume" execution
@@ -1068,7 +3284,8 @@ class IKPdb(object):
         self.frame_return = None
         self.frame_suspend = False
         self.pending_stop = False
-        if not IKBreakpoint.any_active_breakpoint:
+        self.update_native_step_state()
+        if not self.tracing_required():
             self.disable_tracing()
         return
 
@@ -1086,10 +3303,7 @@ class IKPdb(object):
         Note that we test 'step into' first to give a chance to 'stepOver' in
         case user click on 'stepInto' on a 'no call' line.
         """
-        # TODO: Optimization => defines a set of modules / names where _tracer
-        # is never registered. This will replace skip
-        #if self.skip and self.is_skipped_module(frame.f_globals.get('__name__')):
-        #    return False
+        # Note that skipped frames are filtered at 'call' time by _tracer()
 
         # step into
         if self.frame_calling and self.frame_calling==frame.f_back:
@@ -1133,7 +3347,8 @@ class IKPdb(object):
                 "ident": thread_ident,
                 "name": thread.name,
                 "is_debugger": thread_ident == self.debugger_thread_ident,
-                "debugged": thread_ident == self.debugged_thread_ident
+                "debugged": thread_ident == self.debugged_thread_ident,
+                "traced": self.is_traced_thread(thread_ident)
             }
         return thread_list
             
@@ -1143,6 +3358,10 @@ class IKPdb(object):
         if target_thread_ident is None:
             self.debugged_thread_ident = None
             self.debugged_thread_name = ''
+            if self.tracing_enabled:
+                # trace all threads (or traced threads)
+                self.trace_running_frames()
+                self.update_threads_tracing()
             return {
                 "result": self.get_threads(),
                 "error": ""
@@ -1163,6 +3382,45 @@ class IKPdb(object):
         
         self.debugged_thread_ident = target_thread_ident
         self.debugged_thread_name = thread_list[target_thread_ident]['name']
+        if self.tracing_enabled:
+            # move tracing to debugged thread
+            self.trace_running_frames()
+            self.update_threads_tracing()
+        return {
+            "result": self.get_threads(),
+            "error": ""
+        }
+
+    def set_traced_threads(self, target_thread_idents=None):
+        """ Allows to set the threads which may be debugged (the first one 
+        to break becomes the debugged thread) or to reset to all threads 
+        with None. Other threads are not traced. Debugged thread is reset if
+        it is not one of them.
+        """
+        thread_list = self.get_threads()
+        if target_thread_idents is not None:
+            target_thread_idents = set(target_thread_idents)
+            for target_thread_ident in target_thread_idents:
+                if target_thread_ident not in thread_list:
+                    return {
+                        "result": None,
+                        "error": "No thread with ident:%s." % target_thread_ident
+                    }
+                if thread_list[target_thread_ident]['is_debugger']:
+                    return {
+                        "result": None,
+                        "error": "Cannot debug IKPdb tracer (sadly...)."
+                    }
+
+        self.traced_thread_idents = target_thread_idents
+        if target_thread_idents is not None \
+                and self.debugged_thread_ident not in target_thread_idents:
+            self.debugged_thread_ident = None
+            self.debugged_thread_name = ''
+        if self.tracing_enabled:
+            # move tracing to traced threads
+            self.trace_running_frames()
+            self.update_threads_tracing()
         return {
             "result": self.get_threads(),
             "error": ""
@@ -1172,29 +3430,35 @@ class IKPdb(object):
         """This function is called when debugger has decided that it must
         stop or break at this frame.
         """
-        # next logging statement commented for performance
+        # Note that should_break_here() must not be called here as it 
+        # updates breakpoints hit count.
         _logger.f_debug("user_line() with " 
                         "threadName=%s, frame=%s, frame.f_code=%s, self.mainpyfile=%s,"
-                        "self.should_break_here()=%s, self.should_stop_here()=%s\n",
+                        "self.should_stop_here()=%s\n",
                          threading.currentThread().name,
                          hex(id(frame)),
                          frame.f_code,
                          self.mainpyfile,
-                         self.should_break_here(frame),
                          self.should_stop_here(frame))
 
         # next lines allow to focus debugging on only one thread
         if self.debugged_thread_ident is None:
+            if not self.is_traced_thread(threading.currentThread().ident):
+                return
             self.debugged_thread_ident = threading.currentThread().ident
             self.debugged_thread_name = threading.currentThread().name
+            if self.tracing_enabled:
+                self.update_threads_tracing()  # stop tracing other threads
         else:
             if threading.currentThread().ident != self.debugged_thread_ident:
                 return
 
+        break_time = time.time()  # see tracer statistics
+
         # Acquire Breakpoint Lock before sending break command to remote client
         self._active_breakpoint_lock.acquire()
         self.status = 'stopped'
-        frames = self.dump_frames(frame)
+        frames, objects = self.dump_frames(frame)
         exception=None
         warning_messages = []
 
@@ -1211,10 +3475,21 @@ class IKPdb(object):
 
         remote_client.send('programBreak', 
                            frames=frames,
+                           objects=objects,
                            threads= self.get_threads(),
-                           result={'executionStatus': 'stopped'},  # == self.status
+                           result={'executionStatus': 'stopped',  # == self.status
+                                   'stopId': self.stop_id,
+                                   'stackDepth': len(self.stack_entries)},
                            warning_messages=warning_messages,
                            exception=exception)
+        
+        if self.stats_enabled:
+            break_latency = time.time() - break_time
+            self.stats_breaks += 1
+            self.stats_break_latency_total += break_latency
+            self.stats_break_latency_max = max(self.stats_break_latency_max,
+                                               break_latency)
+        stop_time = time.time()  # excluded from tracer time statistics
                            
         # Waits for command to resume among:
         # - resume
@@ -1246,22 +3521,12 @@ class IKPdb(object):
                                                    command['expression'], 
                                                    command['global'], 
                                                    disable_break=command['disableBreak'])
+                # expression may have changed variables
+                self.clear_variables_caches()
                 remote_client.reply(command['obj'], {'value': value, 'type': result_type})
             
-            elif command['cmd'] == 'getProperties':
-                error_messages = []
-                if command.get('id', False):
-                    po_value = ctypes.cast(command['id'], ctypes.py_object).value
-                    result={'properties': self.extract_object_properties(po_value) or []}
-                    command_exec_status = 'ok'
-                else:
-                    result={'properties': self.extract_object_properties(None) or []}
-                    command_exec_status = 'ok'
-                    
-                _logger.e_debug("    => %s", result)
-                remote_client.reply(command['obj'], result, 
-                                    command_exec_status=command_exec_status,
-                                    error_messages=error_messages)
+            elif command['cmd'] in self.INSPECTION_COMMANDS:
+                self.execute_inspection_command(command)
 
             elif command['cmd'] == 'setVariable':
                 error_messages = []
@@ -1271,6 +3536,7 @@ class IKPdb(object):
                 err_message = self.let_variable(command['frame'], 
                                                 command['name'], 
                                                 command['value'])
+                self.clear_variables_caches()
                 if err_message:
                     command_exec_status = 'error'
                     msg = "setVariable(%s=%s) failed with error: %s" % (command['name'], 
@@ -1292,12 +3558,19 @@ class IKPdb(object):
                 _logger.x_critical("Unknown command: %s received by _line_tracer()" % resume_command)
                 raise IKPdbQuit()
             
+        self.stack_entries = []
+        self.handles.release()
         self.status = 'running'
+        if self.stats_enabled:
+            iksettrace._add_stats_stopped_time(time.time() - stop_time)
         self._active_breakpoint_lock.release()
         return
 
     def _tracer(self, frame, event, arg):
         if event == 'line':
+            # Note that when tracing is enabled with iksettrace, 'line' events
+            # are filtered natively so we only get here on lines where 
+            # debugger may stop.
             
             # For the sake of performance, we inlined following code in
             # this method. 
@@ -1308,21 +3581,23 @@ class IKPdb(object):
             # return self._tracer
 
             # should_stop_here() inlined version
-            if self.pending_stop and (
+            must_stop = self.pending_stop and (
                 (self.frame_calling and self.frame_calling==frame.f_back)
                         or frame==self.frame_stop
                         or frame==self.frame_return
-                        or self.frame_suspend
-                        or self.should_break_here(frame)):
-                self._line_tracer(frame)
+                        or self.frame_suspend)
             
-            # self.should_break_here() inlined version 
+            # self.should_break_here() inlined version. It is always evaluated
+            # (once) to maintain breakpoints hit counts.
             c_file_name = self.canonic(frame.f_code.co_filename)  # TODO inline this too !!!
             if c_file_name in IKBreakpoint.breakpoints_files:
                 if IKBreakpoint.lookup_effective_breakpoint(c_file_name, 
                                                             frame.f_lineno,
                                                             frame):
-                    self._line_tracer(frame)
+                    must_stop = True
+            
+            if must_stop:
+                self._line_tracer(frame)
             return self._tracer
         
         if event == 'call':
@@ -1339,16 +3614,102 @@ class IKPdb(object):
                 # the tracer.
                 if self.stop_at_first_statement:
                     self.setup_step_into(frame, pure=True)
-                if self.pending_stop or IKBreakpoint.any_active_breakpoint:
+                if self.tracing_required():
                     self.enable_tracing()
                 else:
                     sys.settrace(None)  # we remove limited tracing
+                return self._tracer
+
+            if self.is_skipped_frame(frame):
+                if self.break_on_raised and self.break_in_library \
+                        or self.break_on_uncaught and self.is_uncaught_boundary(frame):
+                    return self._exception_tracer
+                return None
+
+            # "Just My Code": stepInto a skipped function stops at first 
+            # unskipped frame it calls.
+            if self.frame_calling and frame.f_back != self.frame_calling \
+                    and self.unskipped_caller(frame) == self.frame_calling:
+                self.frame_stop = frame
+                self.update_native_step_state()
+
+            # Frames are only traced if debugger may stop in them: stepInto 
+            # target, suspend or breakpoint. stepOver and stepOut targets are 
+            # already traced (see trace_step_frames()) so deeper calls are not.
+            if (self.frame_calling and self.frame_calling == frame.f_back) \
+                    or frame == self.frame_stop \
+                    or self.frame_suspend \
+                    or self.code_has_breakpoint(frame.f_code):
+                return self._tracer
+            
+            # To catch uncaught exceptions we only need to trace frames where 
+            # debugged program starts.
+            if self.break_on_uncaught:
+                if frame.f_back and frame.f_back.f_trace is None \
+                        and self.is_uncaught_boundary(frame.f_back):
+                    frame.f_back.f_trace = self._exception_tracer
+                if self.is_uncaught_boundary(frame):
+                    return self._tracer
+            
+            # Raised exceptions only require 'exception' events. As frame has
+            # no breakpoint nor step, iksettrace filters all it's 'line' 
+            # events.
+            if self.break_on_raised:
+                return self._exception_tracer
+            return None
+        
+        if event == 'return':
+            # iksettrace only sends 'return' events of frame_return. If it 
+            # returns without any 'line' event (eg. "return f()"), step target
+            # becomes it's caller.
+            if self.pending_stop and frame == self.frame_return:
+                caller = self.unskipped_caller(frame)
+                if caller and caller != self.frame_beginning:
+                    caller.f_trace = self._tracer
+                    self.frame_return = caller
+                else:
+                    self.frame_return = None
+                self.update_native_step_state()
+            return self._tracer
+        
+        if event == 'exception':
+            # iksettrace only sends exceptions that pass exception breakpoints
+            # types filter
+            if self.break_on_raised or self.break_on_uncaught:
+                self.trace_exception(frame, arg)
             return self._tracer
         
-        # Note that event = 'return', returned value is ignored
-        # TODO: Use event = 'exception' to trace exception
         return self._tracer
 
+    def _exception_tracer(self, frame, event, arg):
+        """ Local trace function for frames which are traced only to report
+        exceptions (eg. skipped frames).
+        """
+        if event == 'exception':
+            self.trace_exception(frame, arg)
+        return self._exception_tracer
+
+    def trace_exception(self, frame, exc_info):
+        """ Called on 'exception' events. Breaks if exception has been raised
+        in this frame (see `is_raised_here()`) or if exception is propagating
+        out of debugged program.
+        """
+        callee_traceback = exc_info[2].tb_next if exc_info[2] else None
+        if self.break_on_uncaught and callee_traceback \
+                and self.is_uncaught_boundary(frame) \
+                and not self.is_uncaught_boundary(callee_traceback.tb_frame):
+            # Break where exception has been raised as post_mortem() does
+            self.uncaught_exception_traceback = exc_info[2]
+            while callee_traceback.tb_next:
+                callee_traceback = callee_traceback.tb_next
+            self._line_tracer(callee_traceback.tb_frame, 
+                              exc_info=self.normalize_exc_info(exc_info))
+            return
+        
+        if self.break_on_raised and self.is_raised_here(callee_traceback):
+            self._line_tracer(frame, exc_info=self.normalize_exc_info(exc_info))
+        return
+
     def dump_tracing_state(self, context):
         """ A debug tool to dump all threads tracing state 
         """
@@ -1383,28 +3744,98 @@ class IKPdb(object):
     def enable_tracing(self):
         """ Enable tracing if it is disabled and debugged program is running, 
         else do nothing.
-        Do this on all threads but the debugger thread.
+        Do this on all threads but the debugger thread or only on debugged
+        thread once it is defined (see `is_traced_thread()`).
         :return: True if tracing has been enabled, False else.
         """
         _logger.x_debug("enable_tracing()")
         #self.dump_tracing_state("before enable_tracing()")
         
         if not self.tracing_enabled and self.execution_started:
-            # Restore or set trace function on all existing frames appart from 
-            # debugger
-            threading.settrace(self._tracer)  # then enable on all threads to come
-            for thr in threading.enumerate():
-                if thr.ident != self.debugger_thread_ident:  # skip debugger thread
-                    a_frame = sys._current_frames()[thr.ident]
-                    while a_frame:
-                        a_frame.f_trace = self._tracer
-                        a_frame = a_frame.f_back
-            iksettrace._set_trace_on(self._tracer, self.debugger_thread_ident)
+            iksettrace._set_gated_tracing(self.tracing_backend == 'gated')
+            threading.settrace(self._thread_tracer)  # then enable on all threads to come
+            self.trace_running_frames()
+            self.update_threads_tracing()
             self.tracing_enabled = True
         
         #self.dump_tracing_state("after enable_tracing()")
         return self.tracing_enabled
 
+    def trace_running_frames(self):
+        """ Restore or set trace function on all existing frames of traced
+        threads.
+        """
+        current_frames = sys._current_frames()
+        for thr in threading.enumerate():
+            if self.is_traced_thread(thr.ident):
+                a_frame = current_frames.get(thr.ident)
+                while a_frame:
+                    if not self.is_skipped_frame(a_frame):
+                        a_frame.f_trace = self._tracer
+                    a_frame = a_frame.f_back
+        if self.tracing_enabled:
+            # With 'gated' backend, line tracing of running frames may be off
+            self.update_threads_tracing()
+
+    def untrace_running_frames(self):
+        """ Remove trace function from all existing frames appart from 
+        debugger's ones. While a frame has a trace function, it's f_lineno is
+        only updated by 'line' events.
+        """
+        current_frames = sys._current_frames()
+        for thread_ident, a_frame in current_frames.items():
+            if thread_ident != self.debugger_thread_ident:
+                while a_frame:
+                    a_frame.f_trace = None
+                    a_frame = a_frame.f_back
+
+    def is_traced_thread(self, thread_ident):
+        """ Until a thread is debugged, all threads but the debugger's ones
+        (or only `traced_thread_idents` if set) are traced. Then, as 
+        _line_tracer() ignores other threads, only the debugged thread is 
+        traced.
+        """
+        if thread_ident == self.debugger_thread_ident \
+                or thread_ident == self.logpoints_sender_ident:
+            return False
+        if self.debugged_thread_ident is not None:
+            return thread_ident == self.debugged_thread_ident
+        return self.traced_thread_idents is None \
+            or thread_ident in self.traced_thread_idents
+
+    def update_threads_tracing(self):
+        """ Install iksettrace tracer on traced threads and remove it from
+        others (see `is_traced_thread()`).
+        """
+        if self.debugged_thread_ident is None and self.traced_thread_idents is None:
+            iksettrace._set_trace_on(self._tracer, self.debugger_thread_ident)
+            if self.logpoints_sender_ident:
+                iksettrace._set_trace_off(self.logpoints_sender_ident)
+        else:
+            iksettrace._set_trace_off()
+            if self.debugged_thread_ident is not None:
+                thread_idents = (self.debugged_thread_ident,)
+            else:
+                thread_idents = self.traced_thread_idents
+            for thread_ident in thread_idents:
+                iksettrace._set_trace_on(self._tracer, 
+                                         self.debugger_thread_ident,
+                                         thread_ident)
+
+    def _thread_tracer(self, frame, event, arg):
+        """ Trace function installed by threading.settrace() in threads 
+        started while tracing is enabled. On first event, it replaces itself
+        by iksettrace tracer if thread is traced or removes tracing.
+        """
+        current_thread_ident = threading.currentThread().ident
+        if self.tracing_enabled and self.is_traced_thread(current_thread_ident):
+            iksettrace._set_trace_on(self._tracer, 
+                                     self.debugger_thread_ident,
+                                     current_thread_ident)
+            return self._tracer(frame, event, arg)
+        sys.settrace(None)
+        return None
+
     def disable_tracing(self):
         """ Disable tracing if it is disabled and debugged program is running, 
         else do nothing.
@@ -1417,28 +3848,53 @@ class IKPdb(object):
         if self.tracing_enabled and self.execution_started:
             threading.settrace(None)  # don't trace threads to come
             iksettrace._set_trace_off()
+            self.untrace_running_frames()
             self.tracing_enabled = False
         #self.dump_tracing_state("after disable_tracing()")
         return self.tracing_enabled
 
-    def set_breakpoint(self, file_name, line_number, condition=None, enabled=True):
+    def set_breakpoint(self, file_name, line_number, condition=None, enabled=True,
+                       ignore_count=0, every_nth_hit=0, action='break', 
+                       expressions=None):
         """ Create a breakpoint, register it in the class's lists and returns
-        a tuple of (error_message, break_number)
+        a tuple of (error_message, break_number). With action 'log', 
+        breakpoint is a logpoint (see :class:`IKBreakpoint`).
         """
         c_file_name = self.canonic(file_name)
         import linecache
         line = linecache.getline(c_file_name, line_number)
         if not line:
             return "Line %s:%d does not exist." % (c_file_name, line_number), None
-        bp = IKBreakpoint(c_file_name, line_number, condition, enabled)
-        if self.pending_stop or IKBreakpoint.any_active_breakpoint:
+        try:
+            bp = IKBreakpoint(c_file_name, line_number, condition, enabled,
+                              ignore_count=ignore_count, 
+                              every_nth_hit=every_nth_hit,
+                              action=action,
+                              expressions=expressions)
+        except IKBreakpointError as e:
+            return str(e), None
+        except Exception as e:
+            return "Invalid condition '%s' (%s: %s)." % (condition, 
+                                                         e.__class__.__name__,
+                                                         e,), None
+        self.update_patched_breakpoints(c_file_name)
+        if self.tracing_required():
+            if self.tracing_enabled:
+                # running frames may have been entered without local tracer
+                self.trace_running_frames()
             self.enable_tracing()
         else:
             self.disable_tracing()
         return None, bp.number
 
-    def change_breakpoint_state(self, bp_number, enabled, condition=None):
-        """ Change breakpoint status or `condition` expression.
+    def change_breakpoint_state(self, bp_number, enabled, condition=None, 
+                                ignore_count=None, every_nth_hit=None,
+                                action=None, expressions=None):
+        """ Change breakpoint status, `condition` expression, `ignore_count`,
+        `every_nth_hit`, `action` or logpoint `expressions`. `ignore_count`, 
+        `every_nth_hit` and `action` are left unchanged when None. 
+        `expressions` are left unchanged when both `action` and `expressions`
+        are None.
         
         :param bp_number: number of breakpoint to change 
         :return: None or an error message (string)
@@ -1454,10 +3910,35 @@ class IKPdb(object):
                         enabled,
                         repr(condition),
                         bp)
+        # compile everything first so that breakpoint is left unchanged if
+        # condition, action or expressions are invalid
+        try:
+            compiled_condition = IKBreakpoint.compile_condition(condition)
+        except Exception as e:
+            return "Invalid condition '%s' (%s: %s)." % (condition, 
+                                                         e.__class__.__name__,
+                                                         e,)
+        compiled_action = None
+        if action is not None or expressions is not None:
+            try:
+                compiled_action = IKBreakpoint.compile_action(
+                    action or bp.action, 
+                    bp.expressions if expressions is None else expressions)
+            except IKBreakpointError as e:
+                return str(e)
+        bp.apply_condition(condition, compiled_condition)  # update condition for conditional breakpoints
+        if compiled_action is not None:
+            bp.apply_action(compiled_action)
         bp.enabled = enabled
-        bp.condition = condition  # update condition for conditional breakpoints
+        if ignore_count is not None:
+            bp.ignore_count = ignore_count
+        if every_nth_hit is not None:
+            bp.every_nth_hit = every_nth_hit
         IKBreakpoint.update_active_breakpoint_flag()  # force flag refresh
-        if self.pending_stop or IKBreakpoint.any_active_breakpoint:
+        if self.tracing_required():
+            if self.tracing_enabled and enabled:
+                # running frames may have been entered without local tracer
+                self.trace_running_frames()
             self.enable_tracing()
         else:
             self.disable_tracing()
@@ -1479,7 +3960,8 @@ class IKPdb(object):
                         breakpoint_number,
                         bp)
         bp.clear()
-        if self.pending_stop or IKBreakpoint.any_active_breakpoint:
+        self.update_patched_breakpoints(bp.file_name)
+        if self.tracing_required():
             self.enable_tracing()
         else:
             self.disable_tracing()
@@ -1506,6 +3988,16 @@ class IKPdb(object):
         globals = __main__.__dict__
         locals = globals
 
+        if self.code_patcher:
+            # debugged script code must be patched before it runs. Like 
+            # execfile(), we run it from a '<string>' frame.
+            with open(filename, 'rU') as script_file:
+                script_code = self.code_patcher.patch_code(
+                    compile(script_file.read() + '\n', filename, 'exec')
+                )
+            statement = 'exec(script_code, script_globals)\n'
+            locals = {'script_code': script_code, 'script_globals': globals}
+
         # When IKPdb sets tracing, a number of call and line events happens
         # BEFORE debugger even reaches user's code (and the exact sequence of
         # events depends on python version). So we take special measures to
@@ -1551,12 +4043,22 @@ class IKPdb(object):
                 line_number = args['line_number']
                 condition = args.get('condition', '')
                 enabled = args.get('enabled', True)
+                ignore_count = args.get('ignore_count', 0)
+                every_nth_hit = args.get('every_nth_hit', 0)
+                action = args.get('action', 'break')
+                expressions = args.get('expressions', [])
                 _logger.b_debug("setBreakpoint(file_name=%s, line_number=%s,"
-                                " condition=%s, enabled=%s) with CWD=%s",
+                                " condition=%s, enabled=%s, ignore_count=%s, "
+                                "every_nth_hit=%s, action=%s, expressions=%s)"
+                                " with CWD=%s",
                                 file_name,
                                 line_number,
                                 condition,
                                 enabled,
+                                ignore_count,
+                                every_nth_hit,
+                                action,
+                                expressions,
                                 os.getcwd())
                 
                 error_messages = []
@@ -1574,7 +4076,11 @@ class IKPdb(object):
                     err, bp_number = self.set_breakpoint(c_file_name, 
                                                          line_number, 
                                                          condition=condition,
-                                                         enabled=enabled)
+                                                         enabled=enabled,
+                                                         ignore_count=ignore_count,
+                                                         every_nth_hit=every_nth_hit,
+                                                         action=action,
+                                                         expressions=expressions)
                     if err:
                         _logger.g_error("setBreakpoint error: %s", err)
                         msg = "IKPdb error: Failed to set a breakpoint at %s:%s "\
@@ -1604,7 +4110,11 @@ class IKPdb(object):
                 else:
                     err = self.change_breakpoint_state(bp_number,
                                                        args.get('enabled', False), 
-                                                       condition=args.get('condition', ''))
+                                                       condition=args.get('condition', ''),
+                                                       ignore_count=args.get('ignore_count'),
+                                                       every_nth_hit=args.get('every_nth_hit'),
+                                                       action=args.get('action'),
+                                                       expressions=args.get('expressions'))
                     result = {}
                     error_messages = []
                     if err:
@@ -1643,6 +4153,32 @@ class IKPdb(object):
                                     command_exec_status=command_exec_status,
                                     error_messages=error_messages)
             
+            elif command == "setExceptionBreakpoints":
+                # Define on which exceptions debugger breaks
+                _logger.b_debug("setExceptionBreakpoints(%s)", args)
+                exception_types = args.get('exception_types', [])
+                if isinstance(exception_types, basestring):
+                    exception_types = [exception_types]
+                result = self.set_exception_breakpoints(
+                    raised=args.get('raised', False),
+                    uncaught=args.get('uncaught', False),
+                    exception_types=exception_types,
+                    include_library=args.get('include_library', False)
+                )
+                remote_client.reply(obj, result)
+            
+            elif command == "getTracerStats":
+                # Allows to enable, disable or reset tracer statistics and
+                # returns them
+                _logger.x_debug("getTracerStats(%s)", args)
+                if args.get('reset', False):
+                    self.set_stats_enabled(False)
+                    self.set_stats_enabled(True)
+                if 'enabled' in args:
+                    self.set_stats_enabled(args['enabled'])
+                result = self.get_tracer_stats(max_files=args.get('max_files', 20))
+                remote_client.reply(obj, result)
+
             elif command == 'runScript':
                 #TODO: handle a 'stopAtEntry' arg
                 _logger.x_debug("runScript(%s)", args)
@@ -1651,10 +4187,12 @@ class IKPdb(object):
 
             elif command == 'suspend':
                 _logger.x_debug("suspend(%s)", args)
-                self.setup_suspend()
-                # We return a running status which is True at that point. Next 
-                # programBreak will change status to 'stopped'
-                remote_client.reply(obj, {'executionStatus': 'running'})
+                thread_ident, frame = self.setup_suspend()
+                # We return a 'suspending' status. Suspended thread sends 
+                # programBreak from it's own trace function as soon as it runs
+                # Python code (a thread blocked in native code breaks once 
+                # native call returns).
+                remote_client.reply(obj, {'executionStatus': 'suspending' if frame else 'running'})
                 
             elif command == 'resume':
                 _logger.x_debug("resume(%s)", args)
@@ -1679,7 +4217,7 @@ class IKPdb(object):
 
             elif command == 'evaluate':
                 _logger.e_debug("evaluate(%s)", args)
-                if self.tracing_enabled and self.status == 'stopped':
+                if self.status == 'stopped':
                     self._command_q.put({
                         'cmd':'evaluate',
                         'obj': obj,
@@ -1692,21 +4230,64 @@ class IKPdb(object):
                 else:
                     remote_client.reply(obj, {'value': None, 'type': None})
                     
+            elif command == 'getScopes':
+                _logger.e_debug("getScopes(%s)", args)
+                if self.status == 'stopped':
+                    self._command_q.put({
+                        'cmd':'getScopes',
+                        'obj': obj,
+                        'frame': args['frame']
+                    })
+                    # reply will be done in _tracer() when result is available
+                else:
+                    remote_client.reply(obj, {'scopes': []})
+
+            elif command == 'getStackFrames':
+                _logger.e_debug("getStackFrames(%s)", args)
+                if self.status == 'stopped':
+                    self._command_q.put({
+                        'cmd':'getStackFrames',
+                        'obj': obj,
+                        'start': args.get('start', 0),
+                        'levels': args.get('levels'),
+                    })
+                    # reply will be done in _tracer() when result is available
+                else:
+                    remote_client.reply(obj, {'frames': [], 'stackDepth': 0})
+
             elif command == 'getProperties':
                 _logger.e_debug("getProperties(%s)", args)
-                if self.tracing_enabled and self.status == 'stopped':
+                if self.status == 'stopped':
                     self._command_q.put({
                         'cmd':'getProperties',
                         'obj': obj,
-                        'id': args['id']
+                        'id': args['id'],
+                        'start': args.get('start', 0),
+                        'count': args.get('count'),
+                        'filter': args.get('filter'),
+                        'children_count': args.get('children_count', True),
                     })
                     # reply will be done in _tracer() when result is available
                 else:
                     remote_client.reply(obj, {'value': None, 'type': None})
 
+            elif command == 'getArraySlice':
+                _logger.e_debug("getArraySlice(%s)", args)
+                if self.status == 'stopped':
+                    self._command_q.put({
+                        'cmd':'getArraySlice',
+                        'obj': obj,
+                        'id': args['id'],
+                        'start': args.get('start', 0),
+                        'stop': args.get('stop', args.get('start', 0) + 100),
+                    })
+                    # reply will be done in _tracer() when result is available
+                else:
+                    remote_client.reply(obj, {'values': [], 'total_count': 0})
+
             elif command == 'setVariable':
                 _logger.e_debug("setVariable(%s)", args)
-                if self.tracing_enabled and self.status == 'stopped':
+                if self.status == 'stopped':
                     self._command_q.put({
                         'cmd':'setVariable',
                         'obj': obj,
@@ -1718,9 +4299,17 @@ class IKPdb(object):
                 else:
                     remote_client.reply(obj, {'value': None, 'type': None})
 
+            elif command == 'setEncoding':
+                _logger.n_debug("setEncoding(%s)", args)
+                remote_client.set_encoding(obj, args.get('encoding'))
+
             elif command == 'reconnect':
                 _logger.n_debug("reconnect(%s)", args)
-                remote_client.reply(obj, {'executionStatus': self.status})
+                # new client must receive complete variables lists and 
+                # negotiate encoding again
+                self.variables_fingerprints = {}
+                remote_client.set_encoding(obj, 'json', 
+                                           result={'executionStatus': self.status})
                 
             elif command == 'getThreads':
                 _logger.x_debug("getThreads(%s)", args)
@@ -1739,6 +4328,18 @@ class IKPdb(object):
                 else:
                     remote_client.reply(obj, ret_val['result'])
 
+            elif command == 'setTracedThreads':
+                _logger.x_debug("setTracedThreads(%s)", args)
+                ret_val = self.set_traced_threads(args.get('idents'))
+                if ret_val['error']:
+                    remote_client.reply(obj, 
+                                        {},  # result
+                                        command_exec_status='error',
+                                        error_messages=[ret_val['error']])
+
+                else:
+                    remote_client.reply(obj, ret_val['result'])
+
             elif command == '_InternalQuit':
                 # '_InternalQuit' is an IKPdb internal message, generated by 
                 # IKPdbConnectionHandler when a socket.error occured.
@@ -1761,11 +4362,13 @@ class IKPdb(object):
                 if not IKBreakpoint.breakpoints_by_file_and_line:
                     _logger.b_debug("        <empty>") 
                 for file_line, bp in IKBreakpoint.breakpoints_by_file_and_line.items():
-                    _logger.b_debug("        %s => #%s, enabled=%s, condition=%s, %s", 
+                    _logger.b_debug("        %s => #%s, enabled=%s, condition=%s, "
+                                    "hit_count=%s, %s", 
                                     file_line,
                                     bp.number,
                                     bp.enabled,
                                     repr(bp.condition),
+                                    bp.hit_count,
                                     bp)
                 _logger.b_debug("    IKBreakpoint.breakpoints_files = %s", 
                                 IKBreakpoint.breakpoints_files)
@@ -1867,6 +4470,18 @@ def close_connection():
     except NameError:
         pass
     
+def dump_tracer_stats(file_name):
+    """ Dump tracer statistics in file_name as JSON. Registered with atexit 
+    when --ikpdb-stats-file is used.
+    """
+    try:
+        with open(file_name, 'w') as stats_file:
+            json.dump(ikpdb.get_tracer_stats(), stats_file, indent=2)
+        _logger.g_info("Tracer statistics written to '%s'.", file_name)
+    except (IOError, OSError) as e:
+        _logger.g_error("Failed to write tracer statistics to '%s' (%s).", 
+                        file_name, e)
+
 # On SIGINT, SIGTERM shutdown socket and close connection
 # (SIGKILL cannot be caught)
 def signal_handler(signal, frame):
@@ -1929,6 +4544,73 @@ def main():
                         help="Allows to force debugger's _client_ Current Worki"
                              "ng Directory. Useful "
                              "for remote debugging.")
+    parser.add_argument("-ik_sk", "--ikpdb-skip",
+                        dest="IKPDB_SKIP",
+                        action='append',
+                        default=None,
+                        help="Glob pattern of module names or file paths that "
+                             "debugger must not trace nor step into (eg. "
+                             "'*/site-packages/*'). Can be repeated.")
+    parser.add_argument("-ik_tb", "--ikpdb-tracing-backend",
+                        dest="IKPDB_TRACING_BACKEND",
+                        choices=IKPdb.TRACING_BACKENDS,
+                        default='settrace',
+                        help="'settrace' filters all 'line' events natively. "
+                             "'gated' generates 'line' events only in frames "
+                             "where debugger may stop (it replaces any "
+                             "profiler).")
+    parser.add_argument("-ik_bm", "--ikpdb-breakpoints-mode",
+                        dest="IKPDB_BREAKPOINTS_MODE",
+                        choices=IKPdb.BREAKPOINTS_MODES,
+                        default='trace',
+                        help="'trace' detects breakpoints by tracing. 'patch' "
+                             "patches code of breakpoints lines so that "
+                             "program is not traced unless a step is pending.")
+    parser.add_argument("-ik_ls", "--ikpdb-lazy-scopes",
+                        dest="IKPDB_LAZY_SCOPES",
+                        action='store_true',
+                        default=False,
+                        help="Send stack frames without their variables. "
+                             "Client fetches them using getScopes and "
+                             "getProperties commands.")
+    parser.add_argument("-ik_vd", "--ikpdb-variables-diff",
+                        dest="IKPDB_VARIABLES_DIFF",
+                        action='store_true',
+                        default=False,
+                        help="At each stop, send only variables added, "
+                             "changed or removed since previous stop for "
+                             "frames already sent.")
+    parser.add_argument("-ik_sb", "--ikpdb-stop-budget",
+                        dest="IKPDB_STOP_BUDGET",
+                        type=int,
+                        default=None,
+                        help="Maximum size (in bytes) of variables sent at "
+                             "each stop. Top frame locals are sent first, "
+                             "then outer frames locals and globals. Others "
+                             "are fetched on demand.")
+    parser.add_argument("-ik_sd", "--ikpdb-stack-depth",
+                        dest="IKPDB_STACK_DEPTH",
+                        type=int,
+                        default=None,
+                        help="Count of stack frames sent at each stop. "
+                             "Others are fetched on demand.")
+    parser.add_argument("-ik_io", "--ikpdb-intern-objects",
+                        dest="IKPDB_INTERN_OBJECTS",
+                        action="store_true",
+                        default=False,
+                        help="Send each object and scope once per stop in "
+                             "an objects table referenced by frames.")
+    parser.add_argument("-ik_st", "--ikpdb-stats",
+                        dest="IKPDB_STATS",
+                        action='store_true',
+                        default=False,
+                        help="Collect tracer statistics (see getTracerStats "
+                             "command).")
+    parser.add_argument("-ik_sf", "--ikpdb-stats-file",
+                        dest="IKPDB_STATS_FILE",
+                        default=None,
+                        help="Collect tracer statistics and dump them as JSON "
+                             "in this file when debugged program exits.")
     parser.add_argument("-ik_nvc", "--ikpdb-no-version-check",
                         dest="IKPDB_NO_VERSION_CHECK",
                         action='store_true',
@@ -1967,6 +4649,9 @@ def main():
     if cmd_line_args.IKPDB_CLIENT_WORKING_DIRECTORY:
         _logger.g_debug("  CLIENT Working Directory set to: '%s'", 
                         cmd_line_args.IKPDB_CLIENT_WORKING_DIRECTORY)
+    if cmd_line_args.IKPDB_SKIP:
+        _logger.g_debug("  Skipped modules and paths: %s", 
+                        cmd_line_args.IKPDB_SKIP)
 
     if not sys.argv[0:]:
         print "Error: scriptfile argument is required"
@@ -2016,15 +4701,27 @@ def main():
     remote_client = IKPdbConnectionHandler(client_connection)  
     
     global ikpdb
-    ikpdb = IKPdb(stop_at_first_statement=cmd_line_args.IKPDB_STOP_AT_ENTRY,
+    ikpdb = IKPdb(skip=cmd_line_args.IKPDB_SKIP,
+                  stop_at_first_statement=cmd_line_args.IKPDB_STOP_AT_ENTRY,
                   working_directory=cmd_line_args.IKPDB_WORKING_DIRECTORY,
-                  client_working_directory=cmd_line_args.IKPDB_CLIENT_WORKING_DIRECTORY)
+                  client_working_directory=cmd_line_args.IKPDB_CLIENT_WORKING_DIRECTORY,
+                  stats=cmd_line_args.IKPDB_STATS or bool(cmd_line_args.IKPDB_STATS_FILE),
+                  tracing_backend=cmd_line_args.IKPDB_TRACING_BACKEND,
+                  breakpoints_mode=cmd_line_args.IKPDB_BREAKPOINTS_MODE,
+                  lazy_scopes=cmd_line_args.IKPDB_LAZY_SCOPES,
+                  variables_diff=cmd_line_args.IKPDB_VARIABLES_DIFF,
+                  stop_budget=cmd_line_args.IKPDB_STOP_BUDGET,
+                  stack_depth=cmd_line_args.IKPDB_STACK_DEPTH,
+                  intern_objects=cmd_line_args.IKPDB_INTERN_OBJECTS)
+    if cmd_line_args.IKPDB_STATS_FILE:
+        atexit.register(dump_tracer_stats, cmd_line_args.IKPDB_STATS_FILE)
 
     if not cmd_line_args.IKPDB_NO_VERSION_CHECK:
         check_version()
 
     if cmd_line_args.IKPDB_SEND_WELCOME_MESSAGE:  
         remote_client.send("start", 
+                           result={'encodings': IKPdbConnectionHandler.ENCODINGS},
                            info_messages=["Welcome to", "IKPdb", __version__])
 
 
@@ -2039,8 +4736,15 @@ def main():
 
         debugger_thread.start()
         ikpdb.debugger_thread_ident = debugger_thread.ident
+        
+        logpoints_sender_thread = threading.Thread(target=ikpdb.logpoints_sender_loop,
+                                                   name='IKPdbLogpointsSender')
+        logpoints_sender_thread.daemon = True
+        logpoints_sender_thread.start()
+        ikpdb.logpoints_sender_ident = logpoints_sender_thread.ident
         run_script_event.wait()  # Wait for client to run script
         ikpdb._runscript(mainpyfile)
+        ikpdb.send_logpoints_hits()
         remote_client.send('programEnd', 
                            result={'exit_code': None, 
                                    'executionStatus': 'terminated'})
@@ -2053,6 +4757,7 @@ def main():
 
         # Connection may have been closed
         try:
+            ikpdb.send_logpoints_hits()
             remote_client.send('programEnd', 
                                result={'exit_code': exit_code, 
                                        'executionStatus': 'terminated'})
@@ -2072,10 +4777,15 @@ def main():
         traceback.print_exc()
         _logger.g_info("Uncaught exception. Entering post mortem debugging")
         pm_traceback = sys.exc_info()[2]
+        already_reported = False  # by an uncaught exception breakpoint 
         while pm_traceback.tb_next:
             pm_traceback = pm_traceback.tb_next      
-        ikpdb._line_tracer(pm_traceback.tb_frame, exc_info=sys.exc_info())
+            if pm_traceback is ikpdb.uncaught_exception_traceback:
+                already_reported = True
+        if not already_reported:
+            ikpdb._line_tracer(pm_traceback.tb_frame, exc_info=sys.exc_info())
         try:
+            ikpdb.send_logpoints_hits()
             remote_client.send('programEnd', 
                                result={'exit_code': None, 
                                        'executionStatus': 'terminated'})
@@ -2,6 +2,12 @@
 #include "frameobject.h"
 #include "pystate.h"
 
+#ifdef MS_WINDOWS
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
 /**
  * This file is part of the IKPdb Debugger
  * Copyright (c) 2016-2018 by cyril MORISSE, Audaxis
@@ -10,6 +16,59 @@
 
 static long debuggerThreadIdent = 0;  // Track debugger thread ident
 
+/*
+ * Native copy of the breakpoints table and of the stepping state. They are
+ * used by _tracer_trampoline() to filter 'line' events so that the python
+ * tracer is only called when a line may stop the debugged program.
+ *
+ * breakpointsCache maps raw co_filename to a frozenset of line numbers (or
+ * None when file has no enabled breakpoint). It is filled lazily by calling
+ * breakpointsResolver and flushed each time breakpoints are modified.
+ */
+static PyObject *breakpointsResolver = NULL;
+static PyObject *breakpointsCache = NULL;
+
+/*
+ * Native exception breakpoints filter. exceptionCache maps exception types
+ * to True or False depending on wether debugger may break on them. It is 
+ * filled lazily by calling exceptionResolver. When exceptionResolver is NULL
+ * 'exception' events are not sent to python tracer.
+ */
+static PyObject *exceptionResolver = NULL;
+static PyObject *exceptionCache = NULL;
+
+static PyObject *frameStop = NULL;     // stepOver and stepInto
+static PyObject *frameReturn = NULL;   // stepOut and stepOver
+static PyObject *frameCalling = NULL;  // stepInto
+static int frameSuspend = 0;           // suspend
+static int pendingStop = 0;            // True if any of frameXxxx is set
+
+/*
+ * "gated" tracing backend (see _set_gated_tracing()). A profile function 
+ * receives 'call' and 'return' events and turns the thread's trace function
+ * on only while the running frame has a local trace function. Frames that
+ * can't stop run without any 'line' event.
+ */
+static int gatedTracing = 0;
+
+/*
+ * Optional tracer statistics (see _set_stats_enabled()). Counters are indexed
+ * by trace event: PyTrace_CALL, PyTrace_EXCEPTION, PyTrace_LINE and 
+ * PyTrace_RETURN. statsEvents counts events received by the trampoline and 
+ * statsCallbacks the ones forwarded to python tracer. statsByThread and 
+ * statsByFile map thread ids and raw co_filename to lists of event counts.
+ */
+#define STATS_EVENT_TYPES 4
+static int statsEnabled = 0;
+static PY_LONG_LONG statsEvents[STATS_EVENT_TYPES];
+static PY_LONG_LONG statsCallbacks[STATS_EVENT_TYPES];
+static double statsTracerTime = 0.0;   // seconds spent in python tracer
+static double statsStoppedTime = 0.0;  // seconds python tracer was stopped
+// key set in thread state dict while thread runs a timed python tracer call
+static PyObject *statsTimedCallKey = NULL;
+static PyObject *statsByThread = NULL;
+static PyObject *statsByFile = NULL;
+
 /*
  * Cached interned string objects used for calling the profile and
  * trace functions.  Initialized by trace_init().
@@ -53,10 +112,12 @@ call_trampoline(PyThreadState *tstate, PyObject* callback,
     PyTuple_SET_ITEM(args, 1, whatstr);
     PyTuple_SET_ITEM(args, 2, arg);
 
-    /* call the Python-level function */
-    PyFrame_FastToLocals(frame);
+    /* call the Python-level function. 
+     * Unlike sys.settrace() trampoline, we do not synchronize frame's locals 
+     * (PyFrame_FastToLocals() / PyFrame_LocalsToFast()) on each event. 
+     * Reading frame.f_locals synchronizes the dict and debugger calls 
+     * _locals_to_fast() when it modifies locals. */
     result = PyEval_CallObject(callback, args);
-    PyFrame_LocalsToFast(frame, 1);
     if (result == NULL)
         PyTraceBack_Here(frame);
 
@@ -66,12 +127,230 @@ call_trampoline(PyThreadState *tstate, PyObject* callback,
 }
 
 
+/*
+ * Returns a monotonic time in seconds used to measure time spent in tracer.
+ */
+static double
+stats_clock(void)
+{
+#ifdef MS_WINDOWS
+    LARGE_INTEGER frequency, counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart / (double)frequency.QuadPart;
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+#endif
+}
+
+/*
+ * Increments what counter of the list stored under key in table dict.
+ * Returns 0 on success and -1 on error.
+ */
+static int
+stats_count(PyObject **table, PyObject *key, int what)
+{
+    PyObject *counts;
+    PyObject *count;
+
+    if (*table == NULL) {
+        *table = PyDict_New();
+        if (*table == NULL)
+            return -1;
+    }
+    counts = PyDict_GetItem(*table, key);
+    if (counts == NULL) {
+        counts = Py_BuildValue("[iiii]", 0, 0, 0, 0);
+        if (counts == NULL)
+            return -1;
+        if (PyDict_SetItem(*table, key, counts) == -1) {
+            Py_DECREF(counts);
+            return -1;
+        }
+        Py_DECREF(counts);  // table holds a reference
+    }
+    count = PyInt_FromLong(PyInt_AS_LONG(PyList_GET_ITEM(counts, what)) + 1);
+    if (count == NULL)
+        return -1;
+    return PyList_SetItem(counts, what, count);
+}
+
+/*
+ * Count an event received by the trampoline.
+ */
+static int
+stats_count_event(PyFrameObject *frame, int what)
+{
+    PyObject *thread_id;
+    int result;
+
+    statsEvents[what]++;
+    if (stats_count(&statsByFile, frame->f_code->co_filename, what) == -1)
+        return -1;
+    thread_id = PyInt_FromLong(frame->f_tstate->thread_id);
+    if (thread_id == NULL)
+        return -1;
+    result = stats_count(&statsByThread, thread_id, what);
+    Py_DECREF(thread_id);
+    return result;
+}
+
+/*
+ * Returns 1 if there is an enabled breakpoint at frame's current line, 0 if
+ * not and -1 on error.
+ * When no resolver is registered, we can't filter so we return 1.
+ */
+static int
+is_breakpoint_line(PyFrameObject *frame)
+{
+    PyObject *file_name = frame->f_code->co_filename;
+    PyObject *lines;
+    PyObject *line_number;
+    int found;
+
+    if (breakpointsResolver == NULL)
+        return 1;
+    if (breakpointsCache == NULL) {
+        breakpointsCache = PyDict_New();
+        if (breakpointsCache == NULL)
+            return -1;
+    }
+
+    lines = PyDict_GetItem(breakpointsCache, file_name);
+    if (lines == NULL) {
+        lines = PyObject_CallFunctionObjArgs(breakpointsResolver, file_name, NULL);
+        if (lines == NULL)
+            return -1;
+        if (PyDict_SetItem(breakpointsCache, file_name, lines) == -1) {
+            Py_DECREF(lines);
+            return -1;
+        }
+        Py_DECREF(lines);  // breakpointsCache holds a reference
+    }
+    if (lines == Py_None)
+        return 0;
+
+    line_number = PyInt_FromLong(frame->f_lineno);
+    if (line_number == NULL)
+        return -1;
+    found = PySet_Contains(lines, line_number);
+    Py_DECREF(line_number);
+    return found;
+}
+
+/*
+ * Returns 1 if exception breakpoints may match this 'exception' event, 0 if 
+ * not and -1 on error.
+ */
+static int
+is_exception_filtered_in(PyObject *arg)
+{
+    PyObject *exc_type;
+    PyObject *match;
+    int found;
+
+    if (exceptionResolver == NULL)
+        return 0;
+    if (arg == NULL || !PyTuple_Check(arg) || PyTuple_GET_SIZE(arg) < 1)
+        return 0;
+    if (exceptionCache == NULL) {
+        exceptionCache = PyDict_New();
+        if (exceptionCache == NULL)
+            return -1;
+    }
+
+    exc_type = PyTuple_GET_ITEM(arg, 0);
+    match = PyDict_GetItem(exceptionCache, exc_type);
+    if (match == NULL) {
+        match = PyObject_CallFunctionObjArgs(exceptionResolver, exc_type, NULL);
+        if (match == NULL)
+            return -1;
+        found = PyObject_IsTrue(match);
+        Py_DECREF(match);
+        if (found == -1)
+            return -1;
+        if (PyDict_SetItem(exceptionCache, exc_type, 
+                           found ? Py_True : Py_False) == -1)
+            return -1;
+        return found;
+    }
+    return match == Py_True;
+}
+
+/*
+ * Inlined version of IKPdb.should_stop_here()
+ */
+static int
+is_step_line(PyFrameObject *frame)
+{
+    if (!pendingStop)
+        return 0;
+    if (frameCalling && frameCalling == (PyObject *)frame->f_back)
+        return 1;
+    if (frameStop == (PyObject *)frame || frameReturn == (PyObject *)frame)
+        return 1;
+    return frameSuspend;
+}
+
+
+/*
+ * Marks (or unmarks) current thread as running a python tracer call whose 
+ * time is added to statsTracerTime so that only the time it is stopped in
+ * such a call is subtracted (see _add_stats_stopped_time()).
+ * Returns 1 if thread has been marked.
+ */
+static int
+stats_set_timed_call(int timed)
+{
+    PyObject *dict = PyThreadState_GetDict();
+
+    if (statsTimedCallKey == NULL)
+        statsTimedCallKey = PyString_InternFromString("iksettrace.timed_call");
+    if (dict == NULL || statsTimedCallKey == NULL) {
+        PyErr_Clear();
+        return 0;
+    }
+    if (timed) {
+        if (PyDict_SetItem(dict, statsTimedCallKey, Py_True) == -1) {
+            PyErr_Clear();
+            return 0;
+        }
+        return 1;
+    }
+    if (PyDict_DelItem(dict, statsTimedCallKey) == -1)
+        PyErr_Clear();
+    return 0;
+}
+
+static int
+stats_is_timed_call(void)
+{
+    PyObject *dict = PyThreadState_GetDict();
+
+    return dict != NULL && statsTimedCallKey != NULL 
+           && PyDict_GetItem(dict, statsTimedCallKey) != NULL;
+}
+
+
 static int
 _tracer_trampoline(PyObject *self, PyFrameObject *frame, int what, PyObject *arg)
 {
     PyThreadState *tstate = frame->f_tstate;
     PyObject *callback;
     PyObject *result;
+    int must_call;
+    int timed_call = 0;
+    double start_time = 0.0;
+
+    if (statsEnabled && what < STATS_EVENT_TYPES) {
+        if (stats_count_event(frame, what) == -1) {
+            PyEval_SetTrace(NULL, NULL);
+            Py_CLEAR(frame->f_trace);
+            return -1;
+        }
+    }
 
     if (what == PyTrace_CALL)
         callback = self;
@@ -80,7 +359,49 @@ _tracer_trampoline(PyObject *self, PyFrameObject *frame, int what, PyObject *arg
     if (callback == NULL)
         return 0;
 
+    if (what == PyTrace_LINE) {
+        // python tracer is only called if debugger may stop at this line
+        must_call = is_step_line(frame);
+        if (!must_call)
+            must_call = is_breakpoint_line(frame);
+        if (must_call == -1) {
+            PyEval_SetTrace(NULL, NULL);
+            Py_CLEAR(frame->f_trace);
+            return -1;
+        }
+        if (!must_call)
+            return 0;
+    } else if (what == PyTrace_EXCEPTION) {
+        // python tracer is only called for exceptions it may break on
+        must_call = is_exception_filtered_in(arg);
+        if (must_call == -1) {
+            PyEval_SetTrace(NULL, NULL);
+            Py_CLEAR(frame->f_trace);
+            return -1;
+        }
+        if (!must_call)
+            return 0;
+    } else if (what == PyTrace_RETURN) {
+        // python tracer only handles the return of the step target's caller
+        if (breakpointsResolver != NULL
+                && !(pendingStop && frameReturn == (PyObject *)frame))
+            return 0;
+    }
+
+    if (statsEnabled && what < STATS_EVENT_TYPES) {
+        statsCallbacks[what]++;
+        timed_call = stats_set_timed_call(1);
+        start_time = stats_clock();
+    }
     result = call_trampoline(tstate, callback, frame, what, arg);
+    if (statsEnabled && start_time != 0.0)
+        statsTracerTime += stats_clock() - start_time;
+    if (timed_call) {
+        PyObject *type, *value, *traceback;
+        PyErr_Fetch(&type, &value, &traceback);
+        stats_set_timed_call(0);
+        PyErr_Restore(type, value, traceback);
+    }
     if (result == NULL) {
         PyEval_SetTrace(NULL, NULL);
         Py_CLEAR(frame->f_trace);
@@ -100,36 +421,173 @@ _tracer_trampoline(PyObject *self, PyFrameObject *frame, int what, PyObject *arg
 }
 
 
+/*
+ * Turn line tracing of current thread on or off without touching it's 
+ * profile function. PyEval_SetTrace() keeps _Py_TracingPossible balanced and
+ * ceval recomputes use_tracing when profile function returns.
+ */
+static void
+set_line_tracing(PyThreadState *tstate, int on, PyObject *tracer)
+{
+    if (on && tstate->c_tracefunc == NULL)
+        PyEval_SetTrace(_tracer_trampoline, tracer);
+    else if (!on && tstate->c_tracefunc == _tracer_trampoline)
+        PyEval_SetTrace(NULL, NULL);
+}
+
+/*
+ * Profile function of the "gated" backend. It is called on 'call' and 
+ * 'return' events (and C calls that we ignore) whether line tracing is on
+ * or off.
+ */
+static int
+_profile_trampoline(PyObject *self, PyFrameObject *frame, int what, PyObject *arg)
+{
+    // a generator frame may run in another thread than the one it was 
+    // created by (frame->f_tstate)
+    PyThreadState *tstate = PyThreadState_GET();
+    PyFrameObject *back;
+
+    if (what == PyTrace_CALL) {
+        // When line tracing is off, 'call' event has not been sent to 
+        // _tracer_trampoline
+        if (tstate->c_tracefunc == NULL) {
+            if (_tracer_trampoline(self, frame, PyTrace_CALL, Py_None) == -1)
+                return -1;
+        }
+        set_line_tracing(tstate, frame->f_trace != NULL, self);
+    } else if (what == PyTrace_RETURN) {
+        // execution goes back to caller
+        back = frame->f_back;
+        set_line_tracing(tstate, back != NULL && back->f_trace != NULL, self);
+    }
+    return 0;
+}
+
+
+/*
+ * Add delta (1 or -1) to _Py_TracingPossible, the count of threads having a
+ * trace function that ceval checks before sending 'line' events. As only
+ * PyEval_SetTrace() updates it, it is called on current thread whose trace
+ * function is swapped for a NULL (or dummy) one meanwhile.
+ */
+static void
+adjust_tracing_possible(int delta)
+{
+    PyThreadState *ts = PyThreadState_GET();
+    Py_tracefunc currentFunc = ts->c_tracefunc;
+    PyObject *currentObj = ts->c_traceobj;
+
+    // PyEval_SetTrace() adds (func != NULL) - (ts->c_tracefunc != NULL)
+    ts->c_tracefunc = delta > 0 ? NULL : _tracer_trampoline;
+    ts->c_traceobj = NULL;
+    PyEval_SetTrace(delta > 0 ? _tracer_trampoline : NULL, NULL);
+    ts->c_tracefunc = currentFunc;
+    ts->c_traceobj = currentObj;
+    ts->use_tracing = ((currentFunc != NULL) || (ts->c_profilefunc != NULL));
+}
+
+/*
+ * Set trace function of a thread state without touching the others. Like
+ * PyEval_SetTrace(), _Py_TracingPossible is updated when thread starts or 
+ * stops being traced.
+ */
+static void
+set_thread_state_trace(PyThreadState *ts, Py_tracefunc func, PyObject *arg)
+{
+    PyObject *temp = ts->c_traceobj;
+    int delta = (func != NULL) - (ts->c_tracefunc != NULL);
+
+    Py_XINCREF(arg);
+    ts->c_tracefunc = NULL;
+    ts->c_traceobj = NULL;
+    /* Must make sure that profiling is not ignored if 'temp' is freed */
+    ts->use_tracing = ts->c_profilefunc != NULL;
+    Py_XDECREF(temp);
+    ts->c_tracefunc = func;
+    ts->c_traceobj = arg;
+    /* Flag that tracing or profiling is turned on */
+    ts->use_tracing = ((func != NULL) || (ts->c_profilefunc != NULL));
+    if (delta)
+        adjust_tracing_possible(delta);
+}
+
+/*
+ * Set profile function of a thread state.
+ */
+static void
+set_thread_state_profile(PyThreadState *ts, Py_tracefunc func, PyObject *arg)
+{
+    PyObject *temp = ts->c_profileobj;
+    Py_XINCREF(arg);
+    ts->c_profilefunc = NULL;
+    ts->c_profileobj = NULL;
+    /* Must make sure that tracing is not ignored if 'temp' is freed */
+    ts->use_tracing = ts->c_tracefunc != NULL;
+    Py_XDECREF(temp);
+    ts->c_profilefunc = func;
+    ts->c_profileobj = arg;
+    ts->use_tracing = ((func != NULL) || (ts->c_tracefunc != NULL));
+}
+
+/*
+ * Install (or remove when func is NULL) the gated backend profile function
+ * on a thread. A profile function that is not ours is left untouched.
+ */
+static void
+set_thread_state_gate(PyThreadState *ts, Py_tracefunc func, PyObject *arg)
+{
+    if (func != NULL && gatedTracing)
+        set_thread_state_profile(ts, _profile_trampoline, arg);
+    else if (ts->c_profilefunc == _profile_trampoline)
+        set_thread_state_profile(ts, NULL, NULL);
+}
+
+
 void
 IK_SetTrace(Py_tracefunc func, PyObject *arg)
 {
-    // Ensure _Py_TracingPossible is correctly set
-    PyEval_SetTrace(func, arg);  
-    
-    // Now iterate over all threads to set tracing
+    // Iterate over all threads to set tracing
     PyInterpreterState *interp = PyInterpreterState_Head();
     PyThreadState *loopThreadState = PyInterpreterState_ThreadHead(interp);
     while(loopThreadState) {
         if(loopThreadState->thread_id!=debuggerThreadIdent) {
-            PyObject *temp = loopThreadState->c_traceobj;
-            Py_XINCREF(arg);
-            loopThreadState->c_tracefunc = NULL;
-            loopThreadState->c_traceobj = NULL;
-            /* Must make sure that profiling is not ignored if 'temp' is freed */
-            loopThreadState->use_tracing = loopThreadState->c_profilefunc != NULL;
-            Py_XDECREF(temp);
-            loopThreadState->c_tracefunc = func;
-            loopThreadState->c_traceobj = arg;
-            /* Flag that tracing or profiling is turned on */
-            loopThreadState->use_tracing = ((func != NULL) || (loopThreadState->c_profilefunc != NULL));
+            set_thread_state_trace(loopThreadState, func, arg);
+            set_thread_state_gate(loopThreadState, func, arg);
         } else {
-            PyObject *temp = loopThreadState->c_traceobj;
-            loopThreadState->c_tracefunc = NULL;
-            loopThreadState->c_traceobj = NULL;
-            /* Must make sure that profiling is not ignored if 'temp' is freed */
-            loopThreadState->use_tracing = loopThreadState->c_profilefunc != NULL;
-            Py_XDECREF(temp);
+            set_thread_state_trace(loopThreadState, NULL, NULL);
+            set_thread_state_gate(loopThreadState, NULL, NULL);
+        };
+        loopThreadState = PyThreadState_Next(loopThreadState);
+    };
+}
 
+
+/*
+ * Set tracing on (or off if func is NULL) on thread_id only.
+ */
+void
+IK_SetThreadTrace(long threadIdent, Py_tracefunc func, PyObject *arg)
+{
+    PyThreadState *currentThreadState = PyThreadState_GET();
+    PyInterpreterState *interp = PyInterpreterState_Head();
+    PyThreadState *loopThreadState;
+
+    if (threadIdent == debuggerThreadIdent)
+        return;
+
+    if (currentThreadState->thread_id == threadIdent) {
+        PyEval_SetTrace(func, arg);
+        set_thread_state_gate(currentThreadState, func, arg);
+        return;
+    }
+
+    loopThreadState = PyInterpreterState_ThreadHead(interp);
+    while(loopThreadState) {
+        if(loopThreadState->thread_id == threadIdent) {
+            set_thread_state_trace(loopThreadState, func, arg);
+            set_thread_state_gate(loopThreadState, func, arg);
+            break;
         };
         loopThreadState = PyThreadState_Next(loopThreadState);
     };
@@ -140,50 +598,708 @@ static PyObject *
 _ik_set_trace_on(PyObject *self, PyObject *args)
 {
     PyObject *traceObject = NULL;
+    long threadIdent = 0;
 
     if (trace_init() == -1)
         return NULL;
     
-    if (!PyArg_ParseTuple(args, "Ol", &traceObject, &debuggerThreadIdent)) {
+    if (!PyArg_ParseTuple(args, "Ol|l", &traceObject, &debuggerThreadIdent,
+                          &threadIdent)) {
         return NULL;
     }    
 
-    IK_SetTrace(_tracer_trampoline, traceObject);
+    if (threadIdent)
+        IK_SetThreadTrace(threadIdent, _tracer_trampoline, traceObject);
+    else
+        IK_SetTrace(_tracer_trampoline, traceObject);
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 PyDoc_STRVAR(_ik_set_trace_on_doc,
-"_set_trace_on(tracer, thread_id)\n\
+"_set_trace_on(tracer, debugger_thread_id[, thread_id])\n\
 \n\
-Activate tracing with tracer function, on all threads but the one specified.\n\
+Activate tracing with tracer function, on all threads but the debugger's one\n\
+or only on thread_id if it is specified (other threads are left unchanged).\n\
 See the debugger chapter in the library manual.\n\
 This function do not call threading.settrace(), user must do it."
 );
 
 
 static PyObject *
-_ik_set_trace_off(PyObject *self)
+_ik_set_trace_off(PyObject *self, PyObject *args)
 {
-    IK_SetTrace(NULL, NULL);
+    long threadIdent = 0;
+
+    if (!PyArg_ParseTuple(args, "|l", &threadIdent)) {
+        return NULL;
+    }    
+
+    if (threadIdent)
+        IK_SetThreadTrace(threadIdent, NULL, NULL);
+    else
+        IK_SetTrace(NULL, NULL);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 PyDoc_STRVAR(_ik_set_trace_off_doc,
-"_set_trace_off()\n\
+"_set_trace_off([thread_id])\n\
 \n\
-Disable tracing on all threads.\n\
+Disable tracing on all threads or only on thread_id if it is specified.\n\
 See the debugger chapter in the library manual.\n\
 This function do not call threading.settrace(), user must do it."
 );
 
 
+static PyObject *
+_ik_set_breakpoints_resolver(PyObject *self, PyObject *args)
+{
+    PyObject *resolver = NULL;
+    PyObject *temp;
+
+    if (!PyArg_ParseTuple(args, "O", &resolver)) {
+        return NULL;
+    }
+    if (resolver == Py_None) {
+        resolver = NULL;
+    } else if (!PyCallable_Check(resolver)) {
+        PyErr_SetString(PyExc_TypeError, "resolver must be callable or None");
+        return NULL;
+    }
+
+    temp = breakpointsResolver;
+    Py_XINCREF(resolver);
+    breakpointsResolver = resolver;
+    Py_XDECREF(temp);
+    Py_CLEAR(breakpointsCache);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_set_breakpoints_resolver_doc,
+"_set_breakpoints_resolver(resolver)\n\
+\n\
+Register the function used to build the native breakpoints table.\n\
+resolver(co_filename) must return a frozenset of the line numbers of the \n\
+enabled breakpoints in this file or None if there is none.\n\
+Use None to disable native 'line' events filtering."
+);
+
+
+static PyObject *
+_ik_clear_breakpoints_cache(PyObject *self, PyObject *unused)
+{
+    Py_CLEAR(breakpointsCache);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_clear_breakpoints_cache_doc,
+"_clear_breakpoints_cache()\n\
+\n\
+Flush the native breakpoints table. Must be called each time a breakpoint\n\
+is added, removed, enabled or disabled."
+);
+
+
+static PyObject *
+_ik_set_exception_resolver(PyObject *self, PyObject *args)
+{
+    PyObject *resolver = NULL;
+    PyObject *temp;
+
+    if (!PyArg_ParseTuple(args, "O", &resolver)) {
+        return NULL;
+    }
+    if (resolver == Py_None) {
+        resolver = NULL;
+    } else if (!PyCallable_Check(resolver)) {
+        PyErr_SetString(PyExc_TypeError, "resolver must be callable or None");
+        return NULL;
+    }
+
+    temp = exceptionResolver;
+    Py_XINCREF(resolver);
+    exceptionResolver = resolver;
+    Py_XDECREF(temp);
+    Py_CLEAR(exceptionCache);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_set_exception_resolver_doc,
+"_set_exception_resolver(resolver)\n\
+\n\
+Register the function used to filter 'exception' events natively.\n\
+resolver(exception_type) must return True if debugger may break on\n\
+this type of exception. Result is cached by exception type.\n\
+Use None to stop sending 'exception' events to the python tracer."
+);
+
+
+static PyObject *
+_ik_locals_to_fast(PyObject *self, PyObject *frame)
+{
+    if (!PyFrame_Check(frame)) {
+        PyErr_SetString(PyExc_TypeError, "argument must be a frame");
+        return NULL;
+    }
+    if (((PyFrameObject *)frame)->f_locals != NULL)
+        PyFrame_LocalsToFast((PyFrameObject *)frame, 1);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_locals_to_fast_doc,
+"_locals_to_fast(frame)\n\
+\n\
+Write frame.f_locals dict back into frame's fast locals. Must be called\n\
+after debugger modifies frame.f_locals (eg. setVariable or evaluate).\n\
+Note that reading frame.f_locals refreshes the dict from fast locals."
+);
+
+
+static PyObject *
+_ik_call_untraced(PyObject *self, PyObject *args)
+{
+    PyThreadState *tstate = PyThreadState_GET();
+    PyObject *func;
+    PyObject *func_args;
+    PyObject *result;
+
+    if (PyTuple_GET_SIZE(args) < 1) {
+        PyErr_SetString(PyExc_TypeError, "_call_untraced() requires a callable");
+        return NULL;
+    }
+    func = PyTuple_GET_ITEM(args, 0);
+    func_args = PyTuple_GetSlice(args, 1, PyTuple_GET_SIZE(args));
+    if (func_args == NULL)
+        return NULL;
+
+    // same as ceval's call_trace()
+    tstate->tracing++;
+    tstate->use_tracing = 0;
+    result = PyObject_Call(func, func_args, NULL);
+    tstate->use_tracing = ((tstate->c_tracefunc != NULL)
+                           || (tstate->c_profilefunc != NULL));
+    tstate->tracing--;
+
+    Py_DECREF(func_args);
+    return result;
+}
+
+PyDoc_STRVAR(_ik_call_untraced_doc,
+"_call_untraced(func, *args)\n\
+\n\
+Call func(*args) with tracing and profiling suspended on current thread as\n\
+if it was called by a trace function. Tracing state changes done by func\n\
+apply when it returns."
+);
+
+
+static void
+set_frame_ref(PyObject **target, PyObject *frame)
+{
+    PyObject *temp = *target;
+    if (frame == Py_None)
+        frame = NULL;
+    Py_XINCREF(frame);
+    *target = frame;
+    Py_XDECREF(temp);
+}
+
+static PyObject *
+_ik_set_step_state(PyObject *self, PyObject *args)
+{
+    PyObject *frame_stop = NULL;
+    PyObject *frame_return = NULL;
+    PyObject *frame_calling = NULL;
+    int frame_suspend = 0;
+
+    if (!PyArg_ParseTuple(args, "OOOi", &frame_stop, &frame_return, 
+                          &frame_calling, &frame_suspend)) {
+        return NULL;
+    }
+    set_frame_ref(&frameStop, frame_stop);
+    set_frame_ref(&frameReturn, frame_return);
+    set_frame_ref(&frameCalling, frame_calling);
+    frameSuspend = frame_suspend ? 1 : 0;
+    pendingStop = (frameStop || frameReturn || frameCalling || frameSuspend);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_set_step_state_doc,
+"_set_step_state(frame_stop, frame_return, frame_calling, frame_suspend)\n\
+\n\
+Copy debugger stepping state so that 'line' events can be filtered natively.\n\
+Frames may be None."
+);
+
+
+static PyObject *
+_ik_set_gated_tracing(PyObject *self, PyObject *args)
+{
+    int gated = 0;
+
+    if (!PyArg_ParseTuple(args, "i", &gated)) {
+        return NULL;
+    }
+    gatedTracing = gated ? 1 : 0;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_set_gated_tracing_doc,
+"_set_gated_tracing(gated)\n\
+\n\
+Select the tracing backend used by next _set_trace_on() calls.\n\
+When gated is False, every 'line' event of traced threads reaches\n\
+iksettrace which filters them natively.\n\
+When gated is True, a profile function receives 'call' and 'return' events\n\
+and turns line tracing on only while running frame has a local trace\n\
+function. Other frames run without 'line' events. Note that the\n\
+profile function replaces any profiler installed on traced threads."
+);
+
+
+static void
+stats_reset(void)
+{
+    int i;
+    for (i = 0; i < STATS_EVENT_TYPES; i++) {
+        statsEvents[i] = 0;
+        statsCallbacks[i] = 0;
+    }
+    statsTracerTime = 0.0;
+    statsStoppedTime = 0.0;
+    Py_CLEAR(statsByThread);
+    Py_CLEAR(statsByFile);
+}
+
+static PyObject *
+_ik_set_stats_enabled(PyObject *self, PyObject *args)
+{
+    int enabled = 0;
+
+    if (!PyArg_ParseTuple(args, "i", &enabled)) {
+        return NULL;
+    }
+    if (enabled && !statsEnabled)
+        stats_reset();
+    statsEnabled = enabled ? 1 : 0;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_set_stats_enabled_doc,
+"_set_stats_enabled(enabled)\n\
+\n\
+Enable or disable tracer statistics. Counters are reset when statistics\n\
+are enabled."
+);
+
+static PyObject *
+_ik_add_stats_stopped_time(PyObject *self, PyObject *args)
+{
+    double stopped_time = 0.0;
+
+    if (!PyArg_ParseTuple(args, "d", &stopped_time)) {
+        return NULL;
+    }
+    // time is only counted in statsTracerTime for trampoline calls
+    if (statsEnabled && stats_is_timed_call())
+        statsStoppedTime += stopped_time;
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+PyDoc_STRVAR(_ik_add_stats_stopped_time_doc,
+"_add_stats_stopped_time(seconds)\n\
+\n\
+Called by python tracer with the time it spent stopped, waiting for user\n\
+commands, so that it is not counted in 'tracer_time'. Time is ignored unless\n\
+python tracer has been called by iksettrace tracer."
+);
+
+
+/*
+ * Returns a deep copy of a statistics table.
+ */
+static PyObject *
+stats_copy_table(PyObject *table)
+{
+    PyObject *copy = PyDict_New();
+    PyObject *key, *counts, *counts_copy;
+    Py_ssize_t pos = 0;
+
+    if (copy == NULL || table == NULL)
+        return copy;
+    while (PyDict_Next(table, &pos, &key, &counts)) {
+        counts_copy = PyList_GetSlice(counts, 0, STATS_EVENT_TYPES);
+        if (counts_copy == NULL || PyDict_SetItem(copy, key, counts_copy) == -1) {
+            Py_XDECREF(counts_copy);
+            Py_DECREF(copy);
+            return NULL;
+        }
+        Py_DECREF(counts_copy);
+    }
+    return copy;
+}
+
+static PyObject *
+_ik_get_stats(PyObject *self, PyObject *unused)
+{
+    PyObject *by_thread = stats_copy_table(statsByThread);
+    PyObject *by_file = stats_copy_table(statsByFile);
+    PyObject *result = NULL;
+    double tracer_time = statsTracerTime - statsStoppedTime;
+
+    if (by_thread != NULL && by_file != NULL) {
+        result = Py_BuildValue("{s:i,s:[LLLL],s:[LLLL],s:d,s:O,s:O}",
+                               "enabled", statsEnabled,
+                               "events", statsEvents[0], statsEvents[1],
+                                         statsEvents[2], statsEvents[3],
+                               "callbacks", statsCallbacks[0], statsCallbacks[1],
+                                            statsCallbacks[2], statsCallbacks[3],
+                               "tracer_time", tracer_time > 0.0 ? tracer_time : 0.0,
+                               "threads", by_thread,
+                               "files", by_file);
+    }
+    Py_XDECREF(by_thread);
+    Py_XDECREF(by_file);
+    return result;
+}
+
+PyDoc_STRVAR(_ik_get_stats_doc,
+"_get_stats()\n\
+\n\
+Returns tracer statistics as a dict. 'events' and 'callbacks' are lists of\n\
+'call', 'exception', 'line' and 'return' events counts respectively received\n\
+by iksettrace and forwarded to python tracer. 'threads' and 'files' map\n\
+thread ids and co_filename to lists of received events counts.\n\
+'tracer_time' is the time spent in python tracer in seconds, excluding\n\
+the time it was stopped (see _add_stats_stopped_time())."
+);
+
+
+/*
+ * MessagePack encoder of the 'msgpack' encoding of ikpdb messages (see 
+ * IKMessagePack in ikpdb.py). Objects are packed into a growable buffer.
+ */
+#define MSGPACK_MAX_DEPTH 256
+
+typedef struct {
+    unsigned char *data;
+    Py_ssize_t size;
+    Py_ssize_t allocated;
+} msgpackBuffer;
+
+static int
+msgpack_write(msgpackBuffer *buffer, const void *data, Py_ssize_t size)
+{
+    if (buffer->size + size > buffer->allocated) {
+        Py_ssize_t allocated = buffer->allocated;
+        unsigned char *new_data;
+
+        while (allocated < buffer->size + size)
+            allocated *= 2;
+        new_data = PyMem_Realloc(buffer->data, allocated);
+        if (new_data == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        buffer->data = new_data;
+        buffer->allocated = allocated;
+    }
+    memcpy(buffer->data + buffer->size, data, size);
+    buffer->size += size;
+    return 0;
+}
+
+/*
+ * Writes type_byte followed by the `size` lower bytes of value (big endian).
+ */
+static int
+msgpack_write_header(msgpackBuffer *buffer, unsigned char type_byte, 
+                     unsigned PY_LONG_LONG value, int size)
+{
+    unsigned char header[9];
+    int i;
+
+    header[0] = type_byte;
+    for (i = size; i > 0; i--) {
+        header[i] = (unsigned char)(value & 0xff);
+        value >>= 8;
+    }
+    return msgpack_write(buffer, header, size + 1);
+}
+
+/*
+ * Writes the header of a str, array or map. fix_type is the type byte of 
+ * the fix format (whose length is below fix_limit) followed by the type bytes
+ * of the 8 (0 if none), 16 and 32 bits formats.
+ */
+static int
+msgpack_write_length(msgpackBuffer *buffer, Py_ssize_t length, 
+                     unsigned char fix_type, Py_ssize_t fix_limit, 
+                     unsigned char type_8, unsigned char type_16, 
+                     unsigned char type_32)
+{
+    if (length < fix_limit)
+        return msgpack_write_header(buffer, fix_type | (unsigned char)length, 0, 0);
+    if (type_8 && length <= 0xff)
+        return msgpack_write_header(buffer, type_8, length, 1);
+    if (length <= 0xffff)
+        return msgpack_write_header(buffer, type_16, length, 2);
+    if (length <= 0xffffffffLL)
+        return msgpack_write_header(buffer, type_32, length, 4);
+    PyErr_SetString(PyExc_ValueError, "object is too large for MessagePack");
+    return -1;
+}
+
+/*
+ * Returns 1 if data is valid UTF-8 (as strict decoders expect it: no 
+ * overlong sequences, surrogates or code points above U+10FFFF), else 0.
+ */
+static int
+msgpack_is_utf8(const unsigned char *data, Py_ssize_t size)
+{
+    const unsigned char *end = data + size;
+    unsigned char c;
+    unsigned long code_point;
+    int continuation_count, i;
+
+    while (data < end) {
+        c = *data++;
+        if (c < 0x80)
+            continue;
+        if (c >= 0xc2 && c <= 0xdf) {
+            continuation_count = 1;
+            code_point = c & 0x1f;
+        } else if (c >= 0xe0 && c <= 0xef) {
+            continuation_count = 2;
+            code_point = c & 0x0f;
+        } else if (c >= 0xf0 && c <= 0xf4) {
+            continuation_count = 3;
+            code_point = c & 0x07;
+        } else {
+            return 0;
+        }
+        if (end - data < continuation_count)
+            return 0;
+        for (i = 0; i < continuation_count; i++) {
+            c = *data++;
+            if ((c & 0xc0) != 0x80)
+                return 0;
+            code_point = (code_point << 6) | (c & 0x3f);
+        }
+        if ((continuation_count == 2 && code_point < 0x800)
+                || (continuation_count == 3 && code_point < 0x10000)
+                || (code_point >= 0xd800 && code_point <= 0xdfff)
+                || code_point > 0x10ffff)
+            return 0;
+    }
+    return 1;
+}
+
+static int msgpack_pack(msgpackBuffer *buffer, PyObject *obj, int depth);
+
+/*
+ * Packs repr(obj) as a MessagePack str. Used for objects MessagePack can't
+ * represent so that a message is never lost because of one of its values.
+ */
+static int
+msgpack_pack_repr(msgpackBuffer *buffer, PyObject *obj, int depth)
+{
+    PyObject *repr = PyObject_Repr(obj);
+    int result;
+
+    if (repr == NULL)
+        return -1;
+    result = msgpack_pack(buffer, repr, depth);
+    Py_DECREF(repr);
+    return result;
+}
+
+static int
+msgpack_pack_integer(msgpackBuffer *buffer, PyObject *obj, int depth)
+{
+    PY_LONG_LONG value;
+    unsigned PY_LONG_LONG unsigned_value;
+
+    if (PyInt_Check(obj)) {
+        value = PyInt_AS_LONG(obj);
+    } else {
+        value = PyLong_AsLongLong(obj);
+        if (value == -1 && PyErr_Occurred()) {
+            if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+                return -1;
+            PyErr_Clear();
+            unsigned_value = PyLong_AsUnsignedLongLong(obj);
+            if (unsigned_value == (unsigned PY_LONG_LONG)-1 && PyErr_Occurred()) {
+                // out of MessagePack integers range
+                PyErr_Clear();
+                return msgpack_pack_repr(buffer, obj, depth);
+            }
+            return msgpack_write_header(buffer, 0xcf, unsigned_value, 8);
+        }
+    }
+    if (value >= 0) {
+        if (value < 0x80)
+            return msgpack_write_header(buffer, (unsigned char)value, 0, 0);
+        if (value <= 0xff)
+            return msgpack_write_header(buffer, 0xcc, value, 1);
+        if (value <= 0xffff)
+            return msgpack_write_header(buffer, 0xcd, value, 2);
+        if (value <= 0xffffffffLL)
+            return msgpack_write_header(buffer, 0xce, value, 4);
+        return msgpack_write_header(buffer, 0xcf, value, 8);
+    }
+    if (value >= -0x20)
+        return msgpack_write_header(buffer, (unsigned char)(value & 0xff), 0, 0);
+    if (value >= -0x80)
+        return msgpack_write_header(buffer, 0xd0, value, 1);
+    if (value >= -0x8000)
+        return msgpack_write_header(buffer, 0xd1, value, 2);
+    if (value >= -0x80000000LL)
+        return msgpack_write_header(buffer, 0xd2, value, 4);
+    return msgpack_write_header(buffer, 0xd3, value, 8);
+}
+
+static int
+msgpack_pack(msgpackBuffer *buffer, PyObject *obj, int depth)
+{
+    Py_ssize_t i, length;
+
+    if (depth > MSGPACK_MAX_DEPTH) {
+        PyErr_SetString(PyExc_ValueError, "object is too deep for MessagePack");
+        return -1;
+    }
+    if (obj == Py_None)
+        return msgpack_write_header(buffer, 0xc0, 0, 0);
+    if (PyBool_Check(obj))
+        return msgpack_write_header(buffer, obj == Py_True ? 0xc3 : 0xc2, 0, 0);
+    if (PyInt_Check(obj) || PyLong_Check(obj))
+        return msgpack_pack_integer(buffer, obj, depth);
+    if (PyFloat_Check(obj)) {
+        unsigned char packed[9];
+
+        packed[0] = 0xcb;
+        if (_PyFloat_Pack8(PyFloat_AS_DOUBLE(obj), packed + 1, 0) == -1)
+            return -1;
+        return msgpack_write(buffer, packed, 9);
+    }
+    if (PyString_Check(obj)) {
+        const unsigned char *data = (unsigned char *)PyString_AS_STRING(obj);
+
+        length = PyString_GET_SIZE(obj);
+        if (msgpack_is_utf8(data, length)) {
+            if (msgpack_write_length(buffer, length, 0xa0, 32, 0xd9, 0xda, 0xdb) == -1)
+                return -1;
+        } else {
+            // not a text, packed as bin
+            if (msgpack_write_length(buffer, length, 0, 0, 0xc4, 0xc5, 0xc6) == -1)
+                return -1;
+        }
+        return msgpack_write(buffer, data, length);
+    }
+    if (PyUnicode_Check(obj)) {
+        PyObject *utf8 = PyUnicode_AsUTF8String(obj);
+        int result;
+
+        if (utf8 == NULL)
+            return -1;
+        result = msgpack_pack(buffer, utf8, depth);
+        Py_DECREF(utf8);
+        return result;
+    }
+    if (PyList_Check(obj) || PyTuple_Check(obj)) {
+        int is_list = PyList_Check(obj);
+
+        length = is_list ? PyList_GET_SIZE(obj) : PyTuple_GET_SIZE(obj);
+        if (msgpack_write_length(buffer, length, 0x90, 16, 0, 0xdc, 0xdd) == -1)
+            return -1;
+        // a list may be modified while packing its items
+        for (i = 0; i < (is_list ? PyList_GET_SIZE(obj) : length); i++) {
+            PyObject *item = is_list ? PyList_GET_ITEM(obj, i) : PyTuple_GET_ITEM(obj, i);
+            if (msgpack_pack(buffer, item, depth + 1) == -1)
+                return -1;
+        }
+        if (i != length) {
+            PyErr_SetString(PyExc_RuntimeError, "list changed size during packing");
+            return -1;
+        }
+        return 0;
+    }
+    if (PyDict_Check(obj)) {
+        PyObject *key, *value;
+        Py_ssize_t pos = 0;
+
+        length = PyDict_Size(obj);
+        if (msgpack_write_length(buffer, length, 0x80, 16, 0, 0xde, 0xdf) == -1)
+            return -1;
+        while (PyDict_Next(obj, &pos, &key, &value)) {
+            if (msgpack_pack(buffer, key, depth + 1) == -1
+                    || msgpack_pack(buffer, value, depth + 1) == -1)
+                return -1;
+        }
+        return 0;
+    }
+    return msgpack_pack_repr(buffer, obj, depth);
+}
+
+static PyObject *
+_ik_msgpack_pack(PyObject *self, PyObject *obj)
+{
+    msgpackBuffer buffer;
+    PyObject *result = NULL;
+
+    buffer.size = 0;
+    buffer.allocated = 4096;
+    buffer.data = PyMem_Malloc(buffer.allocated);
+    if (buffer.data == NULL)
+        return PyErr_NoMemory();
+    if (msgpack_pack(&buffer, obj, 0) == 0)
+        result = PyString_FromStringAndSize((char *)buffer.data, buffer.size);
+    PyMem_Free(buffer.data);
+    return result;
+}
+
+PyDoc_STRVAR(_ik_msgpack_pack_doc,
+"_msgpack_pack(obj)\n\
+\n\
+Returns obj packed as a MessagePack str. Supports None, bool, int, long,\n\
+float, str and unicode (as MessagePack str, or bin for str that are not\n\
+valid UTF-8), list, tuple and dict. Other objects and integers out of\n\
+MessagePack range are packed as their repr().\n\
+Raises ValueError on too large or too deep objects."
+);
+
+
 static PyMethodDef InoukMethods[] = {
     {"_set_trace_on", _ik_set_trace_on, METH_VARARGS, _ik_set_trace_on_doc},
-    {"_set_trace_off", (PyCFunction)_ik_set_trace_off, METH_NOARGS, _ik_set_trace_off_doc},
-    {NULL,           NULL}           /* sentinel */
+    {"_set_trace_off", _ik_set_trace_off, METH_VARARGS, _ik_set_trace_off_doc},
+    {"_set_breakpoints_resolver", _ik_set_breakpoints_resolver, METH_VARARGS, _ik_set_breakpoints_resolver_doc},
+    {"_clear_breakpoints_cache", _ik_clear_breakpoints_cache, METH_NOARGS, _ik_clear_breakpoints_cache_doc},
+    {"_set_step_state", _ik_set_step_state, METH_VARARGS, _ik_set_step_state_doc},
+    {"_set_exception_resolver", _ik_set_exception_resolver, METH_VARARGS, _ik_set_exception_resolver_doc},
+    {"_locals_to_fast", _ik_locals_to_fast, METH_O, _ik_locals_to_fast_doc},
+    {"_set_gated_tracing", _ik_set_gated_tracing, METH_VARARGS, _ik_set_gated_tracing_doc},
+    {"_call_untraced", _ik_call_untraced, METH_VARARGS, _ik_call_untraced_doc},
+    {"_set_stats_enabled", _ik_set_stats_enabled, METH_VARARGS, _ik_set_stats_enabled_doc},
+    {"_add_stats_stopped_time", _ik_add_stats_stopped_time, METH_VARARGS, _ik_add_stats_stopped_time_doc},
+    {"_get_stats", _ik_get_stats, METH_NOARGS, _ik_get_stats_doc},
+    {"_msgpack_pack", _ik_msgpack_pack, METH_O, _ik_msgpack_pack_doc},
+    {NULL,           NULL,           0,      NULL}   /* sentinel */
 };
 
 
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+#
+# This file is part of the IKPdb Debugger
+# Licence: MIT. See LICENCE at repository root
+#
+# Tests of IKCodePatcher used by the 'patch' breakpoints mode: functions of
+# a module imported through the import hook must call hook on patched lines
+# and get their original code back once lines are cleared.
+#
+# Run from repository root (with iksettrace built in place) using:
+#   python -m unittest discover -s tests -p "test_*.py"
+#
+import __builtin__
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ikpdb
+
+
+PATCHED_MODULE_SOURCE = """\
+import functools
+
+def add(a, b):
+    total = a + b
+    return total
+
+def logged(function):
+    @functools.wraps(function)
+    def wrapper(*args):
+        return function(*args)
+    return wrapper
+
+@logged
+def decorated(a):
+    return a * 2
+
+class Computer(object):
+    def compute(self, a):
+        return add(a, 1)
+"""
+ADD_LINE = 4
+DECORATED_LINE = 15
+COMPUTE_LINE = 19
+
+
+class IKCodePatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hits = []
+        self.directory = tempfile.mkdtemp()
+        self.module_name = 'ikpdb_patched_module_%s' % id(self)
+        self.file_name = os.path.join(self.directory, self.module_name + '.py')
+        with open(self.file_name, 'w') as module_file:
+            module_file.write(PATCHED_MODULE_SOURCE)
+        sys.path.insert(0, self.directory)
+        # hook is a constant of patched code objects so it must be hashable
+        def hook(line_number):
+            self.hits.append(line_number)
+        self.code_patcher = ikpdb.IKCodePatcher(hook, os.path.abspath)
+        self.code_patcher.install_import_hook()
+
+    def tearDown(self):
+        __builtin__.__import__ = self.code_patcher.original_import
+        sys.path.remove(self.directory)
+        sys.modules.pop(self.module_name, None)
+        shutil.rmtree(self.directory)
+
+    def import_module(self):
+        # through the import hook
+        return __import__(self.module_name)
+
+    def test_lines_patched_before_import(self):
+        self.code_patcher.set_patched_lines(self.file_name, [ADD_LINE])
+        module = self.import_module()
+        self.assertEqual(module.add(1, 2), 3)
+        self.assertEqual(self.hits, [ADD_LINE])
+
+    def test_lines_patched_after_import(self):
+        module = self.import_module()
+        original_co_codes = [function.func_code.co_code
+                             for function in (module.add, module.Computer.compute.im_func,)]
+        self.code_patcher.set_patched_lines(self.file_name,
+                                            [ADD_LINE, DECORATED_LINE, COMPUTE_LINE])
+        self.assertEqual(module.Computer().compute(1), 2)
+        self.assertEqual(module.decorated(2), 4)
+        self.assertEqual(self.hits, [COMPUTE_LINE, ADD_LINE, DECORATED_LINE])
+        self.assertNotEqual(module.add.func_code.co_code, original_co_codes[0])
+
+        # clearing lines restores original code
+        self.code_patcher.set_patched_lines(self.file_name, [])
+        self.assertEqual([function.func_code.co_code
+                          for function in (module.add, module.Computer.compute.im_func,)],
+                         original_co_codes)
+        self.assertEqual(module.Computer().compute(1), 2)
+        self.assertEqual(module.decorated(2), 4)
+        self.assertEqual(self.hits, [COMPUTE_LINE, ADD_LINE, DECORATED_LINE])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+#
+# This file is part of the IKPdb Debugger
+# Licence: MIT. See LICENCE at repository root
+#
+# Tests of IKPdbConnectionHandler messages parsing: messages are sent
+# through a socket pair and must be received as sent whatever the way they
+# are split between socket reads.
+#
+# Run from repository root (with iksettrace built in place) using:
+#   python -m unittest discover -s tests -p "test_*.py"
+#
+import json
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ikpdb
+
+
+class RunningDebugger(object):
+    """ Stands for the IKPdb instance passed to `receive()`. """
+    status = 'running'
+
+
+class IKPdbConnectionHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection, self.peer = socket.socketpair()
+        self.remote_client = ikpdb.IKPdbConnectionHandler(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+        self.peer.close()
+
+    def json_message(self, obj):
+        body = json.dumps(obj)
+        return ikpdb.IKPdbConnectionHandler.MESSAGE_TEMPLATE % (len(body), body,)
+
+    def receive(self):
+        return self.remote_client.receive(RunningDebugger())
+
+    def test_split_header(self):
+        message = self.json_message({'command': 'split'})
+        magic_code_idx = message.index(ikpdb.IKPdbConnectionHandler.MAGIC_CODE)
+        # split in 'length=', in length, in MAGIC_CODE then in body
+        for split_idx in (3, len('length=') + 1, magic_code_idx + 5, len(message) - 2,):
+            self.peer.sendall(message[:split_idx])
+            self.assertEqual(self.remote_client.parse_message(), None)
+            self.remote_client._received_end += self.connection.recv_into(
+                self.remote_client.get_receive_view())
+            self.peer.sendall(message[split_idx:])
+            self.assertEqual(self.receive(), {'command': 'split'})
+
+    def test_split_msgpack_length_prefix(self):
+        self.remote_client.encoding = 'msgpack'
+        message = self.remote_client.encode({'command': 'split'})
+        self.peer.sendall(message[:2])
+        self.remote_client._received_end += self.connection.recv_into(
+            self.remote_client.get_receive_view())
+        self.assertEqual(self.remote_client.parse_message(), None)
+        self.peer.sendall(message[2:])
+        self.assertEqual(self.receive(), {'command': 'split'})
+
+    def test_several_messages_in_one_read(self):
+        self.peer.sendall(''.join(self.json_message({'command': 'c%s' % i})
+                                  for i in range(3)))
+        self.assertEqual([self.receive() for i in range(3)],
+                         [{'command': 'c0'}, {'command': 'c1'}, {'command': 'c2'}])
+        self.assertEqual(self.remote_client._received_end, 0)
+
+    def test_long_message_grows_receive_buffer(self):
+        value = u'é' * (3 * ikpdb.IKPdbConnectionHandler.SOCKET_BUFFER_SIZE)
+        self.peer.sendall(self.json_message({'value': value})
+                          + self.json_message({'command': 'next'}))
+        self.assertEqual(self.receive(), {'value': value})
+        self.assertEqual(self.receive(), {'command': 'next'})
+
+    def test_invalid_header_then_valid_message(self):
+        self.peer.sendall('length=xx' + ikpdb.IKPdbConnectionHandler.MAGIC_CODE
+                          + self.json_message({'command': 'valid'}))
+        self.assertEqual(self.receive(), {'command': 'valid'})
+
+    def test_undecodable_body_then_valid_message(self):
+        body = '{not json'
+        self.peer.sendall(ikpdb.IKPdbConnectionHandler.MESSAGE_TEMPLATE % (len(body), body,)
+                          + self.json_message({'command': 'valid'}))
+        self.assertEqual(self.receive(), {'command': 'valid'})
+
+    def test_too_long_message_is_discarded(self):
+        self.remote_client.MAX_MESSAGE_LENGTH = 100
+        # body of the too long message looks like a message once it's first
+        # bytes are discarded
+        too_long_body = 'x' * 5000 + self.json_message({'command': 'inBody'})
+        self.peer.sendall(ikpdb.IKPdbConnectionHandler.MESSAGE_TEMPLATE %
+                          (len(too_long_body), too_long_body,))
+        self.peer.sendall(self.json_message({'command': 'next'}))
+        self.assertEqual(self.receive(), {'command': 'next'})
+
+    def test_too_long_msgpack_message_is_discarded(self):
+        self.remote_client.encoding = 'msgpack'
+        self.remote_client.MAX_MESSAGE_LENGTH = 100
+        message = self.remote_client.encode({'command': 'next'})
+        self.peer.sendall(self.remote_client.encode('x' * 5000 + message))
+        self.peer.sendall(message)
+        self.assertEqual(self.receive(), {'command': 'next'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# coding: utf-8
+
+#
+# This file is part of the IKPdb Debugger
+# Licence: MIT. See LICENCE at repository root
+#
+# Round-trip tests of the 'msgpack' encoding: objects packed by iksettrace
+# must be unpacked as is by IKMessagePack.
+#
+# Run from repository root (with iksettrace built in place) using:
+#   python -m unittest discover -s tests -p "test_*.py"
+#
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import iksettrace
+import ikpdb
+
+
+class MessagePackRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.message_pack = ikpdb.IKMessagePack()
+
+    def round_trip(self, obj):
+        return self.message_pack.unpack(iksettrace._msgpack_pack(obj))
+
+    def assertRoundTrip(self, obj, expected=None):
+        expected = obj if expected is None else expected
+        result = self.round_trip(obj)
+        self.assertEqual(result, expected)
+        self.assertEqual(type(result) is bool, type(expected) is bool)
+
+    def test_constants(self):
+        for obj in (None, True, False,):
+            self.assertIs(self.round_trip(obj), obj)
+
+    def test_integers(self):
+        # limits of each MessagePack integer format
+        for value in (0, 1, 0x7f, 0x80, 0xff, 0x100, 0xffff, 0x10000,
+                      0xffffffff, 0x100000000, 2 ** 63 - 1, 2 ** 63, 2 ** 64 - 1,
+                      -1, -0x20, -0x21, -0x80, -0x81, -0x8000, -0x8001,
+                      -0x80000000, -0x80000001, -2 ** 63, 5L):
+            self.assertRoundTrip(value)
+        packed_sizes = [len(iksettrace._msgpack_pack(value))
+                        for value in (0x7f, 0xff, 0xffff, 0xffffffff, 2 ** 64 - 1)]
+        self.assertEqual(packed_sizes, [1, 2, 3, 5, 9])
+
+    def test_integers_out_of_range(self):
+        # packed as their repr()
+        for value in (2 ** 64, -2 ** 63 - 1, 10 ** 100):
+            self.assertRoundTrip(value, unicode(repr(value)))
+        self.assertRoundTrip({'n': [2 ** 64]}, {u'n': [u'18446744073709551616L']})
+
+    def test_floats(self):
+        for value in (0.0, -0.0, 1.5, -3.25, 1e300, float('inf')):
+            self.assertRoundTrip(value)
+
+    def test_strings(self):
+        for length in (0, 31, 32, 0xff, 0x100, 0xffff, 0x10000):
+            self.assertRoundTrip('a' * length, u'a' * length)
+        self.assertRoundTrip(u'é€ \U0001f600')
+        self.assertRoundTrip(u'é€'.encode('utf8'), u'é€')
+
+    def test_binary(self):
+        for value in ('\xff\xfe', '\xc0\x80', '\xed\xa0\x80', '\xe9t\xe9',
+                      '\xff' * 0x100, '\xff' * 0x10000):
+            self.assertEqual(self.round_trip(value), value)
+            self.assertIs(type(self.round_trip(value)), str)
+
+    def test_containers(self):
+        for length in (0, 15, 16, 0xffff, 0x10000):
+            self.assertRoundTrip(range(length))
+            self.assertRoundTrip(dict((i, -i) for i in range(length)))
+        self.assertRoundTrip((1, 'a', None,), [1, u'a', None])
+        obj = {
+            'frames': [{'id': 1, 'f_locals': [{'name': 'x', 'value': '1'}]}],
+            'objects': {5: {'properties': []}},
+            'result': {'stopId': 3, 'ratio': 0.5, 'flags': [True, False]},
+        }
+        self.assertRoundTrip(obj)
+
+    def test_unsupported_types(self):
+        # packed as their repr()
+        self.assertRoundTrip(set([1]), u'set([1])')
+        self.assertRoundTrip([1, 1j], [1, u'1j'])
+        self.assertRoundTrip({'a': {'b': (Ellipsis,)}}, {u'a': {u'b': [u'Ellipsis']}})
+
+    def test_unrepresentable_objects(self):
+        class Unrepresentable(object):
+            def __repr__(self):
+                raise RuntimeError("no repr")
+        self.assertRaises(RuntimeError, iksettrace._msgpack_pack, [Unrepresentable()])
+        self.assertRaises(ValueError, iksettrace._msgpack_pack, 
+                          reduce(lambda obj, _: [obj], range(300), []))
+
+    def test_connection_encode(self):
+        connection, peer = socket.socketpair()
+        try:
+            remote_client = ikpdb.IKPdbConnectionHandler(connection)
+            remote_client.encoding = 'msgpack'
+            message = remote_client.encode({'value': [object, 2 ** 70]})
+            self.assertEqual(remote_client.BINARY_LENGTH_PREFIX.unpack_from(message)[0],
+                             len(message) - remote_client.BINARY_LENGTH_PREFIX.size)
+            self.assertEqual(remote_client.decode(message[remote_client.BINARY_LENGTH_PREFIX.size:]),
+                             {u'value': [u"<type 'object'>", u'1180591620717411303424L']})
+        finally:
+            connection.close()
+            peer.close()
+
+    def test_invalid_data(self):
+        packed = iksettrace._msgpack_pack([1, 2, 'abc'])
+        self.assertRaises(ValueError, self.message_pack.unpack, packed[:-1])
+        self.assertRaises(ValueError, self.message_pack.unpack, packed + '\x00')
+        self.assertRaises(ValueError, self.message_pack.unpack, '\xc1')
+
+
+if __name__ == '__main__':
+    unittest.main()
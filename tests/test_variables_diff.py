@@ -0,0 +1,112 @@
+# coding: utf-8
+
+#
+# This file is part of the IKPdb Debugger
+# Licence: MIT. See LICENCE at repository root
+#
+# Tests of frames variables diff (see IKPdb.diff_frame_variables()) between
+# stops in the same frame.
+#
+# Run from repository root (with iksettrace built in place) using:
+#   python -m unittest discover -s tests -p "test_*.py"
+#
+import os
+import sys
+import threading
+import Queue
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ikpdb
+
+
+def debugged_program(stop):
+    """ Program running in a thread which waits in `stop()` as a debugged 
+    thread does at each stop.
+    """
+    d = {'a': 1, 'b': [1, 2]}
+    lst = [1, 2, 3]
+    tpl = (1, 'x')
+    n = 1
+    stop()
+    stop()
+    n = 2
+    stop()
+    d = {'a': 1, 'b': [1, 2]}
+    stop()
+
+
+def run_program(stop):
+    debugged_program(stop)
+
+
+class VariablesDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.debugger = ikpdb.IKPdb(variables_diff=True)
+        self.stopped_q = Queue.Queue()
+        self.resume_q = Queue.Queue()
+        self.thread = threading.Thread(target=run_program, args=(self.wait,))
+        self.thread.start()
+        self.stopped_q.get()
+        self.frame = sys._current_frames()[self.thread.ident]
+        while self.frame.f_code is not debugged_program.__code__:
+            self.frame = self.frame.f_back
+        # Thread.run() frame plays the role of the module level frame
+        self.debugger.frame_beginning = self.frame.f_back.f_back.f_back
+
+    def tearDown(self):
+        while self.thread.is_alive():
+            self.resume_q.put(None)
+            self.thread.join(0.1)
+
+    def wait(self):
+        self.stopped_q.put(None)
+        self.resume_q.get()
+
+    def stop(self):
+        """ :return: top frame dumped at a new stop in debugged program. """
+        frames = self.debugger.dump_frames(self.frame)[0]
+        self.debugger.handles.release()
+        return frames[0]
+
+    def resume(self):
+        self.resume_q.put(None)
+        self.stopped_q.get()
+
+    def changed(self, remote_frame):
+        return sorted(var['name'] for var in remote_frame['f_locals_diff']['changed'])
+
+    def test_first_stop_is_complete(self):
+        remote_frame = self.stop()
+        self.assertNotIn('f_locals_diff', remote_frame)
+        self.assertTrue(set(['d', 'lst', 'tpl', 'n']) <= 
+                        set(var['name'] for var in remote_frame['f_locals']))
+
+    def test_unmodified_containers_are_not_changed(self):
+        first_frame = self.stop()
+        self.resume()
+        remote_frame = self.stop()
+        self.assertEqual(remote_frame['id'], first_frame['id'])
+        self.assertEqual(remote_frame['f_locals_diff'], 
+                         {'added': [], 'changed': [], 'removed': []})
+        # containers keep their handle so that client's variables remain valid
+        ids = dict((var['name'], var['id']) for var in first_frame['f_locals'])
+        for name in ('d', 'lst', 'tpl'):
+            self.assertEqual(self.debugger.handles.get_handle(self.frame.f_locals[name]), 
+                             ids[name])
+
+    def test_modified_variables_are_changed(self):
+        self.stop()
+        self.resume()
+        self.stop()
+        self.resume()
+        self.assertEqual(self.changed(self.stop()), ['n'])
+        self.resume()
+        # same value but another object
+        self.assertEqual(self.changed(self.stop()), ['d'])
+
+
+if __name__ == '__main__':
+    unittest.main()